@@ -0,0 +1,189 @@
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from main import metrics
+from main.config import config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+
+class Cache(ABC):
+    """Response cache with tagged entries, so writes drop exactly what they touch"""
+
+    def __init__(self) -> None:
+        self.stats = CacheStats()
+
+    @abstractmethod
+    async def get(self, key: str) -> Any | None: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, tags: Iterable[str] = ()) -> None: ...
+
+    @abstractmethod
+    async def invalidate(self, *tags: str) -> None: ...
+
+    @abstractmethod
+    async def clear(self) -> None: ...
+
+    def metrics(self) -> dict:
+        return asdict(self.stats)
+
+
+class MemoryCache(Cache):
+    """In-process LRU with a per-entry TTL"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, Any, tuple[str, ...]]] = (
+            OrderedDict()
+        )
+        self._tags: dict[str, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, key: str) -> None:
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    async def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self._drop(key)
+            self.stats.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any, tags: Iterable[str] = ()) -> None:
+        if key in self._entries:
+            self._drop(key)
+
+        tags = tuple(tags)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+    async def invalidate(self, *tags: str) -> None:
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+                self.stats.invalidations += 1
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self._tags.clear()
+
+    def metrics(self) -> dict:
+        return {
+            **super().metrics(),
+            "entries": len(self),
+            "max_entries": self.max_entries,
+        }
+
+
+class RedisCache(Cache):
+    """Cache shared between workers, stored in Redis with a set of keys per tag"""
+
+    def __init__(self, url: str, ttl_seconds: float, prefix: str = "cache:") -> None:
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError(
+                "CACHE_BACKEND=redis requires the 'redis' package to be installed"
+            ) from e
+
+        super().__init__()
+        self.client = redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Any | None:
+        value = await self.client.get(self.prefix + key)
+        if value is None:
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        return json.loads(value)
+
+    async def set(self, key: str, value: Any, tags: Iterable[str] = ()) -> None:
+        ttl = max(1, int(self.ttl_seconds))
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.set(self.prefix + key, json.dumps(value), ex=ttl)
+            for tag in tags:
+                pipe.sadd(f"{self.prefix}tag:{tag}", key)
+                pipe.expire(f"{self.prefix}tag:{tag}", ttl)
+            await pipe.execute()
+
+    async def invalidate(self, *tags: str) -> None:
+        for tag in tags:
+            tag_key = f"{self.prefix}tag:{tag}"
+            keys = await self.client.smembers(tag_key)
+            if keys:
+                await self.client.delete(*(self.prefix + k.decode() for k in keys))
+                self.stats.invalidations += len(keys)
+            await self.client.delete(tag_key)
+
+    async def clear(self) -> None:
+        async for key in self.client.scan_iter(match=f"{self.prefix}*"):
+            await self.client.delete(key)
+
+
+def create_cache() -> Cache:
+    if config.CACHE_BACKEND == "redis":
+        logger.info("Using Redis response cache")
+        return RedisCache(config.CACHE_REDIS_URL, config.CACHE_TTL_SECONDS)
+    return MemoryCache(config.CACHE_MAX_ENTRIES, config.CACHE_TTL_SECONDS)
+
+
+def post_tag(post_id: int) -> str:
+    return f"post:{post_id}"
+
+
+def comments_tag(post_id: int) -> str:
+    return f"comments:{post_id}"
+
+
+def user_tag(email: str) -> str:
+    return f"user:{email}"
+
+
+def feed_tag(sorting: str | None = None) -> str:
+    return f"feed:{sorting}" if sorting else "feed"
+
+
+response_cache = create_cache()
+metrics.register("response_cache", response_cache.metrics)
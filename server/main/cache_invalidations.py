@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+import logging
+from dataclasses import asdict, dataclass
+
+import sqlalchemy
+from databases import Database
+
+from main import metrics
+from main.cache import Cache, response_cache
+from main.config import config
+from main.database import cache_invalidation_table, database
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class InvalidationStats:
+    published: int = 0
+    applied: int = 0
+    failed_polls: int = 0
+
+
+def utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class InvalidationLog:
+    """Carries response cache invalidations between processes
+
+    A MemoryCache only lives in its own process, so invalidating it from the
+    job worker leaves the web processes serving stale pages. Published tags
+    are also written to the database, and each web process polls for the
+    rows after the last one it saw and invalidates its own cache. Rows older
+    than startup are skipped, since the cache starts out empty.
+    """
+
+    def __init__(self, database: Database, cache: Cache, poll_interval: float) -> None:
+        self.database = database
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self.stats = InvalidationStats()
+        self._last_id = 0
+        self._stopping = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        query = sqlalchemy.select(sqlalchemy.func.max(cache_invalidation_table.c.id))
+        self._last_id = await self.database.fetch_val(query) or 0
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+
+    async def publish(self, *tags: str) -> None:
+        """Invalidate `tags` in this process's cache and in every web process's"""
+        await self.cache.invalidate(*tags)
+
+        now = utcnow()
+        await self.database.execute(
+            cache_invalidation_table.insert().values(
+                [{"tag": tag, "created_at": now} for tag in tags]
+            )
+        )
+        # Listeners only need rows from their last poll on
+        cutoff = now - datetime.timedelta(
+            seconds=config.CACHE_INVALIDATION_RETENTION_SECONDS
+        )
+        await self.database.execute(
+            cache_invalidation_table.delete().where(
+                cache_invalidation_table.c.created_at < cutoff
+            )
+        )
+        self.stats.published += len(tags)
+
+    async def poll(self) -> int:
+        """Apply invalidations published since the last poll, returning how many"""
+        query = (
+            cache_invalidation_table.select()
+            .where(cache_invalidation_table.c.id > self._last_id)
+            .order_by(cache_invalidation_table.c.id)
+        )
+        rows = await self.database.fetch_all(query)
+        if not rows:
+            return 0
+
+        await self.cache.invalidate(*{row.tag for row in rows})
+        self._last_id = rows[-1].id
+        self.stats.applied += len(rows)
+        return len(rows)
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=self.poll_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.poll()
+            except Exception:
+                # Entries still expire after CACHE_TTL_SECONDS; try again next poll
+                self.stats.failed_polls += 1
+                logger.exception("Failed to poll cache invalidations")
+
+    def metrics(self) -> dict:
+        return asdict(self.stats)
+
+
+invalidation_log = InvalidationLog(
+    database, response_cache, poll_interval=config.CACHE_INVALIDATION_POLL_SECONDS
+)
+metrics.register("cache_invalidations", invalidation_log.metrics)
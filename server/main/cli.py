@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import logging
+
+import sqlalchemy
+from databases import Database
+
+from main import migrations
+from main.config import config
+from main.database import database, like_table, post_table, refresh_token_table
+from main.jobs import utcnow
+from main.logging_conf import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+def counted_likes():
+    return (
+        sqlalchemy.select(sqlalchemy.func.count(like_table.c.id))
+        .where(like_table.c.post_id == post_table.c.id)
+        .scalar_subquery()
+    )
+
+
+async def reconcile_like_counts(database: Database) -> int:
+    """Recompute posts.like_count from the likes table, returning the drifted posts"""
+    drifted_query = (
+        sqlalchemy.select(sqlalchemy.func.count())
+        .select_from(post_table)
+        .where(post_table.c.like_count != counted_likes())
+    )
+    drifted = await database.fetch_val(drifted_query)
+    logger.info(f"Found {drifted} posts with a drifted like count")
+
+    if drifted:
+        query = (
+            post_table.update()
+            .where(post_table.c.like_count != counted_likes())
+            .values(like_count=counted_likes())
+        )
+        logger.debug(query)
+        await database.execute(query)
+
+    return drifted
+
+
+async def prune_refresh_tokens(database: Database) -> int:
+    """Delete expired refresh tokens, returning how many were deleted
+
+    Revoked tokens are kept until they expire, since presenting one again is
+    how token reuse is detected.
+    """
+    expired = refresh_token_table.c.expires_at < utcnow()
+    count_query = (
+        sqlalchemy.select(sqlalchemy.func.count())
+        .select_from(refresh_token_table)
+        .where(expired)
+    )
+    pruned = await database.fetch_val(count_query)
+    if pruned:
+        await database.execute(refresh_token_table.delete().where(expired))
+    logger.info(f"Pruned {pruned} expired refresh tokens")
+    return pruned
+
+
+async def with_database(coroutine_function):
+    await database.connect()
+    try:
+        return await coroutine_function(database)
+    finally:
+        await database.disconnect()
+
+
+def reconcile_likes_command(args: argparse.Namespace):
+    asyncio.run(with_database(reconcile_like_counts))
+
+
+def prune_refresh_tokens_command(args: argparse.Namespace):
+    asyncio.run(with_database(prune_refresh_tokens))
+
+
+def migrate_command(args: argparse.Namespace):
+    engine = migrations.create_engine(config.DATABASE_URL)
+    if args.status:
+        for version, name in migrations.pending(engine):
+            print(f"pending {version:04d} {name}")
+        return
+
+    applied = migrations.upgrade(engine)
+    logger.info(f"Applied {len(applied)} migrations")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m main.cli")
+    subparsers = parser.add_subparsers(required=True)
+
+    reconcile_parser = subparsers.add_parser(
+        "reconcile-likes", help="Backfill posts.like_count from the likes table"
+    )
+    reconcile_parser.set_defaults(handler=reconcile_likes_command)
+
+    prune_parser = subparsers.add_parser(
+        "prune-refresh-tokens",
+        help="Delete expired refresh tokens; run it periodically, e.g. from cron",
+    )
+    prune_parser.set_defaults(handler=prune_refresh_tokens_command)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Create or upgrade the database schema"
+    )
+    migrate_parser.add_argument(
+        "--status", action="store_true", help="List pending migrations and exit"
+    )
+    migrate_parser.set_defaults(handler=migrate_command)
+
+    args = parser.parse_args(argv)
+    configure_logging()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
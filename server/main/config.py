@@ -13,6 +13,11 @@ class BaseConfig(BaseSettings):
 class GlobalConfig(BaseConfig):
     DATABASE_URL: Optional[str] = None
     DB_FORCE_ROLL_BACK: bool = False
+    DB_POOL_MIN_SIZE: int = 2  # connections opened and pinged at startup
+    DB_POOL_MAX_SIZE: int = 10  # per process, so per web or job worker
+    DB_POOL_ACQUIRE_TIMEOUT_SECONDS: float = 10
+    DB_POOL_WARM_UP: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100  # 0 behind pgbouncer in transaction mode
     LOGTAIL_API_KEY: Optional[str] = None
     MAILGUN_DOMAIN: Optional[str] = None
     MAILGUN_API_KEY: Optional[str] = None
@@ -22,6 +27,68 @@ class GlobalConfig(BaseConfig):
     B2_BUCKET_NAME: Optional[str] = None
     DEEPAI_API_KEY: Optional[str] = None
     SENTRY_DSN: Optional[str] = None
+    CACHE_BACKEND: str = "memory"  # "memory" or "redis"
+    CACHE_REDIS_URL: str | None = None
+    CACHE_MAX_ENTRIES: int = 1024
+    CACHE_TTL_SECONDS: float = 30
+    CACHE_INVALIDATION_POLL_SECONDS: float = 1
+    CACHE_INVALIDATION_RETENTION_SECONDS: float = 3600
+    LIKE_WRITE_BEHIND: bool = False
+    LIKE_DURABILITY: str = "buffered"  # "buffered" or "flushed"
+    LIKE_BATCH_SIZE: int = 500
+    LIKE_FLUSH_INTERVAL_SECONDS: float = 0.5
+    LIKE_MAX_PENDING: int = 10000
+    PASSWORD_HASH_WORKERS: int = 4
+    USER_CACHE_MAX_ENTRIES: int = 10000
+    USER_CACHE_TTL_SECONDS: float = 60
+    TOKEN_CACHE_MAX_ENTRIES: int = 10000
+    HTTP_MAX_CONNECTIONS: int = 20
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 30
+    HTTP2: bool = False
+    MAILGUN_TIMEOUT_SECONDS: float = 10
+    DEEPAI_TIMEOUT_SECONDS: float = 60
+    JOB_POLL_INTERVAL_SECONDS: float = 1
+    JOB_EMAIL_CONCURRENCY: int = 1000  # jobs mostly wait on the email batcher
+    EMAIL_BATCH_WINDOW_SECONDS: float = 1
+    EMAIL_BATCH_SIZE: int = 1000
+    IMAGE_CACHE_MAX_ENTRIES: int = 1000
+    IMAGE_CACHE_TTL_SECONDS: float = 86400
+    IMAGE_MIRROR: bool = False  # copy generated images into our storage
+    IMAGE_MIRROR_MAX_BYTES: int = 20 * 1024 * 1024
+    IMAGE_DERIVATIVES: bool = False  # needs the optional Pillow package
+    IMAGE_WORKERS: int = 2
+    IMAGE_THUMBNAIL_SIZE: int = 256
+    IMAGE_MEDIUM_SIZE: int = 1024
+    IMAGE_QUALITY: int = 80
+    JOB_IMAGE_CONCURRENCY: int = 4
+    MAILGUN_MAX_CONCURRENCY: int = 20
+    MAILGUN_LATENCY_TARGET_SECONDS: float = 2
+    DEEPAI_MAX_CONCURRENCY: int = 8
+    DEEPAI_LATENCY_TARGET_SECONDS: float = 20
+    UPSTREAM_FAILURE_THRESHOLD: int = 5
+    UPSTREAM_RESET_TIMEOUT_SECONDS: float = 30
+    UPSTREAM_MAX_QUEUED: int = 100
+    UPSTREAM_MAX_RETRIES: int = 2
+    UPSTREAM_RETRY_BACKOFF_SECONDS: float = 0.5
+    UPSTREAM_RETRY_BUDGET_RATIO: float = 0.2  # retries per first attempt
+    UPSTREAM_RETRY_BUDGET_MAX: float = 10
+    UPLOAD_CONCURRENCY: int = 4
+    UPLOAD_MAX_QUEUED: int = 16  # uploads waiting for the pool before a 503
+    UPLOAD_RETRY_AFTER_SECONDS: int = 5
+    UPLOAD_BATCH_MAX_FILES: int = 50
+    UPLOAD_BATCH_CONCURRENCY: int = 4
+    STORAGE_BACKEND: str = "b2"  # "b2" or "local"
+    LOCAL_STORAGE_PATH: str = "./storage"
+    LOCAL_STORAGE_BASE_URL: str = "http://localhost:8000/files"
+    UPLOAD_STREAMING: bool = False  # stream to B2's native API, no temp file
+    B2_PART_SIZE: int = 8 * 1024 * 1024  # B2's minimum part size is 5MB
+    B2_UPLOAD_BUFFERS: int = 8  # parts held in memory across all uploads
+    B2_REAUTHORIZE_SECONDS: float = 20 * 3600  # tokens are valid for 24 hours
+    B2_UPLOAD_KEY_SECONDS: int = 3600  # lifetime of keys for direct uploads
+    B2_TIMEOUT_SECONDS: float = 120
+    B2_MAX_CONCURRENCY: int = 16
+    B2_LATENCY_TARGET_SECONDS: float = 30
 
 
 class DevConfig(GlobalConfig):
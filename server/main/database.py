@@ -1,5 +1,6 @@
 import databases
 import sqlalchemy
+from sqlalchemy.dialects import postgresql, sqlite
 
 from main.config import config
 
@@ -12,8 +13,19 @@ post_table = sqlalchemy.Table(
     sqlalchemy.Column("body", sqlalchemy.String),
     sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
     sqlalchemy.Column("image_url", sqlalchemy.String),
+    sqlalchemy.Column("thumbnail_url", sqlalchemy.String),
+    sqlalchemy.Column("medium_url", sqlalchemy.String),
+    sqlalchemy.Column(
+        "like_count", sqlalchemy.Integer, nullable=False, server_default="0"
+    ),
 )
 
+# Serves the most_likes feed ordering without sorting an aggregate
+sqlalchemy.Index(
+    "ix_posts_like_count_id", post_table.c.like_count.desc(), post_table.c.id.desc()
+)
+sqlalchemy.Index("ix_posts_user_id", post_table.c.user_id)
+
 user_table = sqlalchemy.Table(
     "users",
     metadata,
@@ -32,6 +44,8 @@ comment_table = sqlalchemy.Table(
     sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
 )
 
+sqlalchemy.Index("ix_comments_post_id", comment_table.c.post_id)
+
 like_table = sqlalchemy.Table(
     "likes",
     metadata,
@@ -40,10 +54,108 @@ like_table = sqlalchemy.Table(
     sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
 )
 
-connect_args = {"check_same_thread": False} if "sqlite" in config.DATABASE_URL else {}
-engine = sqlalchemy.create_engine(config.DATABASE_URL, connect_args=connect_args)
+# A user can like a post once, which makes retried likes a no-op. It also
+# serves lookups by user_id, so that column needs no index of its own.
+sqlalchemy.Index(
+    "ux_likes_user_id_post_id", like_table.c.user_id, like_table.c.post_id, unique=True
+)
+sqlalchemy.Index("ix_likes_post_id", like_table.c.post_id)
+
+refresh_token_table = sqlalchemy.Table(
+    "refresh_tokens",
+    metadata,
+    sqlalchemy.Column("jti", sqlalchemy.String, primary_key=True),
+    sqlalchemy.Column("email", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("expires_at", sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Column("revoked", sqlalchemy.Boolean, nullable=False, default=False),
+)
+
+sqlalchemy.Index("ix_refresh_tokens_email", refresh_token_table.c.email)
+
+job_table = sqlalchemy.Table(
+    "jobs",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("type", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("payload", sqlalchemy.Text, nullable=False),  # JSON
+    sqlalchemy.Column("status", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("attempts", sqlalchemy.Integer, nullable=False, default=0),
+    sqlalchemy.Column("run_at", sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Column("locked_until", sqlalchemy.DateTime),
+    sqlalchemy.Column("lock_token", sqlalchemy.String),  # set by each claim
+    sqlalchemy.Column("last_error", sqlalchemy.Text),
+)
+
+sqlalchemy.Index(
+    "ix_jobs_type_status_run_at",
+    job_table.c.type,
+    job_table.c.status,
+    job_table.c.run_at,
+)
+
+# Uploaded files by content hash, so identical uploads reuse the stored file
+upload_table = sqlalchemy.Table(
+    "uploads",
+    metadata,
+    sqlalchemy.Column("sha256", sqlalchemy.String, primary_key=True),
+    sqlalchemy.Column("size", sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.Column("file_url", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("file_name", sqlalchemy.String),
+    sqlalchemy.Column("created_at", sqlalchemy.DateTime, nullable=False),
+)
+
+direct_upload_table = sqlalchemy.Table(
+    "direct_uploads",
+    metadata,
+    sqlalchemy.Column("file_id", sqlalchemy.String, primary_key=True),
+    sqlalchemy.Column("file_name", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("user_id", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("size", sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.Column("content_sha1", sqlalchemy.String),
+    sqlalchemy.Column("file_url", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("created_at", sqlalchemy.DateTime, nullable=False),
+)
+
+sqlalchemy.Index("ix_direct_uploads_user_id", direct_upload_table.c.user_id)
+
+# Tags the job worker invalidated, polled by web processes for their own caches
+cache_invalidation_table = sqlalchemy.Table(
+    "cache_invalidations",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("tag", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("created_at", sqlalchemy.DateTime, nullable=False),
+)
+
+
+def pool_options(url: str | None) -> dict:
+    """asyncpg pool settings; SQLite opens a connection per acquire instead"""
+    if url is None or databases.DatabaseURL(url).dialect != "postgresql":
+        return {}
+    return {
+        "min_size": config.DB_POOL_MIN_SIZE,
+        "max_size": config.DB_POOL_MAX_SIZE,
+        "statement_cache_size": config.DB_STATEMENT_CACHE_SIZE,
+    }
+
 
-metadata.create_all(engine)
+# The schema is created and upgraded by main.migrations, not at import
 database = databases.Database(
-    config.DATABASE_URL, force_rollback=config.DB_FORCE_ROLL_BACK
+    config.DATABASE_URL,
+    force_rollback=config.DB_FORCE_ROLL_BACK,
+    **pool_options(config.DATABASE_URL),
 )
+
+
+def insert_ignore(table: sqlalchemy.Table, *index_elements: str):
+    """INSERT ... ON CONFLICT DO NOTHING for the configured database"""
+    dialect = postgresql if database.url.dialect == "postgresql" else sqlite
+    return dialect.insert(table).on_conflict_do_nothing(index_elements=index_elements)
+
+
+def update_like_count(post_id: int, delta: int):
+    return (
+        post_table.update()
+        .where(post_table.c.id == post_id)
+        .values(like_count=post_table.c.like_count + delta)
+    )
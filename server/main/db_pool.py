@@ -0,0 +1,108 @@
+import asyncio
+import inspect
+import logging
+import time
+from dataclasses import asdict, dataclass
+
+from databases import Database
+
+from main import metrics
+from main.config import config
+from main.database import database
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PoolStats:
+    acquired: int = 0
+    timeouts: int = 0
+    in_use: int = 0
+    acquire_seconds_total: float = 0.0
+    acquire_seconds_max: float = 0.0
+    warm_up_seconds: float | None = None
+
+
+pool_stats = PoolStats()
+
+
+def instrument(database: Database) -> None:
+    """Time connection acquires and count connections in use
+
+    The databases client has no pool hooks or acquire timeout, so both are
+    added by wrapping the backend pool's acquire and release. asyncpg's
+    acquire takes the timeout itself, which puts back a connection handed
+    over just as the timeout fires; wait_for would drop it.
+    """
+    pool = getattr(database._backend, "_pool", None)
+    if pool is None or getattr(pool, "_instrumented", False):
+        return
+    acquire, release = pool.acquire, pool.release
+    takes_timeout = "timeout" in inspect.signature(acquire).parameters
+
+    async def timed_acquire():
+        started = time.perf_counter()
+        timeout = config.DB_POOL_ACQUIRE_TIMEOUT_SECONDS
+        try:
+            if takes_timeout:
+                connection = await acquire(timeout=timeout)
+            else:
+                connection = await asyncio.wait_for(acquire(), timeout)
+        except asyncio.TimeoutError:
+            pool_stats.timeouts += 1
+            logger.warning("Timed out waiting for a database connection")
+            raise
+
+        seconds = time.perf_counter() - started
+        pool_stats.acquired += 1
+        pool_stats.in_use += 1
+        pool_stats.acquire_seconds_total += seconds
+        pool_stats.acquire_seconds_max = max(pool_stats.acquire_seconds_max, seconds)
+        return connection
+
+    async def counted_release(connection, *args, **kwargs):
+        pool_stats.in_use -= 1
+        return await release(connection, *args, **kwargs)
+
+    pool.acquire, pool.release = timed_acquire, counted_release
+    pool._instrumented = True
+
+
+async def warm_up(database: Database, connections: int) -> None:
+    """Open and ping `connections` connections at once, failing if one fails"""
+    started = time.perf_counter()
+    # gather runs each ping in its own task, and so on its own connection
+    await asyncio.gather(*(database.fetch_val("SELECT 1") for _ in range(connections)))
+    pool_stats.warm_up_seconds = time.perf_counter() - started
+    logger.info(
+        f"Warmed up {connections} database connections "
+        f"in {pool_stats.warm_up_seconds:.3f}s"
+    )
+
+
+async def connect(database: Database) -> None:
+    await database.connect()
+    instrument(database)
+    if config.DB_POOL_WARM_UP:
+        await warm_up(database, min(config.DB_POOL_MIN_SIZE, config.DB_POOL_MAX_SIZE))
+
+
+def pool_metrics() -> dict:
+    snapshot = {
+        **asdict(pool_stats),
+        "backend": database.url.dialect,
+        "min_size": config.DB_POOL_MIN_SIZE,
+        "max_size": config.DB_POOL_MAX_SIZE,
+    }
+    # asyncpg keeps idle connections open; SQLite opens one per acquire
+    pool = getattr(database._backend, "_pool", None)
+    if hasattr(pool, "get_idle_size"):
+        snapshot["connections"] = pool.get_size()
+        snapshot["idle"] = pool.get_idle_size()
+    else:
+        snapshot["connections"] = pool_stats.in_use
+        snapshot["idle"] = 0
+    return snapshot
+
+
+metrics.register("db_pool", pool_metrics)
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+from dataclasses import asdict, dataclass
+
+from main import metrics, tasks
+from main.config import config
+
+logger = logging.getLogger(__name__)
+
+Template = tuple[str, str]  # (subject, body)
+
+# Refusals that say nothing about the recipients, so splitting would not help
+UNSPLITTABLE_STATUSES = {401, 403, 429}
+
+
+def rejected_recipients(error: Exception) -> bool:
+    """Whether Mailgun refused the request itself, e.g. over a malformed address"""
+    if not isinstance(error, tasks.APIResponseError) or error.status_code is None:
+        return False
+    status_code = error.status_code
+    return 400 <= status_code < 500 and status_code not in UNSPLITTABLE_STATUSES
+
+
+@dataclass
+class EmailBatcherStats:
+    messages: int = 0
+    batches: int = 0
+    failed: int = 0
+    split: int = 0  # rejected batches retried one recipient at a time
+
+
+class EmailBatcher:
+    """Groups messages that share a template into Mailgun batch sends
+
+    The first message for a template opens a window of `window` seconds. The
+    batch is sent when the window closes or when it reaches `max_batch`
+    recipients, and each caller's `send` returns once its batch was accepted.
+    If Mailgun rejects a batch, its messages are sent one by one so that a
+    bad address only fails its own message.
+    """
+
+    def __init__(self, window: float, max_batch: int) -> None:
+        self.window = window
+        self.max_batch = min(max_batch, tasks.MAILGUN_MAX_RECIPIENTS)
+        self.stats = EmailBatcherStats()
+        self._pending: dict[Template, dict[str, tuple[dict, asyncio.Future]]] = {}
+        self._timers: dict[Template, asyncio.Task] = {}
+
+    async def send(self, to: str, subject: str, body: str, variables: dict) -> None:
+        template = (subject, body)
+        batch = self._pending.setdefault(template, {})
+        if to in batch:
+            # Mailgun keys recipient variables by address, so a repeat joins it
+            _, future = batch[to]
+        else:
+            future = asyncio.get_running_loop().create_future()
+        batch[to] = (variables, future)
+
+        if len(batch) >= self.max_batch:
+            await self.flush(template)
+        elif template not in self._timers:
+            self._timers[template] = asyncio.create_task(self._flush_later(template))
+
+        await asyncio.shield(future)
+
+    async def _flush_later(self, template: Template) -> None:
+        await asyncio.sleep(self.window)
+        self._timers.pop(template, None)
+        await self.flush(template)
+
+    async def flush(self, template: Template) -> None:
+        timer = self._timers.pop(template, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+
+        batch = self._pending.pop(template, None)
+        if not batch:
+            return
+
+        subject, body = template
+        recipient_variables = {to: variables for to, (variables, _) in batch.items()}
+        try:
+            await tasks.send_batch_email(recipient_variables, subject, body)
+        except Exception as e:
+            if len(batch) > 1 and rejected_recipients(e):
+                logger.warning(
+                    f"Mailgun rejected a batch of {len(batch)} emails,"
+                    " sending them one by one"
+                )
+                self.stats.split += 1
+                await self._send_each(template, batch)
+                return
+            logger.exception(f"Failed to send batch of {len(batch)} emails")
+            self.stats.failed += len(batch)
+            for _, future in batch.values():
+                future.set_exception(e)
+        else:
+            self.stats.messages += len(batch)
+            self.stats.batches += 1
+            for _, future in batch.values():
+                future.set_result(None)
+
+    async def _send_each(
+        self, template: Template, batch: dict[str, tuple[dict, asyncio.Future]]
+    ) -> None:
+        subject, body = template
+        semaphore = asyncio.Semaphore(config.MAILGUN_MAX_CONCURRENCY)
+
+        async def send_one(to: str, variables: dict, future: asyncio.Future):
+            async with semaphore:
+                try:
+                    await tasks.send_batch_email({to: variables}, subject, body)
+                except Exception as e:
+                    logger.exception(f"Failed to send email to {to}")
+                    self.stats.failed += 1
+                    future.set_exception(e)
+                else:
+                    self.stats.messages += 1
+                    future.set_result(None)
+
+        await asyncio.gather(
+            *(
+                send_one(to, variables, future)
+                for to, (variables, future) in batch.items()
+            )
+        )
+
+    async def flush_all(self) -> None:
+        for template in list(self._pending):
+            await self.flush(template)
+
+    def metrics(self) -> dict:
+        pending = sum(len(batch) for batch in self._pending.values())
+        return {**asdict(self.stats), "pending": pending}
+
+
+email_batcher = EmailBatcher(
+    window=config.EMAIL_BATCH_WINDOW_SECONDS, max_batch=config.EMAIL_BATCH_SIZE
+)
+metrics.register("email_batcher", email_batcher.metrics)
@@ -0,0 +1,114 @@
+import logging
+from dataclasses import dataclass
+
+import httpx
+
+from main import metrics
+from main.config import config
+
+logger = logging.getLogger(__name__)
+
+
+# Statuses that mean the upstream did not handle the request, so it is safe to
+# send again even for non-idempotent calls like sending an email
+UNHANDLED_STATUSES = frozenset({429, 503})
+# A gateway error can come back after the upstream acted on the request, so
+# only upstreams whose calls are safe to repeat retry these too
+GATEWAY_STATUSES = frozenset({502, 504})
+
+
+@dataclass
+class Upstream:
+    base_url: str
+    timeout: float
+    max_concurrency: int
+    latency_target: float  # seconds; slower calls lower the concurrency limit
+    retry_statuses: frozenset[int] = UNHANDLED_STATUSES
+
+
+UPSTREAMS = {
+    "mailgun": Upstream(
+        "https://api.mailgun.net/v3",
+        config.MAILGUN_TIMEOUT_SECONDS,
+        config.MAILGUN_MAX_CONCURRENCY,
+        config.MAILGUN_LATENCY_TARGET_SECONDS,
+    ),
+    "deepai": Upstream(
+        "https://api.deepai.org",
+        config.DEEPAI_TIMEOUT_SECONDS,
+        config.DEEPAI_MAX_CONCURRENCY,
+        config.DEEPAI_LATENCY_TARGET_SECONDS,
+        # A repeated generation only costs a call, and downloads are GETs
+        retry_statuses=UNHANDLED_STATUSES | GATEWAY_STATUSES,
+    ),
+    # B2 hands out per-account API and upload hosts, so calls use absolute URLs
+    "b2": Upstream(
+        "https://api.backblazeb2.com",
+        config.B2_TIMEOUT_SECONDS,
+        config.B2_MAX_CONCURRENCY,
+        config.B2_LATENCY_TARGET_SECONDS,
+    ),
+}
+
+_clients: dict[str, httpx.AsyncClient] = {}
+_requests: dict[str, int] = {}
+
+
+def create_client(name: str) -> httpx.AsyncClient:
+    upstream = UPSTREAMS[name]
+
+    async def count_request(request: httpx.Request) -> None:
+        _requests[name] = _requests.get(name, 0) + 1
+
+    return httpx.AsyncClient(
+        base_url=upstream.base_url,
+        timeout=upstream.timeout,
+        limits=httpx.Limits(
+            max_connections=config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        http2=config.HTTP2,  # needs the optional h2 package
+        event_hooks={"request": [count_request]},
+    )
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Shared client for an upstream, so calls reuse its pooled connections"""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        logger.debug(f"Creating HTTP client for {name}")
+        client = _clients[name] = create_client(name)
+    return client
+
+
+async def start() -> None:
+    for name in UPSTREAMS:
+        get_client(name)
+
+
+async def close() -> None:
+    for name, client in list(_clients.items()):
+        logger.debug(f"Closing HTTP client for {name}")
+        await client.aclose()
+    _clients.clear()
+
+
+def pool_metrics() -> dict:
+    snapshot = {}
+    for name, client in _clients.items():
+        # httpx has no public pool stats, so read them from the httpcore pool
+        pool = getattr(client._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for connection in connections if connection.is_idle())
+        snapshot[name] = {
+            "requests": _requests.get(name, 0),
+            "connections": len(connections),
+            "active": len(connections) - idle,
+            "idle": idle,
+            "max_connections": config.HTTP_MAX_CONNECTIONS,
+        }
+    return snapshot
+
+
+metrics.register("http_clients", pool_metrics)
@@ -0,0 +1,151 @@
+import asyncio
+import io
+import logging
+import mimetypes
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import PurePosixPath
+from urllib.parse import urlsplit
+
+from main import metrics
+from main.config import config
+from main.http_clients import get_client
+from main.resilience import guard
+from main.storage import storage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ImageStats:
+    mirrored: int = 0
+    bytes_downloaded: int = 0
+    derivatives: int = 0
+    derivative_bytes: int = 0
+
+
+image_stats = ImageStats()
+metrics.register("images", lambda: asdict(image_stats))
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def derivative_sizes() -> dict[str, int]:
+    return {
+        "thumbnail": config.IMAGE_THUMBNAIL_SIZE,
+        "medium": config.IMAGE_MEDIUM_SIZE,
+    }
+
+
+def resize_image(data: bytes, max_size: int, quality: int) -> bytes:
+    """JPEG of the image scaled to fit in `max_size` pixels, run in a worker"""
+    try:
+        from PIL import Image
+    except ImportError as e:
+        raise RuntimeError(
+            "IMAGE_DERIVATIVES requires the 'Pillow' package to be installed"
+        ) from e
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.convert("RGB").save(
+            output, "JPEG", quality=quality, optimize=True, progressive=True
+        )
+    return output.getvalue()
+
+
+def image_executor() -> ProcessPoolExecutor:
+    # Resizing is CPU bound, so it runs in processes created on first use. They
+    # come from a fork server, since forking this process with its upload and
+    # hashing threads running could copy a held lock and deadlock
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=config.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+    return _executor
+
+
+async def create_derivatives(data: bytes) -> dict[str, bytes]:
+    loop = asyncio.get_running_loop()
+    sizes = derivative_sizes()
+    resized = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                image_executor(), resize_image, data, size, config.IMAGE_QUALITY
+            )
+            for size in sizes.values()
+        )
+    )
+    return dict(zip(sizes, resized))
+
+
+async def download_image(url: str) -> tuple[bytes, str | None]:
+    """Image bytes and content type, refusing more than IMAGE_MIRROR_MAX_BYTES
+
+    The body is streamed so an oversized image is dropped before it is read in.
+    """
+    client = get_client("deepai")
+    request = client.build_request("GET", url)
+    response = await guard("deepai").call(client.send, request, stream=True)
+    too_large = ValueError(f"Image at {url} is larger than IMAGE_MIRROR_MAX_BYTES")
+    try:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        if length is not None and int(length) > config.IMAGE_MIRROR_MAX_BYTES:
+            raise too_large
+
+        chunks, size = [], 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > config.IMAGE_MIRROR_MAX_BYTES:
+                raise too_large
+            chunks.append(chunk)
+    finally:
+        await response.aclose()
+
+    image_stats.bytes_downloaded += size
+    return b"".join(chunks), response.headers.get("Content-Type")
+
+
+async def mirror_image(url: str, post_id: int) -> dict[str, str]:
+    """Copy a generated image into our storage, with resized derivatives
+
+    Returns the post columns to set: image_url, and thumbnail_url and
+    medium_url when IMAGE_DERIVATIVES is on.
+    """
+    data, content_type = await download_image(url)
+    media_type = (content_type or "").split(";")[0].strip()
+    extension = (
+        mimetypes.guess_extension(media_type)
+        or PurePosixPath(urlsplit(url).path).suffix
+    )
+    files = {"image_url": (data, f"posts/{post_id}/image{extension}", content_type)}
+
+    if config.IMAGE_DERIVATIVES:
+        for name, resized in (await create_derivatives(data)).items():
+            image_stats.derivatives += 1
+            image_stats.derivative_bytes += len(resized)
+            files[f"{name}_url"] = (
+                resized,
+                f"posts/{post_id}/{name}.jpg",
+                "image/jpeg",
+            )
+
+    stored = await asyncio.gather(
+        *(storage.upload_bytes(*file) for file in files.values())
+    )
+    urls = dict(zip(files, stored))
+    image_stats.mirrored += 1
+    logger.debug(f"Mirrored image for post {post_id}: {urls}")
+    return urls
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
@@ -0,0 +1,355 @@
+import asyncio
+import datetime
+import json
+import logging
+import random
+import uuid
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+
+import sqlalchemy
+from databases import Database
+
+from main import metrics, tasks
+from main.config import config
+from main.database import database, job_table
+from main.email_batcher import email_batcher
+from main.resilience import UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class JobType:
+    handler: Callable[[Database, dict], Awaitable]
+    concurrency: int
+    max_attempts: int = 5
+    visibility_timeout: float = 60  # seconds a claim lasts, renewed while running
+    backoff_base: float = 5  # seconds before the first retry, doubled each time
+
+
+async def send_registration_email(database: Database, payload: dict):
+    await email_batcher.send(
+        payload["email"],
+        tasks.REGISTRATION_EMAIL_SUBJECT,
+        tasks.REGISTRATION_EMAIL_BODY,
+        variables=payload,
+    )
+
+
+async def generate_image(database: Database, payload: dict):
+    await tasks.generate_and_add_to_post(database=database, **payload)
+
+
+JOB_TYPES = {
+    "send_registration_email": JobType(
+        send_registration_email, concurrency=config.JOB_EMAIL_CONCURRENCY
+    ),
+    "generate_image": JobType(
+        generate_image,
+        concurrency=config.JOB_IMAGE_CONCURRENCY,
+        max_attempts=3,
+        visibility_timeout=config.DEEPAI_TIMEOUT_SECONDS + 60,
+    ),
+}
+
+
+def utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+async def enqueue(database: Database, type: str, **payload) -> int:
+    if type not in JOB_TYPES:
+        raise ValueError(f"Unknown job type: {type}")
+
+    logger.debug(f"Enqueueing {type} job")
+    query = job_table.insert().values(
+        type=type,
+        payload=json.dumps(payload),
+        status="queued",
+        attempts=0,
+        run_at=utcnow(),
+    )
+    return await database.execute(query)
+
+
+def claimable(type: str, now: datetime.datetime):
+    # Queued jobs that are due, or running jobs whose worker stopped answering
+    # and that have attempts left
+    return (job_table.c.type == type) & (
+        ((job_table.c.status == "queued") & (job_table.c.run_at <= now))
+        | (
+            (job_table.c.status == "running")
+            & (job_table.c.locked_until < now)
+            & (job_table.c.attempts < JOB_TYPES[type].max_attempts)
+        )
+    )
+
+
+async def abandon_exhausted(database: Database, type: str, now: datetime.datetime):
+    """Fail jobs whose worker stopped answering during their last attempt"""
+    query = (
+        job_table.update()
+        .where(
+            (job_table.c.type == type)
+            & (job_table.c.status == "running")
+            & (job_table.c.locked_until < now)
+            & (job_table.c.attempts >= JOB_TYPES[type].max_attempts)
+        )
+        .values(
+            status="failed",
+            locked_until=None,
+            lock_token=None,
+            last_error="Worker stopped answering during the last attempt",
+        )
+    )
+    await database.execute(query)
+
+
+async def claim(database: Database, type: str, limit: int) -> list:
+    """Lock up to `limit` due jobs for this worker until their visibility timeout
+
+    The claim is one UPDATE of the jobs picked by a subquery. On PostgreSQL
+    the subquery skips rows another worker has locked, so racing workers
+    claim different jobs. The claim's lock token goes with the jobs; only its
+    holder can renew, complete or fail them.
+    """
+    now = utcnow()
+    await abandon_exhausted(database, type, now)
+
+    candidates = (
+        sqlalchemy.select(job_table.c.id)
+        .where(claimable(type, now))
+        .order_by(job_table.c.run_at, job_table.c.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    locked_until = now + datetime.timedelta(seconds=JOB_TYPES[type].visibility_timeout)
+    query = (
+        job_table.update()
+        .where(job_table.c.id.in_(candidates) & claimable(type, now))
+        .values(
+            status="running",
+            locked_until=locked_until,
+            lock_token=uuid.uuid4().hex,
+            attempts=job_table.c.attempts + 1,
+        )
+        .returning(job_table)
+    )
+    return await database.fetch_all(query)
+
+
+def held(job):
+    # A job claimed again after its lease ran out has a new lock token
+    return (job_table.c.id == job.id) & (job_table.c.lock_token == job.lock_token)
+
+
+async def renew(database: Database, job) -> bool:
+    """Extend the lease on a running job, returning False if it was lost"""
+    visibility_timeout = JOB_TYPES[job.type].visibility_timeout
+    query = (
+        job_table.update()
+        .where(held(job) & (job_table.c.status == "running"))
+        .values(locked_until=utcnow() + datetime.timedelta(seconds=visibility_timeout))
+        .returning(job_table.c.id)
+    )
+    return await database.fetch_one(query) is not None
+
+
+async def complete(database: Database, job) -> bool:
+    """Mark the job done, returning False if another claim holds it now"""
+    query = (
+        job_table.update()
+        .where(held(job))
+        .values(status="done", locked_until=None, lock_token=None, last_error=None)
+        .returning(job_table.c.id)
+    )
+    return await database.fetch_one(query) is not None
+
+
+async def fail(database: Database, job, error: str) -> str | None:
+    """Schedule a retry with jittered exponential backoff
+
+    Returns the job's new status, "queued" or "failed", or None if another
+    claim holds it now.
+    """
+    job_type = JOB_TYPES[job.type]
+    if job.attempts >= job_type.max_attempts:
+        values = {"status": "failed"}
+    else:
+        delay = job_type.backoff_base * 2 ** (job.attempts - 1)
+        delay *= random.uniform(0.5, 1.5)
+        run_at = utcnow() + datetime.timedelta(seconds=delay)
+        values = {"status": "queued", "run_at": run_at}
+
+    query = (
+        job_table.update()
+        .where(held(job))
+        .values(**values, locked_until=None, lock_token=None, last_error=error[:1000])
+        .returning(job_table.c.id)
+    )
+    if await database.fetch_one(query) is None:
+        return None
+    return values["status"]
+
+
+async def defer(database: Database, job, delay: float, error: str) -> bool:
+    """Queue the job again after `delay` without using up an attempt
+
+    For runs that never reached the upstream, like while its circuit is open,
+    which would otherwise use up every attempt before the circuit half-opens.
+    Returns False if another claim holds the job now.
+    """
+    query = (
+        job_table.update()
+        .where(held(job))
+        .values(
+            status="queued",
+            run_at=utcnow() + datetime.timedelta(seconds=delay),
+            attempts=job_table.c.attempts - 1,
+            locked_until=None,
+            lock_token=None,
+            last_error=error[:1000],
+        )
+        .returning(job_table.c.id)
+    )
+    return await database.fetch_one(query) is not None
+
+
+async def queue_depth(database: Database) -> dict:
+    query = (
+        sqlalchemy.select(
+            job_table.c.type,
+            job_table.c.status,
+            sqlalchemy.func.count().label("jobs"),
+        )
+        .where(job_table.c.status.in_(["queued", "running"]))
+        .group_by(job_table.c.type, job_table.c.status)
+    )
+    depth = {type: {"queued": 0, "running": 0} for type in JOB_TYPES}
+    for row in await database.fetch_all(query):
+        depth.setdefault(row.type, {})[row.status] = row.jobs
+    return depth
+
+
+@dataclass
+class WorkerStats:
+    completed: Counter = field(default_factory=Counter)
+    retried: Counter = field(default_factory=Counter)
+    failed: Counter = field(default_factory=Counter)
+    lost: Counter = field(default_factory=Counter)  # claimed again elsewhere
+    deferred: Counter = field(default_factory=Counter)  # upstream unavailable
+    running: Counter = field(default_factory=Counter)
+
+
+class Worker:
+    """Polls the jobs table and runs each job type under its own concurrency cap"""
+
+    def __init__(self, database: Database, poll_interval: float) -> None:
+        self.database = database
+        self.poll_interval = poll_interval
+        self.stats = WorkerStats()
+        self._stopping = asyncio.Event()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def run(self) -> None:
+        logger.info("Job worker started")
+        await asyncio.gather(*(self._poll(type) for type in JOB_TYPES))
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+        logger.info(
+            f"Job worker stopped: completed {dict(self.stats.completed)},"
+            f" retried {dict(self.stats.retried)}, failed {dict(self.stats.failed)},"
+            f" deferred {dict(self.stats.deferred)}, lost {dict(self.stats.lost)}"
+        )
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def run_once(self) -> int:
+        """Claim and run every due job once, returning how many ran"""
+        ran = 0
+        for type, job_type in JOB_TYPES.items():
+            for job in await claim(self.database, type, job_type.concurrency):
+                await self._execute(job)
+                ran += 1
+        return ran
+
+    async def _poll(self, type: str) -> None:
+        concurrency = JOB_TYPES[type].concurrency
+        while not self._stopping.is_set():
+            jobs = []
+            free = concurrency - self.stats.running[type]
+            if free > 0:
+                try:
+                    jobs = await claim(self.database, type, free)
+                except Exception:
+                    logger.exception(f"Failed to claim {type} jobs")
+
+            for job in jobs:
+                self.stats.running[type] += 1
+                task = asyncio.create_task(self._execute(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            if not jobs:
+                try:
+                    await asyncio.wait_for(
+                        self._stopping.wait(), timeout=self.poll_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _heartbeat(self, job) -> None:
+        """Renew the job's lease until cancelled or the lease is lost"""
+        interval = JOB_TYPES[job.type].visibility_timeout / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not await renew(self.database, job):
+                    logger.warning(f"Lost the lease on {job.type} job {job.id}")
+                    return
+            except Exception:
+                logger.exception(f"Failed to renew {job.type} job {job.id}")
+
+    async def _run_handler(self, job) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            await JOB_TYPES[job.type].handler(self.database, json.loads(job.payload))
+        finally:
+            heartbeat.cancel()
+
+    async def _execute(self, job) -> None:
+        logger.debug(f"Running {job.type} job {job.id}, attempt {job.attempts}")
+        try:
+            await self._run_handler(job)
+        except UpstreamUnavailable as e:
+            # Wait out the open circuit, spread so not every job probes at once
+            delay = e.retry_after or JOB_TYPES[job.type].backoff_base
+            delay *= random.uniform(1, 1.5)
+            logger.warning(f"{job.type} job {job.id} deferred {delay:.1f}s: {e}")
+            if await defer(self.database, job, delay, repr(e)):
+                self.stats.deferred[job.type] += 1
+            else:
+                self.stats.lost[job.type] += 1
+        except Exception as e:
+            logger.exception(f"{job.type} job {job.id} failed")
+            status = await fail(self.database, job, repr(e))
+            if status == "queued":
+                self.stats.retried[job.type] += 1
+            elif status == "failed":
+                self.stats.failed[job.type] += 1
+            else:
+                self.stats.lost[job.type] += 1
+        else:
+            if await complete(self.database, job):
+                self.stats.completed[job.type] += 1
+            else:
+                self.stats.lost[job.type] += 1
+        finally:
+            if self.stats.running[job.type] > 0:
+                self.stats.running[job.type] -= 1
+
+
+metrics.register("job_queue", lambda: queue_depth(database))
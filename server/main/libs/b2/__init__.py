@@ -1,5 +1,6 @@
 import logging
-from functools import lru_cache
+import threading
+import time
 
 import b2sdk.v2 as b2
 from main.config import config
@@ -7,26 +8,63 @@ from main.config import config
 logger = logging.getLogger(__name__)
 
 
-@lru_cache()
-def b2_api():
-    logger.debug("Creating and authorizing B2 API")
-    info = b2.InMemoryAccountInfo()
-    b2_api = b2.B2Api(info)
+class B2ApiSession:
+    """One b2sdk API and bucket for the process, re-authorized before expiry
+
+    Reusing the B2Api keeps its pooled HTTP session; only the authorization is
+    renewed once it is `max_age` seconds old. b2sdk calls block, so this is
+    used from the upload threads and guarded by a lock.
+    """
+
+    def __init__(self, max_age: float) -> None:
+        self.max_age = max_age
+        self.authorizations = 0
+        self._api: b2.B2Api | None = None
+        self._bucket: b2.Bucket | None = None
+        self._authorized_at = 0.0
+        self._lock = threading.Lock()
+
+    def api(self) -> b2.B2Api:
+        with self._lock:
+            if self._api is None:
+                logger.debug("Creating B2 API")
+                self._api = b2.B2Api(b2.InMemoryAccountInfo())
+            if (
+                not self.authorizations
+                or time.monotonic() - self._authorized_at > self.max_age
+            ):
+                logger.debug("Authorizing B2 API")
+                self._api.authorize_account(
+                    "production", config.B2_KEY_ID, config.B2_APPLICATION_KEY
+                )
+                self._authorized_at = time.monotonic()
+                self.authorizations += 1
+            return self._api
+
+    def bucket(self) -> b2.Bucket:
+        api = self.api()
+        with self._lock:
+            if self._bucket is None:
+                self._bucket = api.get_bucket_by_name(config.B2_BUCKET_NAME)
+            return self._bucket
 
-    b2_api.authorize_account("production", config.B2_KEY_ID, config.B2_APPLICATION_KEY)
-    return b2_api
+
+b2_session = B2ApiSession(max_age=config.B2_REAUTHORIZE_SECONDS)
+
+
+def b2_api():
+    return b2_session.api()
 
 
-@lru_cache()
-def b2_get_bucket(api: b2.B2Api):
-    return api.get_bucket_by_name(config.B2_BUCKET_NAME)
+def b2_get_bucket():
+    return b2_session.bucket()
 
 
 def b2_upload_file(local_file: str, file_name: str):
     api = b2_api()
     logger.debug(f"Uploading {local_file} to B2 as {file_name}")
 
-    uploaded_file = b2_get_bucket(api).upload_local_file(
+    uploaded_file = b2_get_bucket().upload_local_file(
         local_file=local_file, file_name=file_name
     )
 
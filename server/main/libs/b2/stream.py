@@ -0,0 +1,436 @@
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Protocol
+from urllib.parse import quote
+
+import httpx
+from main import metrics
+from main.config import config
+from main.http_clients import get_client
+from main.resilience import guard
+
+logger = logging.getLogger(__name__)
+
+# Async uploads through B2's native API, streamed from the request without a
+# local copy. Files that fit in one part take a single b2_upload_file call,
+# larger ones go through the large-file API with parts uploaded in parallel.
+
+READ_SIZE = 1024 * 1024
+
+
+class B2Error(Exception):
+    def __init__(self, message: str, status_code: int | None = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class AsyncReadable(Protocol):
+    async def read(self, size: int = -1) -> bytes: ...
+
+
+@dataclass
+class B2Account:
+    account_id: str
+    authorization_token: str
+    api_url: str
+    download_url: str
+    bucket_id: str
+
+    def download_url_for_file_id(self, file_id: str) -> str:
+        return f"{self.download_url}/b2api/v2/b2_download_file_by_id?fileId={file_id}"
+
+
+@dataclass
+class BufferPoolStats:
+    acquired: int = 0
+    waits: int = 0
+    in_use: int = 0
+
+
+class BufferPool:
+    """Caps how many part-sized buffers all streaming uploads hold at once
+
+    Memory for streaming uploads stays under `buffers` * B2_PART_SIZE; a reader
+    that finds every buffer taken waits until a part finishes uploading.
+    """
+
+    def __init__(self, buffers: int) -> None:
+        self.buffers = buffers
+        self.stats = BufferPoolStats()
+        self._semaphore = asyncio.Semaphore(buffers)
+
+    async def acquire(self) -> None:
+        if self._semaphore.locked():
+            self.stats.waits += 1
+        await self._semaphore.acquire()
+        self.stats.acquired += 1
+        self.stats.in_use += 1
+
+    def release(self) -> None:
+        self.stats.in_use -= 1
+        self._semaphore.release()
+
+    def metrics(self) -> dict:
+        return {**asdict(self.stats), "buffers": self.buffers}
+
+
+buffer_pool = BufferPool(config.B2_UPLOAD_BUFFERS)
+metrics.register("b2_buffer_pool", buffer_pool.metrics)
+
+
+async def send(
+    client: httpx.AsyncClient, method: str, url: str, **kwargs
+) -> httpx.Response:
+    """Send a B2 request through the b2 upstream's breaker and concurrency limit"""
+    return await guard("b2").call(client.request, method, url, **kwargs)
+
+
+def raise_for_b2_status(response: httpx.Response) -> None:
+    if response.is_success:
+        return
+    try:
+        error = response.json()
+        message = f"{error['code']}: {error['message']}"
+    except (ValueError, KeyError):
+        message = response.text
+    raise B2Error(
+        f"B2 request failed with status {response.status_code}: {message}",
+        status_code=response.status_code,
+    )
+
+
+async def authorize(
+    client: httpx.AsyncClient,
+    key_id: str | None = None,
+    application_key: str | None = None,
+) -> B2Account:
+    """Authorize with the given application key, by default the configured one"""
+    logger.debug("Authorizing B2 account")
+    response = await send(
+        client,
+        "GET",
+        "/b2api/v2/b2_authorize_account",
+        auth=(
+            key_id or config.B2_KEY_ID or "",
+            application_key or config.B2_APPLICATION_KEY or "",
+        ),
+    )
+    raise_for_b2_status(response)
+    data = response.json()
+    account = B2Account(
+        account_id=data["accountId"],
+        authorization_token=data["authorizationToken"],
+        api_url=data["apiUrl"],
+        download_url=data["downloadUrl"],
+        bucket_id=data.get("allowed", {}).get("bucketId") or "",
+    )
+
+    # Keys restricted to one bucket carry its id, others have to look it up
+    if data.get("allowed", {}).get("bucketName") != config.B2_BUCKET_NAME:
+        buckets = await call_api(
+            client,
+            account,
+            "b2_list_buckets",
+            accountId=account.account_id,
+            bucketName=config.B2_BUCKET_NAME,
+        )
+        if not buckets["buckets"]:
+            raise B2Error(f"Bucket {config.B2_BUCKET_NAME} not found")
+        account.bucket_id = buckets["buckets"][0]["bucketId"]
+    return account
+
+
+@dataclass
+class B2SessionStats:
+    authorizations: int = 0
+    expired: int = 0
+
+
+class B2Session:
+    """Account authorization shared by all B2 calls, renewed before it expires
+
+    B2 tokens last 24 hours. The session authorizes again once its token is
+    `max_age` seconds old, and straight away if B2 reports it expired.
+    """
+
+    def __init__(self, max_age: float) -> None:
+        self.max_age = max_age
+        self.stats = B2SessionStats()
+        self._account: B2Account | None = None
+        self._authorized_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def account(self) -> B2Account:
+        async with self._lock:
+            stale = time.monotonic() - self._authorized_at > self.max_age
+            if self._account is None or stale:
+                self._account = await authorize(get_client("b2"))
+                self._authorized_at = time.monotonic()
+                self.stats.authorizations += 1
+            return self._account
+
+    def invalidate(self) -> None:
+        self._account = None
+
+    async def call(self, name: str, **payload) -> dict:
+        """Call a B2 API, authorizing again once if the token has expired"""
+        account = await self.account()
+        try:
+            return await call_api(get_client("b2"), account, name, **payload)
+        except B2Error as e:
+            if e.status_code != 401:
+                raise
+        self.stats.expired += 1
+        self.invalidate()
+        account = await self.account()
+        return await call_api(get_client("b2"), account, name, **payload)
+
+    def metrics(self) -> dict:
+        age = time.monotonic() - self._authorized_at if self._account else None
+        return {**asdict(self.stats), "token_age_seconds": age}
+
+
+session = B2Session(max_age=config.B2_REAUTHORIZE_SECONDS)
+metrics.register("b2_session", session.metrics)
+
+
+async def get_account() -> B2Account:
+    return await session.account()
+
+
+def reset_account() -> None:
+    session.invalidate()
+
+
+async def call_api(
+    client: httpx.AsyncClient, account: B2Account, name: str, **payload
+) -> dict:
+    response = await send(
+        client,
+        "POST",
+        f"{account.api_url}/b2api/v2/{name}",
+        headers={"Authorization": account.authorization_token},
+        json=payload,
+    )
+    raise_for_b2_status(response)
+    return response.json()
+
+
+async def get_upload_url() -> dict:
+    """Upload URL and token for one uploader at a time, valid for 24 hours"""
+    account = await get_account()
+    return await session.call("b2_get_upload_url", bucketId=account.bucket_id)
+
+
+async def get_scoped_upload_url(name_prefix: str) -> dict:
+    """Upload URL and token that can only write files under `name_prefix`
+
+    Tokens from the configured key can write anything anywhere in the bucket,
+    so this creates a short-lived application key restricted to the prefix and
+    gets the upload URL with it. The configured key needs writeKeys.
+    """
+    account = await get_account()
+    key = await session.call(
+        "b2_create_key",
+        accountId=account.account_id,
+        capabilities=["writeFiles"],
+        keyName=f"upload-{uuid.uuid4().hex}",
+        validDurationInSeconds=config.B2_UPLOAD_KEY_SECONDS,
+        bucketId=account.bucket_id,
+        namePrefix=name_prefix,
+    )
+    client = get_client("b2")
+    scoped = await authorize(client, key["applicationKeyId"], key["applicationKey"])
+    return await call_api(
+        client, scoped, "b2_get_upload_url", bucketId=account.bucket_id
+    )
+
+
+async def get_file_info(file_id: str) -> dict:
+    return await session.call("b2_get_file_info", fileId=file_id)
+
+
+async def read_part(file: AsyncReadable, size: int) -> bytes:
+    """Read up to `size` bytes, fewer only at the end of the file"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = await file.read(min(READ_SIZE, remaining))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+async def sha1(data: bytes) -> str:
+    # hashlib releases the GIL for large inputs, so hash parts off the loop
+    return await asyncio.to_thread(lambda: hashlib.sha1(data).hexdigest())
+
+
+async def upload_small_file(
+    client: httpx.AsyncClient,
+    account: B2Account,
+    data: bytes,
+    file_name: str,
+    content_type: str,
+) -> str:
+    target = await call_api(
+        client, account, "b2_get_upload_url", bucketId=account.bucket_id
+    )
+    response = await send(
+        client,
+        "POST",
+        target["uploadUrl"],
+        headers={
+            "Authorization": target["authorizationToken"],
+            "X-Bz-File-Name": quote(file_name),
+            "Content-Type": content_type,
+            "X-Bz-Content-Sha1": await sha1(data),
+        },
+        content=data,
+    )
+    raise_for_b2_status(response)
+    return response.json()["fileId"]
+
+
+class LargeFileUpload:
+    """Uploads the parts of one B2 large file, reusing part upload URLs"""
+
+    def __init__(
+        self, client: httpx.AsyncClient, account: B2Account, file_id: str
+    ) -> None:
+        self.client = client
+        self.account = account
+        self.file_id = file_id
+        self.part_sha1s: dict[int, str] = {}
+        # B2 wants one upload URL per concurrent upload, so idle ones are kept
+        self._upload_urls: list[dict] = []
+
+    async def upload_part(self, part_number: int, data: bytes) -> None:
+        if self._upload_urls:
+            target = self._upload_urls.pop()
+        else:
+            target = await call_api(
+                self.client, self.account, "b2_get_upload_part_url", fileId=self.file_id
+            )
+        part_sha1 = await sha1(data)
+        response = await send(
+            self.client,
+            "POST",
+            target["uploadUrl"],
+            headers={
+                "Authorization": target["authorizationToken"],
+                "X-Bz-Part-Number": str(part_number),
+                "X-Bz-Content-Sha1": part_sha1,
+            },
+            content=data,
+        )
+        raise_for_b2_status(response)
+
+        self._upload_urls.append(target)
+        self.part_sha1s[part_number] = part_sha1
+
+    async def finish(self) -> None:
+        part_sha1s = [self.part_sha1s[n] for n in sorted(self.part_sha1s)]
+        await call_api(
+            self.client,
+            self.account,
+            "b2_finish_large_file",
+            fileId=self.file_id,
+            partSha1Array=part_sha1s,
+        )
+
+    async def cancel(self) -> None:
+        try:
+            await call_api(
+                self.client, self.account, "b2_cancel_large_file", fileId=self.file_id
+            )
+        except (B2Error, httpx.HTTPError):
+            logger.exception(f"Failed to cancel B2 large file {self.file_id}")
+
+
+async def stream_upload(
+    file: AsyncReadable,
+    file_name: str,
+    content_type: str | None = None,
+    part_size: int | None = None,
+) -> str:
+    """Stream `file` to the bucket as `file_name`, returning its download URL"""
+    part_size = part_size or config.B2_PART_SIZE
+    content_type = content_type or "b2/x-auto"
+    client = get_client("b2")
+    account = await get_account()
+
+    await buffer_pool.acquire()
+    try:
+        # A byte over one part tells a file of exactly one part, which has to
+        # go in one request since B2 large files need at least two parts
+        data = await read_part(file, part_size + 1)
+    except BaseException:
+        buffer_pool.release()
+        raise
+
+    if len(data) <= part_size:
+        logger.debug(f"Uploading {file_name} to B2 in one request")
+        try:
+            file_id = await upload_small_file(
+                client, account, data, file_name, content_type
+            )
+        finally:
+            buffer_pool.release()
+        return account.download_url_for_file_id(file_id)
+
+    logger.debug(f"Uploading {file_name} to B2 as a large file")
+    try:
+        started = await call_api(
+            client,
+            account,
+            "b2_start_large_file",
+            bucketId=account.bucket_id,
+            fileName=file_name,
+            contentType=content_type,
+        )
+    except BaseException:
+        buffer_pool.release()
+        raise
+
+    upload = LargeFileUpload(client, account, started["fileId"])
+    data, extra = data[:part_size], data[part_size:]
+    parts: list[asyncio.Task] = []
+    try:
+        part_number = 1
+        while data:
+            part = asyncio.create_task(upload.upload_part(part_number, data))
+            # The part's buffer is free once it is uploaded, failed or cancelled
+            part.add_done_callback(lambda _: buffer_pool.release())
+            parts.append(part)
+            part_number += 1
+            for part in parts:
+                if part.done():
+                    part.result()  # stop reading as soon as a part failed
+
+            await buffer_pool.acquire()
+            data = b""
+            try:
+                data = extra + await read_part(file, part_size - len(extra))
+                extra = b""
+            finally:
+                if not data:
+                    buffer_pool.release()
+
+        await asyncio.gather(*parts)
+        await upload.finish()
+    except BaseException:
+        for part in parts:
+            part.cancel()
+        await asyncio.gather(*parts, return_exceptions=True)
+        await upload.cancel()
+        raise
+
+    logger.debug(f"Uploaded {file_name} to B2 in {len(upload.part_sha1s)} parts")
+    return account.download_url_for_file_id(upload.file_id)
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import asdict, dataclass
+
+from databases import Database
+
+from main import metrics
+from main.cache import feed_tag, post_tag, response_cache
+from main.config import config
+from main.database import database, insert_ignore, like_table, update_like_count
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LikeBufferStats:
+    queued: int = 0
+    discarded: int = 0
+    flushed: int = 0
+    duplicates: int = 0
+    batches: int = 0
+    failed: int = 0
+
+
+class LikeBuffer:
+    """Queues likes in memory and writes them in batched multi-row INSERTs
+
+    A batch is flushed once it reaches `batch_size` or after `flush_interval`
+    seconds. When `max_pending` likes are queued, callers flush before
+    enqueueing, which bounds memory. Callers that pass `wait=True` are only
+    answered once their batch has been committed.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        batch_size: int,
+        flush_interval: float,
+        max_pending: int,
+    ) -> None:
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.stats = LikeBufferStats()
+        self._pending: list[tuple[dict, asyncio.Future | None]] = []
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def start(self) -> None:
+        logger.info("Starting like write-behind buffer")
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # Cancelling could interrupt a flush after it took the batch, losing it
+        # and leaving its waiters hanging, so the loop is asked to finish
+        if self._task is not None:
+            self._stopping.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        logger.info("Stopped like write-behind buffer")
+
+    async def add(self, post_id: int, user_id: int, wait: bool = False) -> None:
+        while len(self._pending) >= self.max_pending:
+            await self.flush()
+
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self._pending.append(({"post_id": post_id, "user_id": user_id}, future))
+        self.stats.queued += 1
+
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+        if future is not None:
+            await future
+
+    async def discard(self, post_id: int, user_id: int) -> bool:
+        """Remove a like that is not flushed yet, returning whether it was queued
+
+        Every queued copy goes, since a double-tap can queue the same like twice.
+        A flush in progress is waited out first, so once this returns the like
+        is either gone or committed, and a DELETE afterwards removes it for good.
+        """
+        like = {"post_id": post_id, "user_id": user_id}
+        async with self._lock:
+            kept = []
+            for pending, future in self._pending:
+                if pending != like:
+                    kept.append((pending, future))
+                    continue
+                if future is not None and not future.done():
+                    future.set_result(None)
+                self.stats.discarded += 1
+
+            discarded = len(self._pending) - len(kept)
+            self._pending = kept
+        return discarded > 0
+
+    async def flush(self) -> None:
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+
+            likes = [like for like, _ in batch]
+            logger.debug(f"Flushing {len(likes)} likes")
+            try:
+                await self._write(likes)
+            except Exception as e:
+                self.stats.failed += len(likes)
+                logger.exception(f"Failed to flush {len(likes)} likes")
+                for _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                return
+
+            self.stats.flushed += len(likes)
+            self.stats.batches += 1
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+        post_ids = {like["post_id"] for like in likes}
+        await response_cache.invalidate(
+            *(post_tag(post_id) for post_id in post_ids), feed_tag("most_likes")
+        )
+
+    async def _write(self, likes: list[dict]) -> None:
+        query = (
+            insert_ignore(like_table, "user_id", "post_id")
+            .values(likes)
+            .returning(like_table.c.post_id)
+        )
+        async with self.database.transaction():
+            # Only rows that were actually inserted count towards like_count
+            inserted = await self.database.fetch_all(query)
+            counts = Counter(row.post_id for row in inserted)
+            for post_id, count in counts.items():
+                await self.database.execute(update_like_count(post_id, count))
+        self.stats.duplicates += len(likes) - len(inserted)
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def metrics(self) -> dict:
+        return {**asdict(self.stats), "pending": len(self)}
+
+
+like_buffer = LikeBuffer(
+    database,
+    batch_size=config.LIKE_BATCH_SIZE,
+    flush_interval=config.LIKE_FLUSH_INTERVAL_SECONDS,
+    max_pending=config.LIKE_MAX_PENDING,
+)
+metrics.register("like_buffer", like_buffer.metrics)
@@ -9,9 +9,14 @@ from asgi_correlation_id import CorrelationIdMiddleware
 from fastapi import FastAPI, HTTPException
 from fastapi.exception_handlers import http_exception_handler
 
+from main import db_pool, http_clients
+from main.cache_invalidations import invalidation_log
 from main.config import config
 from main.database import database
+from main.like_buffer import like_buffer
 from main.logging_conf import configure_logging
+from main.routers.files import router as files_router
+from main.routers.metrics import router as metrics_router
 from main.routers.post import router as post_router
 from main.routers.upload import router as upload_router
 from main.routers.user import router as user_router
@@ -34,8 +39,16 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     configure_logging()
     logger.info("Testing logger")
-    await database.connect()
+    await db_pool.connect(database)
+    await http_clients.start()
+    await invalidation_log.start()
+    if config.LIKE_WRITE_BEHIND:
+        await like_buffer.start()
     yield
+    if config.LIKE_WRITE_BEHIND:
+        await like_buffer.stop()
+    await invalidation_log.stop()
+    await http_clients.close()
     await database.disconnect()
 
 
@@ -46,6 +59,8 @@ app.add_middleware(CorrelationIdMiddleware)
 app.include_router(post_router)  # prefix="/posts"
 app.include_router(user_router)  # prefix="/users"
 app.include_router(upload_router)  # prefix="/upload"
+app.include_router(metrics_router)  # prefix="/metrics"
+app.include_router(files_router)  # prefix="/files"
 
 
 @app.exception_handler(HTTPException)  # track logs for HTTPException
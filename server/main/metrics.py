@@ -0,0 +1,17 @@
+import inspect
+from collections.abc import Awaitable, Callable
+
+_collectors: dict[str, Callable[[], dict | Awaitable[dict]]] = {}
+
+
+def register(name: str, collector: Callable[[], dict | Awaitable[dict]]) -> None:
+    """Expose a component's counters under `name` in the /metrics snapshot"""
+    _collectors[name] = collector
+
+
+async def snapshot() -> dict:
+    result = {}
+    for name, collector in _collectors.items():
+        value = collector()
+        result[name] = await value if inspect.isawaitable(value) else value
+    return result
@@ -0,0 +1,71 @@
+import datetime
+import importlib
+import logging
+import pkgutil
+from types import ModuleType
+
+import sqlalchemy
+
+logger = logging.getLogger(__name__)
+
+# Each migration is a module named m<version>_<name> exposing upgrade(connection)
+schema_migrations_table = sqlalchemy.Table(
+    "schema_migrations",
+    sqlalchemy.MetaData(),
+    sqlalchemy.Column("version", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("name", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("applied_at", sqlalchemy.DateTime, nullable=False),
+)
+
+
+def create_engine(database_url: str) -> sqlalchemy.Engine:
+    connect_args = {"check_same_thread": False} if "sqlite" in database_url else {}
+    return sqlalchemy.create_engine(database_url, connect_args=connect_args)
+
+
+def migrations() -> list[tuple[int, str, ModuleType]]:
+    found = []
+    for module_info in pkgutil.iter_modules(__path__):
+        prefix, _, name = module_info.name.partition("_")
+        if not prefix.startswith("m") or not prefix[1:].isdigit():
+            continue
+        module = importlib.import_module(f"{__name__}.{module_info.name}")
+        found.append((int(prefix[1:]), name, module))
+    return sorted(found, key=lambda migration: migration[0])
+
+
+def applied_versions(connection: sqlalchemy.Connection) -> set[int]:
+    schema_migrations_table.create(connection, checkfirst=True)
+    query = sqlalchemy.select(schema_migrations_table.c.version)
+    return set(connection.execute(query).scalars())
+
+
+def upgrade(engine: sqlalchemy.Engine) -> list[int]:
+    """Apply pending migrations in order, each in its own transaction"""
+    applied = []
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+
+    for version, name, module in migrations():
+        if version in done:
+            continue
+
+        logger.info(f"Applying migration {version}: {name}")
+        with engine.begin() as connection:
+            module.upgrade(connection)
+            connection.execute(
+                schema_migrations_table.insert().values(
+                    version=version,
+                    name=name,
+                    applied_at=datetime.datetime.now(datetime.timezone.utc),
+                )
+            )
+        applied.append(version)
+
+    return applied
+
+
+def pending(engine: sqlalchemy.Engine) -> list[tuple[int, str]]:
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+    return [(version, name) for version, name, _ in migrations() if version not in done]
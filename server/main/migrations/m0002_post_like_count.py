@@ -0,0 +1,20 @@
+"""Denormalized posts.like_count, backfilled from likes"""
+
+import sqlalchemy
+
+
+def upgrade(connection: sqlalchemy.Connection) -> None:
+    columns = sqlalchemy.inspect(connection).get_columns("posts")
+    if "like_count" not in {column["name"] for column in columns}:
+        connection.execute(
+            sqlalchemy.text(
+                "ALTER TABLE posts ADD COLUMN like_count INTEGER NOT NULL DEFAULT 0"
+            )
+        )
+
+    connection.execute(
+        sqlalchemy.text(
+            "UPDATE posts SET like_count ="
+            " (SELECT count(likes.id) FROM likes WHERE likes.post_id = posts.id)"
+        )
+    )
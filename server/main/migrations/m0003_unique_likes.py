@@ -0,0 +1,25 @@
+"""One like per user and post"""
+
+import sqlalchemy
+
+
+def upgrade(connection: sqlalchemy.Connection) -> None:
+    # Keep the first of any duplicated likes so the unique index can be built
+    connection.execute(
+        sqlalchemy.text(
+            "DELETE FROM likes WHERE id NOT IN"
+            " (SELECT min(id) FROM likes GROUP BY user_id, post_id)"
+        )
+    )
+    connection.execute(
+        sqlalchemy.text(
+            "UPDATE posts SET like_count ="
+            " (SELECT count(likes.id) FROM likes WHERE likes.post_id = posts.id)"
+        )
+    )
+    connection.execute(
+        sqlalchemy.text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_likes_user_id_post_id"
+            " ON likes (user_id, post_id)"
+        )
+    )
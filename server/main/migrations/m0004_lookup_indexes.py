@@ -0,0 +1,19 @@
+"""Indexes for the foreign keys and sort keys that hot queries use"""
+
+import sqlalchemy
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_posts_user_id ON posts (user_id)",
+    (
+        "CREATE INDEX IF NOT EXISTS ix_posts_like_count_id"
+        " ON posts (like_count DESC, id DESC)"
+    ),
+    "CREATE INDEX IF NOT EXISTS ix_comments_post_id ON comments (post_id)",
+    # likes.user_id lookups are served by ux_likes_user_id_post_id
+    "CREATE INDEX IF NOT EXISTS ix_likes_post_id ON likes (post_id)",
+]
+
+
+def upgrade(connection: sqlalchemy.Connection) -> None:
+    for statement in INDEXES:
+        connection.execute(sqlalchemy.text(statement))
@@ -0,0 +1,20 @@
+"""Refresh token rotation and revocation state"""
+
+import sqlalchemy
+
+metadata = sqlalchemy.MetaData()
+
+refresh_tokens = sqlalchemy.Table(
+    "refresh_tokens",
+    metadata,
+    sqlalchemy.Column("jti", sqlalchemy.String, primary_key=True),
+    sqlalchemy.Column("email", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("expires_at", sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Column("revoked", sqlalchemy.Boolean, nullable=False, default=False),
+)
+
+sqlalchemy.Index("ix_refresh_tokens_email", refresh_tokens.c.email)
+
+
+def upgrade(connection: sqlalchemy.Connection) -> None:
+    metadata.create_all(connection, checkfirst=True)
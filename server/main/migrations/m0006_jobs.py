@@ -0,0 +1,26 @@
+"""Durable background job queue"""
+
+import sqlalchemy
+
+metadata = sqlalchemy.MetaData()
+
+jobs = sqlalchemy.Table(
+    "jobs",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("type", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("payload", sqlalchemy.Text, nullable=False),
+    sqlalchemy.Column("status", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("attempts", sqlalchemy.Integer, nullable=False, default=0),
+    sqlalchemy.Column("run_at", sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Column("locked_until", sqlalchemy.DateTime),
+    sqlalchemy.Column("last_error", sqlalchemy.Text),
+)
+
+sqlalchemy.Index(
+    "ix_jobs_type_status_run_at", jobs.c.type, jobs.c.status, jobs.c.run_at
+)
+
+
+def upgrade(connection: sqlalchemy.Connection) -> None:
+    metadata.create_all(connection, checkfirst=True)
@@ -0,0 +1,19 @@
+"""Content-addressed index of uploaded files"""
+
+import sqlalchemy
+
+metadata = sqlalchemy.MetaData()
+
+uploads = sqlalchemy.Table(
+    "uploads",
+    metadata,
+    sqlalchemy.Column("sha256", sqlalchemy.String, primary_key=True),
+    sqlalchemy.Column("size", sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.Column("file_url", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("file_name", sqlalchemy.String),
+    sqlalchemy.Column("created_at", sqlalchemy.DateTime, nullable=False),
+)
+
+
+def upgrade(connection: sqlalchemy.Connection) -> None:
+    metadata.create_all(connection, checkfirst=True)
@@ -0,0 +1,23 @@
+"""Files uploaded by clients straight to the bucket"""
+
+import sqlalchemy
+
+metadata = sqlalchemy.MetaData()
+
+direct_uploads = sqlalchemy.Table(
+    "direct_uploads",
+    metadata,
+    sqlalchemy.Column("file_id", sqlalchemy.String, primary_key=True),
+    sqlalchemy.Column("file_name", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("user_id", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("size", sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.Column("content_sha1", sqlalchemy.String),
+    sqlalchemy.Column("file_url", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("created_at", sqlalchemy.DateTime, nullable=False),
+)
+
+sqlalchemy.Index("ix_direct_uploads_user_id", direct_uploads.c.user_id)
+
+
+def upgrade(connection: sqlalchemy.Connection) -> None:
+    metadata.create_all(connection, checkfirst=True)
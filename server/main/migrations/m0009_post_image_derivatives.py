@@ -0,0 +1,13 @@
+"""Resized copies of post images: posts.thumbnail_url and posts.medium_url"""
+
+import sqlalchemy
+
+
+def upgrade(connection: sqlalchemy.Connection) -> None:
+    columns = sqlalchemy.inspect(connection).get_columns("posts")
+    existing = {column["name"] for column in columns}
+    for name in ("thumbnail_url", "medium_url"):
+        if name not in existing:
+            connection.execute(
+                sqlalchemy.text(f"ALTER TABLE posts ADD COLUMN {name} VARCHAR")
+            )
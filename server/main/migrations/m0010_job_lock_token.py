@@ -0,0 +1,11 @@
+"""Per-claim lock token on jobs, so only the current runner can settle a job"""
+
+import sqlalchemy
+
+
+def upgrade(connection: sqlalchemy.Connection) -> None:
+    columns = sqlalchemy.inspect(connection).get_columns("jobs")
+    if "lock_token" not in {column["name"] for column in columns}:
+        connection.execute(
+            sqlalchemy.text("ALTER TABLE jobs ADD COLUMN lock_token VARCHAR")
+        )
@@ -0,0 +1,17 @@
+"""Response cache invalidations, so web processes can apply the job worker's"""
+
+import sqlalchemy
+
+metadata = sqlalchemy.MetaData()
+
+cache_invalidations = sqlalchemy.Table(
+    "cache_invalidations",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("tag", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("created_at", sqlalchemy.DateTime, nullable=False),
+)
+
+
+def upgrade(connection: sqlalchemy.Connection) -> None:
+    metadata.create_all(connection, checkfirst=True)
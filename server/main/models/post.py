@@ -16,6 +16,8 @@ class UserPost(UserPostIn):
     id: int
     user_id: int
     image_url: Optional[str] = None
+    thumbnail_url: str | None = None
+    medium_url: str | None = None
 
 
 class UserPostWithLikes(UserPost):
@@ -24,6 +26,11 @@ class UserPostWithLikes(UserPost):
     likes: int
 
 
+class PostPage(BaseModel):
+    posts: list[UserPostWithLikes]
+    next_cursor: str | None = None
+
+
 class CommentIn(BaseModel):
     body: str
     post_id: int
@@ -47,5 +54,9 @@ class PostLikeIn(BaseModel):
 
 
 class PostLike(PostLikeIn):
-    id: int
-    user_id: int
\ No newline at end of file
+    id: int | None = None  # not yet assigned when the like is write-behind
+    user_id: int
+
+
+class PostLikeResult(PostLike):
+    changed: bool | None = None  # None while a write-behind like is queued
\ No newline at end of file
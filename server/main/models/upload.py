@@ -0,0 +1,33 @@
+from pydantic import BaseModel
+
+
+class UploadedFile(BaseModel):
+    detail: str
+    file_url: str
+
+
+class BatchUploadedFile(BaseModel):
+    file_name: str
+    file_url: str | None = None
+    detail: str
+
+
+class BatchUpload(BaseModel):
+    files: list[BatchUploadedFile]
+
+
+class DirectUploadIn(BaseModel):
+    file_name: str
+    content_type: str | None = None
+
+
+class DirectUploadAuthorization(BaseModel):
+    upload_url: str
+    headers: dict[str, str]  # the client adds X-Bz-Content-Sha1
+    file_name: str
+    ticket: str
+
+
+class DirectUploadComplete(BaseModel):
+    file_id: str
+    ticket: str
@@ -6,6 +6,10 @@ class User(BaseModel):
     email: str
 
 
+class RefreshTokenIn(BaseModel):
+    refresh_token: str
+
+
 class UserIn(User):
     password: str
     name: str | None = None
@@ -0,0 +1,312 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass
+
+import httpx
+
+from main import metrics
+from main.config import config
+from main.http_clients import UNHANDLED_STATUSES, UPSTREAMS
+
+logger = logging.getLogger(__name__)
+
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class UpstreamUnavailable(Exception):
+    """The upstream was not called, so callers may retry without counting it"""
+
+    def __init__(self, message: str, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after  # seconds until a call may be let through
+
+
+class CircuitBreaker:
+    """Stops calling an upstream after `failure_threshold` failures in a row
+
+    After `reset_timeout` seconds one probe call is let through: success closes
+    the circuit again, failure keeps it open for another `reset_timeout`.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at: float | None = None
+
+    def allow(self) -> bool:
+        now = self.clock()
+        if self.state == "open":
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            # A probe that never reported back does not hold the circuit forever
+            probing = self._probe_started_at is not None
+            if probing and now - self._probe_started_at < self.reset_timeout:
+                return False
+            self._probe_started_at = now
+        return True
+
+    def retry_after(self) -> float:
+        """Seconds until allow() may let a call through again"""
+        if self.state == "open":
+            started = self._opened_at
+        elif self._probe_started_at is not None:
+            started = self._probe_started_at
+        else:
+            return 0.0
+        return max(0.0, self.reset_timeout - (self.clock() - started))
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info("Circuit closed")
+        self.state = "closed"
+        self.failures = 0
+        self._probe_started_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Circuit opened after {self.failures} failures")
+            self.state = "open"
+            self._opened_at = self.clock()
+            self._probe_started_at = None
+
+
+class AdaptiveLimiter:
+    """Concurrency limit adjusted by additive increase, multiplicative decrease
+
+    Calls faster than `latency_target` grow the limit by about one per limit's
+    worth of calls; slow calls shrink it by 10% and failures halve it. At most
+    `max_queued` callers wait for a slot, after that they are turned away.
+    """
+
+    def __init__(
+        self,
+        min_limit: int,
+        max_limit: int,
+        latency_target: float,
+        max_queued: int,
+    ) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.max_queued = max_queued
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queued:
+            raise UpstreamUnavailable("Too many calls waiting for the upstream")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                self._waiters.remove(waiter)
+            else:
+                # Cancelled after a slot was handed over, so pass it on
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def record(self, latency: float, ok: bool) -> None:
+        if not ok:
+            self.limit = max(self.min_limit, self.limit / 2)
+        elif latency > self.latency_target:
+            self.limit = max(self.min_limit, self.limit * 0.9)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+class RetryBudget:
+    """Token bucket that caps retries at `ratio` of first attempts"""
+
+    def __init__(self, ratio: float, max_tokens: float) -> None:
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+@dataclass
+class GuardStats:
+    calls: int = 0
+    failures: int = 0
+    retries: int = 0
+    rejected: int = 0
+
+
+class UpstreamGuard:
+    """Circuit breaker, adaptive concurrency limit and retry budget for one upstream"""
+
+    def __init__(
+        self,
+        name: str,
+        breaker: CircuitBreaker,
+        limiter: AdaptiveLimiter,
+        budget: RetryBudget,
+        max_retries: int,
+        backoff_base: float,
+        retry_statuses: frozenset[int] = UNHANDLED_STATUSES,
+    ) -> None:
+        self.name = name
+        self.breaker = breaker
+        self.limiter = limiter
+        self.budget = budget
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.retry_statuses = retry_statuses
+        self.stats = GuardStats()
+
+    async def call(
+        self, send: Callable[..., Awaitable[httpx.Response]], *args, **kwargs
+    ) -> httpx.Response:
+        """Await `send(*args, **kwargs)`, retrying calls the upstream did not handle
+
+        Raises UpstreamUnavailable without calling the upstream while its circuit
+        is open or too many calls are already waiting on it.
+        """
+        self.stats.calls += 1
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.stats.rejected += 1
+                raise UpstreamUnavailable(
+                    f"Circuit for {self.name} is open",
+                    retry_after=self.breaker.retry_after(),
+                )
+            try:
+                await self.limiter.acquire()
+            except UpstreamUnavailable:
+                self.stats.rejected += 1
+                raise
+
+            error, response = None, None
+            started = time.monotonic()
+            try:
+                response = await send(*args, **kwargs)
+            except httpx.TransportError as err:
+                error = err
+            finally:
+                self.limiter.release()
+
+            failed = error is not None or (
+                response.status_code >= 500 or response.status_code == 429
+            )
+            self.limiter.record(time.monotonic() - started, ok=not failed)
+            if not failed:
+                self.breaker.record_success()
+                return response
+
+            self.stats.failures += 1
+            self.breaker.record_failure()
+            retryable = isinstance(error, RETRY_ERRORS) or (
+                response is not None and response.status_code in self.retry_statuses
+            )
+            if attempt < self.max_retries and retryable and self.budget.withdraw():
+                delay = self.backoff_base * 2**attempt * random.uniform(0.5, 1.5)
+                logger.debug(f"Retrying {self.name} call in {delay:.2f}s")
+                self.stats.retries += 1
+                attempt += 1
+                if response is not None:
+                    await response.aclose()  # a streamed body holds its connection
+                await asyncio.sleep(delay)
+                continue
+
+            if error is not None:
+                raise error
+            return response
+
+    def metrics(self) -> dict:
+        return {
+            **asdict(self.stats),
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "limit": round(self.limiter.limit, 2),
+            "in_flight": self.limiter.in_flight,
+            "queued": len(self.limiter._waiters),
+            "retry_tokens": round(self.budget.tokens, 2),
+        }
+
+
+_guards: dict[str, UpstreamGuard] = {}
+
+
+def create_guard(name: str) -> UpstreamGuard:
+    upstream = UPSTREAMS[name]
+    return UpstreamGuard(
+        name,
+        breaker=CircuitBreaker(
+            failure_threshold=config.UPSTREAM_FAILURE_THRESHOLD,
+            reset_timeout=config.UPSTREAM_RESET_TIMEOUT_SECONDS,
+        ),
+        limiter=AdaptiveLimiter(
+            min_limit=1,
+            max_limit=upstream.max_concurrency,
+            latency_target=upstream.latency_target,
+            max_queued=config.UPSTREAM_MAX_QUEUED,
+        ),
+        budget=RetryBudget(
+            ratio=config.UPSTREAM_RETRY_BUDGET_RATIO,
+            max_tokens=config.UPSTREAM_RETRY_BUDGET_MAX,
+        ),
+        max_retries=config.UPSTREAM_MAX_RETRIES,
+        backoff_base=config.UPSTREAM_RETRY_BACKOFF_SECONDS,
+        retry_statuses=upstream.retry_statuses,
+    )
+
+
+def guard(name: str) -> UpstreamGuard:
+    if name not in _guards:
+        _guards[name] = create_guard(name)
+    return _guards[name]
+
+
+def reset() -> None:
+    _guards.clear()
+
+
+metrics.register(
+    "upstreams", lambda: {name: guard.metrics() for name, guard in _guards.items()}
+)
@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import mimetypes
+
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import FileResponse
+from main.storage import LocalStorage, storage
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Stored files are never overwritten, their keys are unique
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Anyone can upload and keeps their file name, so only types browsers render as
+# plain media are shown inline. Anything else, like HTML or SVG, could run
+# script on the API's origin and is sent as a download instead.
+INLINE_TYPES = frozenset(
+    {"image/png", "image/jpeg", "image/gif", "image/webp", "image/avif"}
+)
+
+
+@router.get("/files/{key:path}")
+async def download_file(key: str):
+    """Serve a file from the local storage backend
+
+    FileResponse answers Range requests and, on servers with the ASGI pathsend
+    extension, hands the file to the server to send without copying it through
+    Python.
+    """
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    try:
+        path = storage.path(key)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if not await asyncio.to_thread(path.is_file):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
+        )
+
+    headers = {"Cache-Control": CACHE_CONTROL, "X-Content-Type-Options": "nosniff"}
+    media_type, _ = mimetypes.guess_type(path.name)
+    if media_type in INLINE_TYPES:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        headers=headers,
+        filename=path.name,
+    )
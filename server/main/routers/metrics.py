@@ -0,0 +1,9 @@
+from fastapi import APIRouter
+from main import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def get_metrics():
+    return await metrics.snapshot()
@@ -1,15 +1,38 @@
+import base64
+import binascii
+import json
 import logging
 from enum import Enum
 from typing import Annotated
 
 import sqlalchemy
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
-from main.database import comment_table, database, like_table, post_table
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import StreamingResponse
+from main import jobs
+from main.cache import comments_tag, feed_tag, post_tag, response_cache
+from main.config import config
+from main.database import (
+    comment_table,
+    database,
+    insert_ignore,
+    like_table,
+    post_table,
+    update_like_count,
+)
+from main.like_buffer import like_buffer
 from main.models.post import (
     Comment,
     CommentIn,
-    PostLike,
     PostLikeIn,
+    PostLikeResult,
+    PostPage,
     UserPost,
     UserPostIn,
     UserPostWithComments,
@@ -17,16 +40,19 @@ from main.models.post import (
 )
 from main.models.user import User
 from main.security import get_current_user
-from main.tasks import generate_and_add_to_post
 
 router = APIRouter()
 
 logger = logging.getLogger(__name__)
 
-select_post_and_likes = (
-    sqlalchemy.select(post_table, sqlalchemy.func.count(like_table.c.id).label("likes"))
-    .select_from(post_table.outerjoin(like_table))
-    .group_by(post_table.c.id)
+select_post_and_likes = sqlalchemy.select(
+    post_table.c.id,
+    post_table.c.body,
+    post_table.c.user_id,
+    post_table.c.image_url,
+    post_table.c.thumbnail_url,
+    post_table.c.medium_url,
+    post_table.c.like_count.label("likes"),
 )
 
 @router.get("/")
@@ -45,7 +71,6 @@ async def find_post(post_id: int):
 async def create_post(
     post: UserPostIn,
     current_user: Annotated[User, Depends(get_current_user)],
-    background_tasks: BackgroundTasks,
     request: Request,
     prompt: str = None,
 ):
@@ -57,14 +82,17 @@ async def create_post(
     logger.debug(query)
 
     last_record_id = await database.execute(query)
+    await response_cache.invalidate(feed_tag())
     if prompt:
-        background_tasks.add_task(
-            generate_and_add_to_post,
-            current_user.email,
-            last_record_id,
-            request.url_for("get_post_with_comments", post_id=last_record_id),
+        await jobs.enqueue(
             database,
-            prompt,
+            "generate_image",
+            email=current_user.email,
+            post_id=last_record_id,
+            post_url=str(
+                request.url_for("get_post_with_comments", post_id=last_record_id)
+            ),
+            prompt=prompt,
         )
     return {**data, "id": last_record_id}
 
@@ -75,17 +103,97 @@ class PostSorting(str, Enum):
     most_likes = "most_likes"
 
 
-# Get all posts
-@router.get("/post", response_model=list[UserPostWithLikes])
-async def get_all_posts(sorting: PostSorting = PostSorting.new):
-    logger.info("Getting all posts")
+def encode_cursor(sorting: PostSorting, post) -> str:
+    # The cursor holds the sort key of the last post on the page
+    key = {"id": post.id}
+    if sorting == PostSorting.most_likes:
+        key["likes"] = post.likes
+    raw = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(sorting: PostSorting, cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(key.get("id"), int):
+            raise TypeError("Cursor is missing 'id'")
+        if sorting == PostSorting.most_likes and not isinstance(key.get("likes"), int):
+            raise TypeError("Cursor is missing 'likes'")
+    except (binascii.Error, ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+    return key
+
+
+def paginate_posts(query, sorting: PostSorting, cursor: str | None):
+    likes = post_table.c.like_count
+    key = decode_cursor(sorting, cursor) if cursor else None
 
     if sorting == PostSorting.new:
-        query = select_post_and_likes.order_by(post_table.c.id.desc())
-    elif sorting == PostSorting.old:
-        query = select_post_and_likes.order_by(post_table.c.id.asc())
-    elif sorting == PostSorting.most_likes:
-        query = select_post_and_likes.order_by(sqlalchemy.desc("likes"))
+        if key:
+            query = query.where(post_table.c.id < key["id"])
+        return query.order_by(post_table.c.id.desc())
+    if sorting == PostSorting.old:
+        if key:
+            query = query.where(post_table.c.id > key["id"])
+        return query.order_by(post_table.c.id.asc())
+
+    # most_likes: ties on the like count are broken by newest post first
+    if key:
+        query = query.where(
+            sqlalchemy.or_(
+                likes < key["likes"],
+                sqlalchemy.and_(likes == key["likes"], post_table.c.id < key["id"]),
+            )
+        )
+    return query.order_by(likes.desc(), post_table.c.id.desc())
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+async def stream_posts(query, ndjson: bool):
+    # Rows are serialized as they arrive, so memory stays flat for any result size
+    if not ndjson:
+        yield "["
+    first = True
+    async for post in database.iterate(query):
+        row = json.dumps(dict(post._mapping), separators=(",", ":"))
+        if ndjson:
+            yield row + "\n"
+        else:
+            yield row if first else "," + row
+        first = False
+    if not ndjson:
+        yield "]"
+
+
+# Get a page of posts, or stream every post from the cursor on
+@router.get("/post", response_model=PostPage)
+async def get_all_posts(
+    request: Request,
+    sorting: PostSorting = PostSorting.new,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    cursor: str | None = None,
+    stream: bool = False,
+):
+    logger.info("Getting all posts")
+
+    ndjson = NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+    if stream or ndjson:
+        query = paginate_posts(select_post_and_likes, sorting, cursor)
+        logger.debug(query)
+        return StreamingResponse(
+            stream_posts(query, ndjson),
+            media_type=NDJSON_MEDIA_TYPE if ndjson else "application/json",
+        )
+
+    cache_key = f"feed:{sorting.value}:{limit}:{cursor}"
+    if (page := await response_cache.get(cache_key)) is not None:
+        return page
+
+    # Fetch one extra row to find out whether there is a next page
+    query = paginate_posts(select_post_and_likes, sorting, cursor).limit(limit + 1)
 
     logger.debug(query)
 
@@ -94,7 +202,22 @@ async def get_all_posts(sorting: PostSorting = PostSorting.new):
     if not posts:
         raise HTTPException(status_code=404, detail="No posts found")
 
-    return posts
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = encode_cursor(sorting, posts[-1])
+
+    page = {
+        "posts": [dict(post._mapping) for post in posts],
+        "next_cursor": next_cursor,
+    }
+    await response_cache.set(
+        cache_key,
+        page,
+        tags=[feed_tag(), feed_tag(sorting.value)]
+        + [post_tag(post["id"]) for post in page["posts"]],
+    )
+    return page
 
 
 # Create comment for existing post
@@ -113,6 +236,7 @@ async def create_comment(
     data = {**comment.model_dump(), "user_id": current_user.id}
     query = comment_table.insert().values(data)
     last_record_id = await database.execute(query)
+    await response_cache.invalidate(comments_tag(comment.post_id))
     return {**data, "id": last_record_id}
 
 
@@ -121,6 +245,10 @@ async def create_comment(
 async def get_comments_on_post(post_id: int):
     logger.info("Getting comments on post")
 
+    cache_key = f"comments:{post_id}"
+    if (post_comments := await response_cache.get(cache_key)) is not None:
+        return post_comments
+
     query = comment_table.select().where(comment_table.c.post_id == post_id)
 
     logger.debug(query)
@@ -131,44 +259,156 @@ async def get_comments_on_post(post_id: int):
             status_code=404, detail=f"No comments found under post with id: {post_id}"
         )
 
+    post_comments = [dict(comment._mapping) for comment in post_comments]
+    await response_cache.set(cache_key, post_comments, tags=[comments_tag(post_id)])
     return post_comments
 
 
 # Get post with its comments
 @router.get("/post/{post_id}", response_model=UserPostWithComments)
-async def get_post_with_comments(post_id: int):
+async def get_post_with_comments(
+    post_id: int, comment_limit: Annotated[int, Query(ge=1, le=100)] = 50
+):
     logger.info("Getting post and its comments")
 
-    query = select_post_and_likes.where(post_table.c.id == post_id)
+    cache_key = f"post:{post_id}:{comment_limit}"
+    if (post_with_comments := await response_cache.get(cache_key)) is not None:
+        return post_with_comments
+
+    # Post and first page of comments in one round trip, one row per comment
+    comments = (
+        comment_table.select()
+        .where(comment_table.c.post_id == post_id)
+        .order_by(comment_table.c.id)
+        .limit(comment_limit)
+        .subquery()
+    )
+    query = (
+        select_post_and_likes.add_columns(
+            comments.c.id.label("comment_id"),
+            comments.c.body.label("comment_body"),
+            comments.c.user_id.label("comment_user_id"),
+        )
+        .select_from(
+            post_table.outerjoin(comments, comments.c.post_id == post_table.c.id)
+        )
+        .where(post_table.c.id == post_id)
+        .order_by(comments.c.id)
+    )
 
     logger.debug(query)
 
-    post = await database.fetch_one(query)
-    if not post:
+    rows = await database.fetch_all(query)
+    if not rows:
         raise HTTPException(
             status_code=404, detail=f"Post with id: {post_id} not found"
         )
 
-    return {"post": post, "comments": await get_comments_on_post(post_id)}
-
-
-@router.post("/like", response_model=PostLike, status_code=201)
+    post_comments = [
+        {
+            "id": row.comment_id,
+            "body": row.comment_body,
+            "post_id": post_id,
+            "user_id": row.comment_user_id,
+        }
+        for row in rows
+        if row.comment_id is not None
+    ]
+
+    post = {key: rows[0]._mapping[key] for key in UserPostWithLikes.model_fields}
+    post_with_comments = {"post": post, "comments": post_comments}
+    await response_cache.set(
+        cache_key, post_with_comments, tags=[post_tag(post_id), comments_tag(post_id)]
+    )
+    return post_with_comments
+
+
+@router.post("/like", response_model=PostLikeResult, status_code=201)
 async def like_post(
-    like: PostLikeIn, current_user: Annotated[User, Depends(get_current_user)]
+    like: PostLikeIn,
+    current_user: Annotated[User, Depends(get_current_user)],
+    response: Response,
 ):
     logger.info("Liking post")
 
-    post = await find_post(like.post_id)
-    if not post:
-        raise HTTPException(
-            status_code=404, detail=f"Post with id: {like.post_id} not found"
+    data = {**like.model_dump(), "user_id": current_user.id}
+
+    if config.LIKE_WRITE_BEHIND:
+        if not await find_post(like.post_id):
+            raise HTTPException(
+                status_code=404, detail=f"Post with id: {like.post_id} not found"
+            )
+        await like_buffer.add(**data, wait=config.LIKE_DURABILITY == "flushed")
+        response.status_code = 202
+        return data
+
+    # Inserting from posts skips missing posts and the unique index skips repeats
+    query = (
+        insert_ignore(like_table, "user_id", "post_id")
+        .from_select(
+            ["post_id", "user_id"],
+            sqlalchemy.select(
+                post_table.c.id, sqlalchemy.literal(current_user.id)
+            ).where(post_table.c.id == like.post_id),
+        )
+        .returning(like_table.c.id)
+    )
+
+    logger.debug(query)
+
+    async with database.transaction():
+        last_record_id = await database.fetch_val(query)
+        if last_record_id is not None:
+            await database.execute(update_like_count(like.post_id, 1))
+
+    if last_record_id is None:
+        query = like_table.select().where(
+            (like_table.c.post_id == like.post_id)
+            & (like_table.c.user_id == current_user.id)
         )
+        existing = await database.fetch_one(query)
+        if not existing:
+            raise HTTPException(
+                status_code=404, detail=f"Post with id: {like.post_id} not found"
+            )
+        response.status_code = 200
+        return {**data, "id": existing.id, "changed": False}
+
+    await response_cache.invalidate(post_tag(like.post_id), feed_tag("most_likes"))
+
+    return {**data, "id": last_record_id, "changed": True}
+
+
+@router.delete("/like", response_model=PostLikeResult)
+async def unlike_post(
+    like: PostLikeIn, current_user: Annotated[User, Depends(get_current_user)]
+):
+    logger.info("Unliking post")
 
     data = {**like.model_dump(), "user_id": current_user.id}
-    query = like_table.insert().values(data)
+
+    # A queued copy is dropped, but the like may also be stored already
+    discarded = config.LIKE_WRITE_BEHIND and await like_buffer.discard(**data)
+
+    query = (
+        like_table.delete()
+        .where(
+            (like_table.c.post_id == like.post_id)
+            & (like_table.c.user_id == current_user.id)
+        )
+        .returning(like_table.c.id)
+    )
 
     logger.debug(query)
 
-    last_record_id = await database.execute(query)
+    async with database.transaction():
+        deleted_id = await database.fetch_val(query)
+        if deleted_id is not None:
+            await database.execute(update_like_count(like.post_id, -1))
 
-    return {**data, "id": last_record_id}
+    if deleted_id is None:
+        return {**data, "changed": discarded}
+
+    await response_cache.invalidate(post_tag(like.post_id), feed_tag("most_likes"))
+
+    return {**data, "id": deleted_id, "changed": True}
@@ -1,9 +1,44 @@
+import asyncio
+import hashlib
 import logging
-import tempfile
+import time
+import uuid
+from collections.abc import Awaitable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Annotated, TypeVar
+from urllib.parse import quote
 
-import aiofiles
-from fastapi import APIRouter, HTTPException, UploadFile, status
-from main.libs.b2 import b2_upload_file
+import httpx
+from fastapi import APIRouter, Depends, HTTPException, Response, UploadFile, status
+from main import metrics
+from main.config import config
+from main.database import (
+    database,
+    direct_upload_table,
+    insert_ignore,
+    upload_table,
+)
+from main.jobs import utcnow
+from main.libs.b2 import stream
+from main.libs.b2.stream import B2Error
+from main.models.upload import (
+    BatchUpload,
+    DirectUploadAuthorization,
+    DirectUploadComplete,
+    DirectUploadIn,
+    UploadedFile,
+)
+from main.models.user import User
+from main.resilience import UpstreamUnavailable
+from main.security import (
+    create_credentials_exception,
+    create_upload_ticket,
+    decode_token,
+    get_current_user,
+    get_subject_for_token_type,
+)
+from main.storage import B2Storage, storage
 
 logger = logging.getLogger(__name__)
 
@@ -11,22 +46,256 @@ router = APIRouter()
 
 CHUNK_SIZE = 1024 * 1024  # 1MB max size
 
+T = TypeVar("T")
 
-@router.post("/upload", status_code=201)
-async def upload_file(file: UploadFile):
+
+@dataclass
+class UploadStats:
+    uploads: int = 0
+    failed: int = 0
+    rejected: int = 0
+    in_flight: int = 0
+    upload_seconds_total: float = 0.0
+    upload_seconds_max: float = 0.0
+
+
+upload_stats = UploadStats()
+
+
+@dataclass
+class DedupStats:
+    hits: int = 0
+    misses: int = 0
+    bytes_saved: int = 0
+
+
+dedup_stats = DedupStats()
+metrics.register("upload_dedup", lambda: asdict(dedup_stats))
+metrics.register(
+    "uploads",
+    lambda: {
+        **asdict(upload_stats),
+        "concurrency": config.UPLOAD_CONCURRENCY,
+        "storage": storage.name,
+    },
+)
+
+
+@contextmanager
+def upload_slot(count: int = 1) -> Iterator[None]:
+    """Hold `count` upload slots, answering 503 once the pool and queue are full"""
+    capacity = config.UPLOAD_CONCURRENCY + config.UPLOAD_MAX_QUEUED
+    if upload_stats.in_flight + count > capacity:
+        upload_stats.rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many uploads in progress, try again later",
+            headers={"Retry-After": str(config.UPLOAD_RETRY_AFTER_SECONDS)},
+        )
+
+    upload_stats.in_flight += count
+    try:
+        yield
+    finally:
+        upload_stats.in_flight -= count
+
+
+async def track_upload(upload: Awaitable[T]) -> T:
+    """Await an upload, recording its duration and outcome"""
+    started = time.perf_counter()
     try:
-        with tempfile.NamedTemporaryFile() as temp_file:
-            filename = temp_file.name
-            logger.info(f"Saving file to {filename}")
-            async with aiofiles.open(filename, "wb") as f:
-                while chunk := await file.read(CHUNK_SIZE):
-                    await f.write(chunk)
-
-            file_url = b2_upload_file(local_file=filename, file_name=file.filename)
+        result = await upload
     except Exception:
+        upload_stats.failed += 1
+        raise
+
+    seconds = time.perf_counter() - started
+    upload_stats.uploads += 1
+    upload_stats.upload_seconds_total += seconds
+    upload_stats.upload_seconds_max = max(upload_stats.upload_seconds_max, seconds)
+    return result
+
+
+async def find_duplicate(sha256: str, size: int) -> str | None:
+    """URL of a stored file with the same content, if there is one"""
+    query = upload_table.select().where(upload_table.c.sha256 == sha256)
+    existing = await database.fetch_one(query)
+    if existing is None:
+        dedup_stats.misses += 1
+        return None
+
+    logger.info(f"Upload matches stored file {existing.file_url}")
+    dedup_stats.hits += 1
+    dedup_stats.bytes_saved += size
+    return existing.file_url
+
+
+async def record_upload(sha256: str, size: int, file_url: str, file_name: str):
+    # Concurrent uploads of the same content both miss; the first one is kept
+    query = insert_ignore(upload_table, "sha256").values(
+        sha256=sha256,
+        size=size,
+        file_url=file_url,
+        file_name=file_name,
+        created_at=utcnow(),
+    )
+    await database.execute(query)
+
+
+async def hash_file(file: UploadFile) -> tuple[str, int]:
+    """SHA-256 and size of a received upload, rewound for reading again"""
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := await file.read(CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    await file.seek(0)
+    return digest.hexdigest(), size
+
+
+async def store_file(file: UploadFile) -> str:
+    # The request body is already received, so hashing it first is a local read
+    sha256, size = await hash_file(file)
+    if (file_url := await find_duplicate(sha256, size)) is not None:
+        return file_url
+    file_url = await track_upload(
+        storage.upload(file, file.filename, file.content_type)
+    )
+
+    await record_upload(sha256, size, file_url, file.filename)
+    return file_url
+
+
+@router.post("/upload", status_code=201, response_model=UploadedFile)
+async def upload_file(file: UploadFile):
+    with upload_slot():
+        try:
+            file_url = await store_file(file)
+        except Exception:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to upload file",
+            )
+
+    return {"detail": f"Successfully uploaded {file.filename}", "file_url": file_url}
+
+
+@router.post("/upload/batch", status_code=201, response_model=BatchUpload)
+async def upload_batch(files: list[UploadFile], response: Response):
+    """Store many files in one request, a few at a time
+
+    Each file succeeds or fails on its own; the response is 207 when some
+    failed.
+    """
+    if len(files) > config.UPLOAD_BATCH_MAX_FILES:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to upload file",
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {config.UPLOAD_BATCH_MAX_FILES} files per batch",
         )
 
-    return {"detail": f"Successfully uploaded {file.filename}", "file_url": file_url}
+    concurrency = min(len(files), config.UPLOAD_BATCH_CONCURRENCY)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def store(file: UploadFile) -> dict:
+        async with semaphore:
+            try:
+                file_url = await store_file(file)
+            except Exception:
+                logger.exception(f"Failed to upload {file.filename} in batch")
+                return {"file_name": file.filename, "detail": "Failed to upload file"}
+        return {
+            "file_name": file.filename,
+            "file_url": file_url,
+            "detail": f"Successfully uploaded {file.filename}",
+        }
+
+    with upload_slot(concurrency):
+        results = await asyncio.gather(*(store(file) for file in files))
+
+    if any(result.get("file_url") is None for result in results):
+        response.status_code = status.HTTP_207_MULTI_STATUS
+    return {"files": results}
+
+
+@router.post("/upload/authorize", response_model=DirectUploadAuthorization)
+async def authorize_direct_upload(
+    upload: DirectUploadIn, current_user: Annotated[User, Depends(get_current_user)]
+):
+    """Let the client upload one file straight to the B2 bucket
+
+    The client POSTs the file to `upload_url` with `headers` and its SHA-1 in
+    X-Bz-Content-Sha1, then sends the returned file id and `ticket` to
+    /upload/complete.
+
+    The upload token comes from a key restricted to the file's unique prefix,
+    so it cannot write elsewhere in the bucket. B2 does not cap the size of
+    what is written under the prefix, and files that are never completed
+    stay in the bucket; a lifecycle rule on "uploads/" should clear those.
+    """
+    if not isinstance(storage, B2Storage):
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Direct uploads need the B2 storage backend",
+        )
+
+    name_prefix = f"uploads/{uuid.uuid4().hex}/"
+    file_name = f"{name_prefix}{upload.file_name}"
+    try:
+        target = await stream.get_scoped_upload_url(name_prefix)
+    except (B2Error, httpx.HTTPError, UpstreamUnavailable):
+        logger.exception("Failed to get a B2 upload URL")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to authorize upload",
+        )
+
+    return {
+        "upload_url": target["uploadUrl"],
+        "headers": {
+            "Authorization": target["authorizationToken"],
+            "X-Bz-File-Name": quote(file_name),
+            "Content-Type": upload.content_type or "b2/x-auto",
+        },
+        "file_name": file_name,
+        "ticket": create_upload_ticket(current_user.email, file_name),
+    }
+
+
+@router.post("/upload/complete", status_code=201, response_model=UploadedFile)
+async def complete_direct_upload(
+    upload: DirectUploadComplete,
+    current_user: Annotated[User, Depends(get_current_user)],
+):
+    if get_subject_for_token_type(upload.ticket, "upload") != current_user.email:
+        raise create_credentials_exception("Upload ticket was issued to another user")
+    file_name = decode_token(upload.ticket)["file_name"]
+
+    try:
+        info = await stream.get_file_info(upload.file_id)
+    except B2Error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Uploaded file not found"
+        )
+    account = await stream.get_account()
+    if info["fileName"] != file_name or info["bucketId"] != account.bucket_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Uploaded file does not match the upload ticket",
+        )
+
+    file_url = account.download_url_for_file_id(upload.file_id)
+    # Completing the same upload twice is harmless, so retries are safe
+    query = insert_ignore(direct_upload_table, "file_id").values(
+        file_id=upload.file_id,
+        file_name=file_name,
+        user_id=current_user.id,
+        size=info["contentLength"],
+        content_sha1=info.get("contentSha1"),
+        file_url=file_url,
+        created_at=utcnow(),
+    )
+    await database.execute(query)
+
+    logger.info(f"Recorded direct upload {file_name}")
+    name = file_name.rsplit("/", 1)[-1]
+    return {"detail": f"Successfully uploaded {name}", "file_url": file_url}
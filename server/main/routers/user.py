@@ -1,16 +1,21 @@
 import logging
 
-from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
-from main import tasks
+from fastapi import APIRouter, HTTPException, Request
+from main import jobs
 from main.database import database, user_table
-from main.models.user import UserIn
+from main.models.user import RefreshTokenIn, UserIn
 from main.security import (
     authenticate_user,
     create_access_token,
     create_confirmation_token,
+    create_refresh_token,
     get_password_hash,
     get_subject_for_token_type,
     get_user,
+    invalidate_principal,
+    offload_password_hashing,
+    refresh_access_token,
+    revoke_refresh_token,
 )
 
 logger = logging.getLogger(__name__)
@@ -18,22 +23,25 @@ router = APIRouter()
 
 
 @router.post("/register", status_code=201)
-async def register(user: UserIn, background_tasks: BackgroundTasks, request: Request):
+async def register(user: UserIn, request: Request):
     if await get_user(user.email):  # check if user exists first
         raise HTTPException(
             status_code=400, detail="A user with this email already exists"
         )
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await offload_password_hashing(get_password_hash, user.password)
     query = user_table.insert().values(email=user.email, password=hashed_password)
 
     logger.debug(query)
 
     await database.execute(query)
-    background_tasks.add_task(
-        tasks.send_user_registration_email,
-        user.email,
-        confirmation_url=request.url_for(
-            "confirm_email", token=create_confirmation_token(user.email)
+    await jobs.enqueue(
+        database,
+        "send_registration_email",
+        email=user.email,
+        confirmation_url=str(
+            request.url_for(
+                "confirm_email", token=create_confirmation_token(user.email)
+            )
         ),
     )
     return {"detail": "User created. Please confirm your email."}
@@ -43,7 +51,28 @@ async def register(user: UserIn, background_tasks: BackgroundTasks, request: Req
 async def login(user: UserIn):
     user = await authenticate_user(user.email, user.password)
     access_token = create_access_token(user.email)
-    return {"access_token": access_token, "token_type": "bearer"}
+    refresh_token = await create_refresh_token(user.email)
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+    }
+
+
+@router.post("/token/refresh")
+async def refresh_token(body: RefreshTokenIn):
+    access_token, refresh_token = await refresh_access_token(body.refresh_token)
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+    }
+
+
+@router.post("/token/revoke")
+async def revoke_token(body: RefreshTokenIn):
+    await revoke_refresh_token(body.refresh_token)
+    return {"detail": "Refresh token revoked"}
 
 
 @router.get("/confirm/{token}")
@@ -56,4 +85,5 @@ async def confirm_email(token: str):
     logger.debug(query)
 
     await database.execute(query)
-    return {"detail": "User confirmed"}
\ No newline at end of file
+    await invalidate_principal(email)
+    return {"detail": "User confirmed"}
@@ -1,14 +1,26 @@
+import asyncio
 import datetime
+import hashlib
 import logging
-from typing import Annotated, Literal
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Annotated, Literal, TypeVar
 
+import sqlalchemy
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import ExpiredSignatureError, JWTError, jwt
 from passlib.context import CryptContext
 
+from main import metrics
+from main.cache import MemoryCache, user_tag
 from main.config import config
-from main.database import database, user_table
+from main.database import database, refresh_token_table, user_table
+from main.models.user import User
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +29,98 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 pwd_context = CryptContext(schemes=["bcrypt"])
 
+T = TypeVar("T")
+
+
+@dataclass
+class PasswordHashingStats:
+    calls: int = 0
+    in_flight: int = 0
+    queue_seconds_total: float = 0.0
+    queue_seconds_max: float = 0.0
+
+
+# bcrypt releases the GIL, so a thread pool keeps hashing off the event loop and
+# its size caps how many hashes run at once
+password_hashing_executor = ThreadPoolExecutor(
+    max_workers=config.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hashing"
+)
+password_hashing_stats = PasswordHashingStats()
+
+# Authenticated principals by email, so most requests skip the users lookup
+principal_cache = MemoryCache(
+    max_entries=config.USER_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.USER_CACHE_TTL_SECONDS,
+)
+metrics.register("principal_cache", principal_cache.metrics)
+metrics.register(
+    "password_hashing",
+    lambda: {
+        **asdict(password_hashing_stats),
+        "workers": config.PASSWORD_HASH_WORKERS,
+    },
+)
+
+
+@dataclass
+class TokenCacheStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    evictions: int = 0
+
+
+class VerifiedTokenCache:
+    """LRU of decoded JWT payloads keyed by a digest of the token
+
+    An entry is only served until the token's own `exp`, so a cached token
+    expires exactly when re-verifying it would have failed.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.stats = TokenCacheStats()
+        self._entries: OrderedDict[bytes, dict] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> dict | None:
+        key = self.key(token)
+        payload = self._entries.get(key)
+        if payload is None:
+            self.stats.misses += 1
+            return None
+
+        if payload["exp"] <= time.time():
+            del self._entries[key]
+            self.stats.expired += 1
+            raise create_credentials_exception("Token has expired")
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return payload
+
+    def set(self, token: str, payload: dict) -> None:
+        if not isinstance(payload.get("exp"), (int, float)):
+            return  # tokens without an expiry are never cached
+
+        self._entries[self.key(token)] = payload
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def metrics(self) -> dict:
+        return {**asdict(self.stats), "entries": len(self)}
+
+
 def create_credentials_exception(detail: str) -> HTTPException:
     return HTTPException(
         status_code=401,
@@ -33,6 +137,14 @@ def confirm_token_expire_minutes() -> int:
     return 1440  # 24 hours
 
 
+def refresh_token_expire_minutes() -> int:
+    return 43200  # 30 days
+
+
+def upload_ticket_expire_minutes() -> int:
+    return 60
+
+
 def create_access_token(email: str):
     logger.debug("Creating access token", extra={"email": email})
     expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
@@ -53,9 +165,42 @@ def create_confirmation_token(email: str):
     return encoded_jwt
 
 
-def get_subject_for_token_type(
-    token: str, type: Literal["access", "confirmation"]
-) -> str:
+def create_upload_ticket(email: str, file_name: str):
+    """Token binding a direct upload's bucket file name to the user it was issued to"""
+    logger.debug("Creating upload ticket", extra={"email": email})
+    expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        minutes=upload_ticket_expire_minutes()
+    )
+    jwt_data = {"sub": email, "exp": expire, "type": "upload", "file_name": file_name}
+    encoded_jwt = jwt.encode(jwt_data, key=config.PWD_SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+
+async def create_refresh_token(email: str):
+    logger.debug("Creating refresh token", extra={"email": email})
+    expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        minutes=refresh_token_expire_minutes()
+    )
+    jti = uuid.uuid4().hex
+    query = refresh_token_table.insert().values(
+        jti=jti, email=email, expires_at=expire.replace(tzinfo=None), revoked=False
+    )
+    await database.execute(query)
+
+    jwt_data = {"sub": email, "exp": expire, "type": "refresh", "jti": jti}
+    encoded_jwt = jwt.encode(jwt_data, key=config.PWD_SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+
+verified_token_cache = VerifiedTokenCache(max_entries=config.TOKEN_CACHE_MAX_ENTRIES)
+metrics.register("verified_token_cache", verified_token_cache.metrics)
+
+
+def decode_token(token: str) -> dict:
+    """Verify and decode a JWT, skipping the signature check for cached tokens"""
+    if (payload := verified_token_cache.get(token)) is not None:
+        return payload
+
     try:
         payload = jwt.decode(token, key=config.PWD_SECRET_KEY, algorithms=[ALGORITHM])
     except ExpiredSignatureError as e:
@@ -63,6 +208,15 @@ def get_subject_for_token_type(
     except JWTError as e:
         raise create_credentials_exception("Invalid token") from e
 
+    verified_token_cache.set(token, payload)
+    return payload
+
+
+def get_subject_for_token_type(
+    token: str, type: Literal["access", "confirmation", "refresh", "upload"]
+) -> str:
+    payload = decode_token(token)
+
     token_type = payload.get("type")
     if token_type is None or token_type != type:
         raise create_credentials_exception(f"Token has incorrect type, expected {type}")
@@ -82,6 +236,28 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+async def offload_password_hashing(func: Callable[..., T], *args) -> T:
+    """Run a bcrypt call in the password hashing pool and await its result"""
+    submitted_at = time.perf_counter()
+
+    def run() -> T:
+        queue_seconds = time.perf_counter() - submitted_at
+        password_hashing_stats.queue_seconds_total += queue_seconds
+        password_hashing_stats.queue_seconds_max = max(
+            password_hashing_stats.queue_seconds_max, queue_seconds
+        )
+        return func(*args)
+
+    password_hashing_stats.calls += 1
+    password_hashing_stats.in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            password_hashing_executor, run
+        )
+    finally:
+        password_hashing_stats.in_flight -= 1
+
+
 async def get_user(email: str):
     logger.debug("Fetching user from the database", extra={"email": email})
 
@@ -91,13 +267,75 @@ async def get_user(email: str):
         return result
 
 
+async def get_principal(email: str) -> User | None:
+    if (principal := await principal_cache.get(email)) is not None:
+        return principal
+
+    logger.debug("Fetching principal from the database", extra={"email": email})
+
+    query = sqlalchemy.select(user_table.c.id, user_table.c.email).where(
+        user_table.c.email == email
+    )
+    result = await database.fetch_one(query)
+    if result is None:
+        return None
+
+    principal = User(id=result.id, email=result.email)
+    await principal_cache.set(email, principal, tags=[user_tag(email)])
+    return principal
+
+
+async def invalidate_principal(email: str) -> None:
+    """Call after any update to a user row"""
+    await principal_cache.invalidate(user_tag(email))
+
+
+async def revoke_refresh_token(token: str) -> str:
+    """Revoke a refresh token in a single UPDATE, returning its subject
+
+    Presenting a token that was already revoked means it was replayed, so
+    every refresh token of that user is revoked as well.
+    """
+    email = get_subject_for_token_type(token, "refresh")
+    jti = decode_token(token).get("jti")
+
+    query = (
+        refresh_token_table.update()
+        .where(
+            (refresh_token_table.c.jti == jti)
+            & (refresh_token_table.c.revoked == sqlalchemy.false())
+        )
+        .values(revoked=True)
+        .returning(refresh_token_table.c.jti)
+    )
+    if await database.fetch_val(query) is None:
+        logger.warning("Refresh token reused, revoking all", extra={"email": email})
+        query = (
+            refresh_token_table.update()
+            .where(refresh_token_table.c.email == email)
+            .values(revoked=True)
+        )
+        await database.execute(query)
+        raise create_credentials_exception("Refresh token has been revoked")
+
+    return email
+
+
+async def refresh_access_token(token: str) -> tuple[str, str]:
+    """Rotate a refresh token into a new access and refresh token pair"""
+    email = await revoke_refresh_token(token)
+    if await get_principal(email) is None:
+        raise create_credentials_exception("Could not find user for this token")
+    return create_access_token(email), await create_refresh_token(email)
+
+
 async def authenticate_user(email: str, password: str):
     logger.debug("Authenticating user", extra={"email": email})
 
     user = await get_user(email)
     if not user:
         raise create_credentials_exception("Invalid email or password")
-    if not verify_password(password, user.password):
+    if not await offload_password_hashing(verify_password, password, user.password):
         raise create_credentials_exception("Invalid email or password")
     if not user.confirmed:
         raise create_credentials_exception("User has not confirmed email")
@@ -106,7 +344,7 @@ async def authenticate_user(email: str, password: str):
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     email = get_subject_for_token_type(token, "access")
-    user = await get_user(email=email)
+    user = await get_principal(email)
     if user is None:
         raise create_credentials_exception("Could not find user for this token")
     return user
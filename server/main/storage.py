@@ -0,0 +1,117 @@
+import asyncio
+import io
+import logging
+import tempfile
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePath
+from urllib.parse import quote
+
+import aiofiles
+
+from main.config import config
+from main.libs.b2 import b2_upload_file
+from main.libs.b2.stream import AsyncReadable, stream_upload
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class BytesReader:
+    """In-memory content as the async file storage backends read from"""
+
+    def __init__(self, data: bytes) -> None:
+        self._buffer = io.BytesIO(data)
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._buffer.read(size)
+
+
+class Storage(ABC):
+    """Where uploaded and generated files are kept"""
+
+    name: str
+
+    @abstractmethod
+    async def upload(
+        self, file: AsyncReadable, file_name: str, content_type: str | None = None
+    ) -> str:
+        """Store the file and return its download URL"""
+
+    async def upload_bytes(
+        self, data: bytes, file_name: str, content_type: str | None = None
+    ) -> str:
+        return await self.upload(BytesReader(data), file_name, content_type)
+
+
+class B2Storage(Storage):
+    """Backblaze B2 bucket, streamed or spooled through b2sdk per UPLOAD_STREAMING"""
+
+    name = "b2"
+
+    def __init__(self, upload_concurrency: int) -> None:
+        # b2sdk blocks, so its uploads run in their own pool whose size caps them
+        self.executor = ThreadPoolExecutor(
+            max_workers=upload_concurrency, thread_name_prefix="b2-upload"
+        )
+
+    async def upload(
+        self, file: AsyncReadable, file_name: str, content_type: str | None = None
+    ) -> str:
+        if config.UPLOAD_STREAMING:
+            return await stream_upload(file, file_name, content_type)
+
+        with tempfile.NamedTemporaryFile() as temp_file:
+            filename = temp_file.name
+            logger.info(f"Saving file to {filename}")
+            async with aiofiles.open(filename, "wb") as f:
+                while chunk := await file.read(CHUNK_SIZE):
+                    await f.write(chunk)
+
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, b2_upload_file, filename, file_name
+            )
+
+
+class LocalStorage(Storage):
+    """Files on local disk, served by the /files route"""
+
+    name = "local"
+
+    def __init__(self, root: str | Path, base_url: str) -> None:
+        self.root = Path(root).resolve()
+        self.base_url = base_url.rstrip("/")
+
+    def path(self, key: str) -> Path:
+        """Path of a stored file, refusing keys that point outside the root"""
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root) or path == self.root:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    async def upload(
+        self, file: AsyncReadable, file_name: str, content_type: str | None = None
+    ) -> str:
+        # Keys are never reused, so the files can be cached forever
+        key = f"{uuid.uuid4().hex}/{PurePath(file_name).name or 'file'}"
+        path = self.path(key)
+        await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+
+        async with aiofiles.open(path, "wb") as f:
+            while chunk := await file.read(CHUNK_SIZE):
+                await f.write(chunk)
+
+        logger.debug(f"Stored {file_name} at {path}")
+        return f"{self.base_url}/{quote(key)}"
+
+
+def create_storage() -> Storage:
+    if config.STORAGE_BACKEND == "local":
+        logger.info(f"Storing files in {config.LOCAL_STORAGE_PATH}")
+        return LocalStorage(config.LOCAL_STORAGE_PATH, config.LOCAL_STORAGE_BASE_URL)
+    return B2Storage(config.UPLOAD_CONCURRENCY)
+
+
+storage = create_storage()
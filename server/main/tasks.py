@@ -1,75 +1,148 @@
+import asyncio
+import json
 import logging
 from json import JSONDecodeError
 
 import httpx
 from databases import Database
 
+from main import images, metrics
+from main.cache import MemoryCache, post_tag
+from main.cache_invalidations import invalidation_log
 from main.config import config
 from main.database import post_table
+from main.http_clients import get_client
+from main.resilience import guard
 
 logger = logging.getLogger(__name__)
 
 
 class APIResponseError(Exception):
-    pass
+    def __init__(self, message: str, status_code: int | None = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def _send_mailgun_message(data: dict) -> httpx.Response:
+    client = get_client("mailgun")
+    try:
+        response = await guard("mailgun").call(
+            client.post,
+            f"/{config.MAILGUN_DOMAIN}/messages",
+            auth=("api", config.MAILGUN_API_KEY),
+            data={"from": f"Ryan V <mailgun@{config.MAILGUN_DOMAIN}>", **data},
+        )
+        response.raise_for_status()
+
+        logger.debug(response.content)
+
+        return response
+    except httpx.HTTPStatusError as err:
+        raise APIResponseError(
+            f"API request failed with status code {err.response.status_code}",
+            status_code=err.response.status_code,
+        ) from err
 
 
 async def send_simple_email(to: str, subject: str, body: str):
     logger.debug(f"Sending email to '{to}' with subject '{subject[:20]}'")
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"https://api.mailgun.net/v3/{config.MAILGUN_DOMAIN}/messages",
-                auth=("api", config.MAILGUN_API_KEY),
-                data={
-                    "from": f"Ryan V <mailgun@{config.MAILGUN_DOMAIN}>",
-                    "to": [to],
-                    "subject": subject,
-                    "text": body,
-                },
-            )
-            response.raise_for_status()
-
-            logger.debug(response.content)
-
-            return response
-        except httpx.HTTPStatusError as err:
-            raise APIResponseError(
-                f"API request failed with status code {err.response.status_code}"
-            ) from err
-
-
-async def send_user_registration_email(email: str, confirmation_url: str):
-    return await send_simple_email(
-        email,
-        "Successfully signed up",
-        (
-            f"Hi {email}! You have successfully signed up to the RV Social REST API."
-            " Please confirm your email by clicking on the"
-            f" following link: {confirmation_url}"
-        ),
+    return await _send_mailgun_message({"to": [to], "subject": subject, "text": body})
+
+
+MAILGUN_MAX_RECIPIENTS = 1000  # per batch send
+
+REGISTRATION_EMAIL_SUBJECT = "Successfully signed up"
+# Batch sends fill %recipient.<name>% in from each recipient's variables
+REGISTRATION_EMAIL_BODY = (
+    "Hi %recipient.email%! You have successfully signed up to the RV Social REST API."
+    " Please confirm your email by clicking on the"
+    " following link: %recipient.confirmation_url%"
+)
+
+
+async def send_batch_email(
+    recipient_variables: dict[str, dict], subject: str, body: str
+):
+    """Send one message per recipient in a single Mailgun request"""
+    if len(recipient_variables) > MAILGUN_MAX_RECIPIENTS:
+        raise ValueError(f"At most {MAILGUN_MAX_RECIPIENTS} recipients per batch")
+
+    logger.debug(
+        f"Sending email to {len(recipient_variables)} recipients"
+        f" with subject '{subject[:20]}'"
+    )
+    return await _send_mailgun_message(
+        {
+            "to": list(recipient_variables),
+            "subject": subject,
+            "text": body,
+            "recipient-variables": json.dumps(recipient_variables),
+        }
     )
 
 
 async def _generate_cute_creature_api(prompt: str):
     logger.debug("Generating cute creature")
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                "https://api/deepai.org/api/cute-creature-generator",
-                data={"text": prompt},
-                headers={"api-key": config.DEEPAI_API_KEY},
-                timeout=60,
-            )
-            logger.debug(response)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as err:
-            raise APIResponseError(
-                f"API request failed with status code {err.response.status_code}"
-            ) from err
-        except (JSONDecodeError, TypeError) as err:
-            raise APIResponseError("API response parsing failed") from err
+    client = get_client("deepai")
+    try:
+        response = await guard("deepai").call(
+            client.post,
+            "/api/cute-creature-generator",
+            data={"text": prompt},
+            headers={"api-key": config.DEEPAI_API_KEY},
+        )
+        logger.debug(response)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as err:
+        raise APIResponseError(
+            f"API request failed with status code {err.response.status_code}"
+        ) from err
+    except (JSONDecodeError, TypeError) as err:
+        raise APIResponseError("API response parsing failed") from err
+
+
+# Generated images by normalized prompt, so repeated prompts skip the upstream call
+image_cache = MemoryCache(
+    max_entries=config.IMAGE_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.IMAGE_CACHE_TTL_SECONDS,
+)
+_image_requests: dict[str, asyncio.Future] = {}
+image_requests_deduplicated = 0
+metrics.register(
+    "image_cache",
+    lambda: {
+        **image_cache.metrics(),
+        "in_flight": len(_image_requests),
+        "deduplicated": image_requests_deduplicated,
+    },
+)
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+
+async def generate_cute_creature(prompt: str):
+    """Cached _generate_cute_creature_api; concurrent identical prompts share a call"""
+    global image_requests_deduplicated
+
+    key = normalize_prompt(prompt)
+    if (cached := await image_cache.get(key)) is not None:
+        return cached
+
+    request = _image_requests.get(key)
+    if request is None:
+        request = asyncio.ensure_future(_generate_cute_creature_api(prompt))
+        _image_requests[key] = request
+        request.add_done_callback(lambda _: _image_requests.pop(key, None))
+    else:
+        image_requests_deduplicated += 1
+
+    # Shielded so one cancelled waiter does not cancel the call for the others
+    response = await asyncio.shield(request)
+    await image_cache.set(key, response)
+    return response
 
 
 async def generate_and_add_to_post(
@@ -80,7 +153,9 @@ async def generate_and_add_to_post(
     prompt: str = "An orange shorthair dog sitting on a tree stump",
 ):
     try:
-        response = await _generate_cute_creature_api(prompt)
+        response = await generate_cute_creature(prompt)
+    # UpstreamUnavailable is left to the job queue, which waits for DeepAI's
+    # circuit to half-open without using up an attempt
     except APIResponseError:
         return await send_simple_email(
             email,
@@ -92,17 +167,20 @@ async def generate_and_add_to_post(
             ),
         )
 
+    image = {"image_url": response["output_url"]}
+    if config.IMAGE_MIRROR:
+        # Feeds then load our copy and its smaller derivatives, not DeepAI's
+        image = await images.mirror_image(response["output_url"], post_id)
+
     logger.debug("Connecting to database to update post")
 
-    query = (
-        post_table.update()
-        .where(post_table.c.id == post_id)
-        .values(image_url=response["output_url"])
-    )
+    query = post_table.update().where(post_table.c.id == post_id).values(**image)
 
     logger.debug(query)
 
     await database.execute(query)
+    # This runs in the job worker, so the web processes' caches are told too
+    await invalidation_log.publish(post_tag(post_id))
 
     logger.debug("Database connecting in background task closed")
 
@@ -115,4 +193,4 @@ async def generate_and_add_to_post(
         ),
     )
 
-    return response
\ No newline at end of file
+    return response
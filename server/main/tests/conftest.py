@@ -5,11 +5,16 @@ from unittest.mock import AsyncMock, Mock
 
 import pytest
 from fastapi.testclient import TestClient
-from httpx import AsyncClient, Request, Response
+from httpx import ASGITransport, AsyncClient, Request, Response
 
 os.environ["ENV_STATE"] = "test"  # Overwrite env for testing
+from main import migrations, resilience, security, tasks
+from main.cache import response_cache
+from main.config import config
 from main.database import database, user_table
+from main.libs.b2 import stream
 from main.main import app
+from main.tests.fake_b2 import create_fake_b2
 from main.tests.helpers import create_post  # noqa: E402
 
 
@@ -18,6 +23,11 @@ def anyio_backend():
     return "asyncio"
 
 
+@pytest.fixture(scope="session", autouse=True)
+def migrated_db() -> None:
+    migrations.upgrade(migrations.create_engine(config.DATABASE_URL))
+
+
 @pytest.fixture()
 def client() -> Generator:
     print("Getting test client")
@@ -31,6 +41,16 @@ async def db() -> AsyncGenerator:
     await database.disconnect()
 
 
+@pytest.fixture(autouse=True)
+async def clear_caches() -> AsyncGenerator:
+    yield
+    await response_cache.clear()  # cached rows outlive the rolled back DB
+    await security.principal_cache.clear()
+    security.verified_token_cache.clear()
+    await tasks.image_cache.clear()
+    resilience.reset()
+
+
 @pytest.fixture()
 async def async_client(client) -> AsyncGenerator:
     async with AsyncClient(app=app, base_url=client.base_url) as ac:
@@ -67,17 +87,28 @@ async def logged_in_token(async_client: AsyncClient, confirmed_user: dict) -> st
 
 @pytest.fixture(autouse=True)
 def mock_httpx_client(mocker):
-    mocked_client = mocker.patch("main.tasks.httpx.AsyncClient")
-
     mocked_async_client = Mock()
     response = Response(status_code=200, content="", request=Request("POST", "//"))
 
     mocked_async_client.post = AsyncMock(return_value=response)
-    mocked_client.return_value.__aenter__.return_value = mocked_async_client
+    mocker.patch("main.tasks.get_client", return_value=mocked_async_client)
 
     return mocked_async_client
 
 
 @pytest.fixture()
 async def created_post(async_client: AsyncClient, logged_in_token: str):
-    return await create_post("Test Post", async_client, logged_in_token)
\ No newline at end of file
+    return await create_post("Test Post", async_client, logged_in_token)
+
+
+@pytest.fixture()
+async def fake_b2(mocker) -> AsyncGenerator:
+    mocker.patch.object(config, "B2_BUCKET_NAME", "test-bucket")
+    stream.reset_account()
+    fake_app = create_fake_b2()
+    async with AsyncClient(
+        transport=ASGITransport(app=fake_app), base_url="https://api.backblazeb2.com"
+    ) as b2_client:
+        mocker.patch("main.libs.b2.stream.get_client", return_value=b2_client)
+        yield fake_app
+    stream.reset_account()
@@ -0,0 +1,196 @@
+import asyncio
+import base64
+import hashlib
+import itertools
+from urllib.parse import unquote
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+# Stand-in for the B2 native API: one app answers for the account, API and
+# upload hosts, and keeps uploaded files in memory
+
+API_URL = "https://api000.backblazeb2.test"
+DOWNLOAD_URL = "https://f000.backblazeb2.test"
+UPLOAD_URL = "https://pod-000.backblazeb2.test"
+
+
+def create_fake_b2(bucket_name: str = "test-bucket") -> FastAPI:
+    app = FastAPI()
+    app.state.files = {}  # file id -> {"name", "data"}
+    app.state.large_files = {}  # file id -> {"name", "parts"}
+    app.state.calls = []
+    app.state.parts_in_flight = 0
+    app.state.max_parts_in_flight = 0
+    app.state.part_delay = 0  # seconds each part upload takes
+    app.state.tokens = set()  # account tokens that are still valid
+    app.state.keys = {}  # restricted application key id -> name prefix
+    app.state.name_prefixes = {}  # account or upload token -> writable prefix
+    ids = itertools.count(1)
+    tokens = itertools.count(1)
+
+    @app.middleware("http")
+    async def check_account_token(request: Request, call_next):
+        # Upload URLs carry their own tokens, the other APIs the account token
+        name = request.url.path.rsplit("/", 1)[-1]
+        upload_urls = "/b2_upload_file/" in request.url.path
+        upload_urls = upload_urls or "/b2_upload_part/" in request.url.path
+        if (
+            name != "b2_authorize_account"
+            and not upload_urls
+            and request.headers.get("Authorization") not in app.state.tokens
+        ):
+            return JSONResponse(
+                {"status": 401, "code": "expired_auth_token", "message": ""},
+                status_code=401,
+            )
+        return await call_next(request)
+
+    def record(name: str) -> None:
+        app.state.calls.append(name)
+
+    async def body_with_sha1(request: Request) -> bytes:
+        data = await request.body()
+        if hashlib.sha1(data).hexdigest() != request.headers["X-Bz-Content-Sha1"]:
+            raise HTTPException(400, detail="sha1 mismatch")
+        return data
+
+    @app.get("/b2api/v2/b2_authorize_account")
+    async def authorize_account(request: Request):
+        record("b2_authorize_account")
+        credentials = request.headers["Authorization"].removeprefix("Basic ")
+        key_id = base64.b64decode(credentials).decode().split(":")[0]
+        name_prefix = app.state.keys.get(key_id)
+
+        token = f"account-token-{next(tokens)}"
+        app.state.tokens.add(token)
+        app.state.name_prefixes[token] = name_prefix or ""
+        allowed = {"bucketId": None, "bucketName": None}
+        if name_prefix is not None:
+            allowed = {
+                "bucketId": "bucket",
+                "bucketName": bucket_name,
+                "namePrefix": name_prefix,
+            }
+        return {
+            "accountId": "account",
+            "authorizationToken": token,
+            "apiUrl": API_URL,
+            "downloadUrl": DOWNLOAD_URL,
+            "allowed": allowed,
+        }
+
+    @app.post("/b2api/v2/b2_create_key")
+    async def create_key(request: Request):
+        record("b2_create_key")
+        payload = await request.json()
+        key_id = f"key{next(ids)}"
+        app.state.keys[key_id] = payload["namePrefix"]
+        return {"applicationKeyId": key_id, "applicationKey": f"secret-{key_id}"}
+
+    @app.post("/b2api/v2/b2_list_buckets")
+    async def list_buckets(request: Request):
+        record("b2_list_buckets")
+        payload = await request.json()
+        if payload["bucketName"] != bucket_name:
+            return {"buckets": []}
+        return {"buckets": [{"bucketId": "bucket", "bucketName": bucket_name}]}
+
+    @app.post("/b2api/v2/b2_get_upload_url")
+    async def get_upload_url(request: Request):
+        record("b2_get_upload_url")
+        # Upload tokens can write where the account token they came from can
+        token = f"upload-token-{next(tokens)}"
+        account_token = request.headers["Authorization"]
+        app.state.name_prefixes[token] = app.state.name_prefixes[account_token]
+        return {
+            "uploadUrl": f"{UPLOAD_URL}/b2api/v2/b2_upload_file/bucket",
+            "authorizationToken": token,
+        }
+
+    @app.post("/b2api/v2/b2_upload_file/{bucket_id}")
+    async def upload_file(bucket_id: str, request: Request):
+        record("b2_upload_file")
+        name = unquote(request.headers["X-Bz-File-Name"])
+        name_prefix = app.state.name_prefixes.get(request.headers["Authorization"])
+        if name_prefix is None or not name.startswith(name_prefix):
+            return JSONResponse(
+                {"status": 401, "code": "unauthorized", "message": ""},
+                status_code=401,
+            )
+        data = await body_with_sha1(request)
+        file_id = f"file{next(ids)}"
+        app.state.files[file_id] = {"name": name, "data": data}
+        return {"fileId": file_id, "fileName": name, "contentLength": len(data)}
+
+    @app.post("/b2api/v2/b2_get_file_info")
+    async def get_file_info(request: Request):
+        record("b2_get_file_info")
+        payload = await request.json()
+        if (file := app.state.files.get(payload["fileId"])) is None:
+            raise HTTPException(404, detail="file not found")
+        return {
+            "fileId": payload["fileId"],
+            "fileName": file["name"],
+            "bucketId": "bucket",
+            "contentLength": len(file["data"]),
+            "contentSha1": hashlib.sha1(file["data"]).hexdigest(),
+        }
+
+    @app.post("/b2api/v2/b2_start_large_file")
+    async def start_large_file(request: Request):
+        record("b2_start_large_file")
+        payload = await request.json()
+        file_id = f"file{next(ids)}"
+        app.state.large_files[file_id] = {"name": payload["fileName"], "parts": {}}
+        return {"fileId": file_id, "fileName": payload["fileName"]}
+
+    @app.post("/b2api/v2/b2_get_upload_part_url")
+    async def get_upload_part_url(request: Request):
+        record("b2_get_upload_part_url")
+        payload = await request.json()
+        return {
+            "uploadUrl": f"{UPLOAD_URL}/b2api/v2/b2_upload_part/{payload['fileId']}",
+            "authorizationToken": "upload-token",
+        }
+
+    @app.post("/b2api/v2/b2_upload_part/{file_id}")
+    async def upload_part(file_id: str, request: Request):
+        record("b2_upload_part")
+        app.state.parts_in_flight += 1
+        app.state.max_parts_in_flight = max(
+            app.state.max_parts_in_flight, app.state.parts_in_flight
+        )
+        try:
+            data = await body_with_sha1(request)
+            await asyncio.sleep(app.state.part_delay)
+        finally:
+            app.state.parts_in_flight -= 1
+        part_number = int(request.headers["X-Bz-Part-Number"])
+        app.state.large_files[file_id]["parts"][part_number] = data
+        return {"fileId": file_id, "partNumber": part_number}
+
+    @app.post("/b2api/v2/b2_finish_large_file")
+    async def finish_large_file(request: Request):
+        record("b2_finish_large_file")
+        payload = await request.json()
+        large_file = app.state.large_files.pop(payload["fileId"])
+        parts = [large_file["parts"][n] for n in sorted(large_file["parts"])]
+        if len(parts) < 2:
+            raise HTTPException(400, detail="large files need at least two parts")
+        if [hashlib.sha1(p).hexdigest() for p in parts] != payload["partSha1Array"]:
+            raise HTTPException(400, detail="partSha1Array mismatch")
+        app.state.files[payload["fileId"]] = {
+            "name": large_file["name"],
+            "data": b"".join(parts),
+        }
+        return {"fileId": payload["fileId"]}
+
+    @app.post("/b2api/v2/b2_cancel_large_file")
+    async def cancel_large_file(request: Request):
+        record("b2_cancel_large_file")
+        payload = await request.json()
+        app.state.large_files.pop(payload["fileId"], None)
+        return {"fileId": payload["fileId"]}
+
+    return app
@@ -0,0 +1,45 @@
+import json
+import re
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Stand-in for the Mailgun messages API, which delivers (here: records) one
+# message per recipient with its recipient-variables substituted. Like Mailgun
+# it refuses the whole request if any address is malformed
+
+
+def render(template: str, variables: dict) -> str:
+    return re.sub(
+        r"%recipient\.(\w+)%",
+        lambda match: str(variables.get(match.group(1), "")),
+        template,
+    )
+
+
+def create_fake_mailgun() -> FastAPI:
+    app = FastAPI()
+    app.state.requests = 0
+    app.state.messages = []
+
+    @app.post("/v3/{domain}/messages")
+    async def messages(domain: str, request: Request):
+        form = await request.form(max_fields=5000)
+        recipient_variables = json.loads(form.get("recipient-variables", "{}"))
+        app.state.requests += 1
+        if any("@" not in to for to in form.getlist("to")):
+            return JSONResponse(
+                {"message": "'to' parameter is not a valid address"}, 400
+            )
+        for to in form.getlist("to"):
+            variables = recipient_variables.get(to, {})
+            app.state.messages.append(
+                {
+                    "to": to,
+                    "subject": render(form["subject"], variables),
+                    "text": render(form["text"], variables),
+                }
+            )
+        return {"id": f"<{app.state.requests}@{domain}>", "message": "Queued"}
+
+    return app
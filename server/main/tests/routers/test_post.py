@@ -1,8 +1,13 @@
+import json
+
 import pytest
+from databases import Database
 from httpx import AsyncClient
 
 from main import security
-from main.tests.helpers import create_comment, create_post, like_post
+from main.config import config
+from main.jobs import Worker
+from main.tests.helpers import create_comment, create_post, like_post, unlike_post
 
 
 ##### FIXTURES #####
@@ -48,7 +53,10 @@ async def test_create_post(
 
 @pytest.mark.anyio
 async def test_create_post_with_prompt(
-    async_client: AsyncClient, logged_in_token: str, mock_generate_cute_creature_api
+    async_client: AsyncClient,
+    logged_in_token: str,
+    mock_generate_cute_creature_api,
+    db: Database,
 ):
     body = "Test post"
 
@@ -64,6 +72,9 @@ async def test_create_post_with_prompt(
         "body": body,
         "image_url": None,
     }.items() <= response.json().items()
+    mock_generate_cute_creature_api.assert_not_called()  # queued, not inline
+
+    await Worker(db, poll_interval=0).run_once()
     mock_generate_cute_creature_api.assert_called()
 
 
@@ -105,12 +116,92 @@ async def test_like_post(
     assert response.status_code == 201
 
 
+@pytest.mark.anyio
+async def test_like_post_twice(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    first = await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.post(
+        "/like",
+        json={"post_id": created_post["id"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {**first, "changed": False}
+
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_like_missing_post(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post(
+        "/like",
+        json={"post_id": 2},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_unlike_post(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    unliked = await unlike_post(created_post["id"], async_client, logged_in_token)
+    assert unliked["changed"]
+    unliked = await unlike_post(created_post["id"], async_client, logged_in_token)
+    assert not unliked["changed"]
+
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["likes"] == 0
+
+
+@pytest.mark.anyio
+async def test_like_post_write_behind(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str, mocker
+):
+    mocker.patch.object(config, "LIKE_WRITE_BEHIND", True)
+    add = mocker.patch("main.routers.post.like_buffer.add")
+
+    response = await async_client.post(
+        "/like",
+        json={"post_id": created_post["id"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 202
+    assert response.json()["id"] is None
+    add.assert_awaited_once()
+
+
+@pytest.mark.anyio
+async def test_unlike_post_write_behind_deletes_stored_like(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str, mocker
+):
+    await like_post(created_post["id"], async_client, logged_in_token)
+    mocker.patch.object(config, "LIKE_WRITE_BEHIND", True)
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    unliked = await unlike_post(created_post["id"], async_client, logged_in_token)
+    assert unliked["changed"]
+    assert unliked["id"] is not None
+
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["likes"] == 0
+
+
 @pytest.mark.anyio
 async def test_get_all_posts(async_client: AsyncClient, created_post: dict):
     response = await async_client.get("/post")
 
     assert response.status_code == 200
-    assert response.json() == [{**created_post, "likes": 0}]
+    assert response.json() == {
+        "posts": [{**created_post, "likes": 0}],
+        "next_cursor": None,
+    }
 
 
 @pytest.mark.anyio
@@ -126,7 +217,7 @@ async def test_get_all_post_sorting(
     response = await async_client.get("/post", params={"sorting": sorting})
     assert response.status_code == 200
 
-    data = response.json()
+    data = response.json()["posts"]
     post_ids = [post["id"] for post in data]
     assert post_ids == expected_order
 
@@ -142,12 +233,111 @@ async def test_get_all_posts_sort_likes(
     response = await async_client.get("/post", params={"sorting": "most_likes"})
     assert response.status_code == 200
 
-    data = response.json()
+    data = response.json()["posts"]
     post_ids = [post["id"] for post in data]
     expected_order = [1, 2]
     assert post_ids == expected_order
 
 
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "sorting, expected_order",
+    [("new", [3, 2, 1]), ("old", [1, 2, 3]), ("most_likes", [2, 3, 1])],
+)
+async def test_get_all_posts_pagination(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sorting: str,
+    expected_order: list[int],
+):
+    for i in range(3):
+        await create_post(f"Test Post {i}", async_client, logged_in_token)
+    await like_post(2, async_client, logged_in_token)
+
+    post_ids = []
+    cursor = None
+    while True:
+        params = {"sorting": sorting, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = await async_client.get("/post", params=params)
+        assert response.status_code == 200
+
+        data = response.json()
+        assert len(data["posts"]) <= 2
+        post_ids += [post["id"] for post in data["posts"]]
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert post_ids == expected_order
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_cache_invalidated_by_like(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    response = await async_client.get("/post")
+    assert response.json()["posts"][0]["likes"] == 0
+
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.get("/post")
+    assert response.json()["posts"][0]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_stream(async_client: AsyncClient, logged_in_token: str):
+    posts = [
+        await create_post(f"Test Post {i}", async_client, logged_in_token)
+        for i in range(3)
+    ]
+
+    response = await async_client.get("/post", params={"stream": True, "limit": 1})
+
+    assert response.status_code == 200
+    assert response.json() == [{**post, "likes": 0} for post in reversed(posts)]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_stream_ndjson(
+    async_client: AsyncClient, logged_in_token: str
+):
+    posts = [
+        await create_post(f"Test Post {i}", async_client, logged_in_token)
+        for i in range(2)
+    ]
+
+    response = await async_client.get(
+        "/post",
+        params={"sorting": "old"},
+        headers={"Accept": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {**post, "likes": 0} for post in posts
+    ]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_stream_empty(async_client: AsyncClient):
+    response = await async_client.get("/post", params={"stream": True})
+
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_invalid_cursor(
+    async_client: AsyncClient, created_post: dict
+):
+    response = await async_client.get("/post", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
 # @pytest.mark.anyio
 # async def test_get_all_posts_wrong_sorting(async_client: AsyncClient):
 #     response await async_client.get("/post", params={"sorting": "wrong"})
@@ -212,6 +402,48 @@ async def test_get_post_with_comments(
     }
 
 
+@pytest.mark.anyio
+async def test_get_post_without_comments(
+    async_client: AsyncClient, created_post: dict
+):
+    response = await async_client.get(f"/post/{created_post['id']}")
+
+    assert response.status_code == 200
+    assert response.json() == {"post": {**created_post, "likes": 0}, "comments": []}
+
+
+@pytest.mark.anyio
+async def test_get_post_with_comments_limit(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    for i in range(3):
+        await create_comment(
+            f"Test Comment {i}", created_post["id"], async_client, logged_in_token
+        )
+
+    response = await async_client.get(
+        f"/post/{created_post['id']}", params={"comment_limit": 2}
+    )
+
+    assert response.status_code == 200
+    assert [comment["id"] for comment in response.json()["comments"]] == [1, 2]
+
+
+@pytest.mark.anyio
+async def test_get_post_with_comments_cache_invalidated_by_comment(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["comments"] == []
+
+    comment = await create_comment(
+        "Test Comment", created_post["id"], async_client, logged_in_token
+    )
+
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["comments"] == [comment]
+
+
 @pytest.mark.anyio
 async def test_get_missing_post_with_comments(
     async_client: AsyncClient,
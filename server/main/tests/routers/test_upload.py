@@ -1,10 +1,19 @@
+import asyncio
 import contextlib
+import hashlib
 import os
 import pathlib
 import tempfile
+import threading
+import time
 
 import pytest
-from httpx import AsyncClient
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from main.config import config
+from main.database import direct_upload_table
+from main.routers import upload
 
 
 @pytest.fixture()
@@ -17,7 +26,7 @@ def sample_image(fs) -> pathlib.Path:
 @pytest.fixture(autouse=True)
 def mock_b2_upload_file(mocker):
     return mocker.patch(
-        "main.routers.upload.b2_upload_file", return_value="https://fakeurl.com"
+        "main.storage.b2_upload_file", return_value="https://fakeurl.com"
     )
 
 
@@ -69,3 +78,345 @@ async def test_temp_file_removed_after_upload(
 
     assert not os.path.exists(created_temp_file.name)
     assert created_temp_file.closed
+
+
+@pytest.mark.anyio
+async def test_upload_runs_in_upload_pool(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    mock_b2_upload_file,
+):
+    threads = []
+    mock_b2_upload_file.side_effect = lambda *args: (
+        threads.append(threading.current_thread().name) or "https://fakeurl.com"
+    )
+
+    response = await call_upload_endpoint(async_client, logged_in_token, sample_image)
+
+    assert response.status_code == 201
+    assert threads[0].startswith("b2-upload")
+
+
+@pytest.mark.anyio
+async def test_upload_rejected_when_saturated(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    mock_b2_upload_file,
+    mocker,
+):
+    mocker.patch.object(upload.upload_stats, "in_flight", 1000)
+
+    response = await call_upload_endpoint(async_client, logged_in_token, sample_image)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    mock_b2_upload_file.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_upload_benchmark_keeps_loop_responsive(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    mock_b2_upload_file,
+):
+    # Benchmark of other requests' latency while slow uploads are in progress,
+    # against the same requests on an idle server in the same run
+    upload_seconds = 1.0
+
+    def slow_upload(*args):
+        time.sleep(upload_seconds)
+        return "https://fakeurl.com"
+
+    mock_b2_upload_file.side_effect = slow_upload
+    idle_latencies = []
+    for _ in range(5):
+        started = time.perf_counter()
+        await async_client.get("/metrics")
+        idle_latencies.append(time.perf_counter() - started)
+
+    uploads = [
+        asyncio.create_task(
+            call_upload_endpoint(async_client, logged_in_token, sample_image)
+        )
+        for _ in range(4)
+    ]
+    latencies = []
+    while not all(upload.done() for upload in uploads):
+        started = time.perf_counter()
+        response = await async_client.get("/metrics")
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200
+        await asyncio.sleep(0.05)
+
+    assert [upload.result().status_code for upload in uploads] == [201] * 4
+    print(
+        f"max /metrics latency during uploads: {max(latencies) * 1e3:.1f}ms,"
+        f" idle: {max(idle_latencies) * 1e3:.1f}ms"
+    )
+    # An upload blocking the loop would hold a request up for the whole upload
+    assert max(latencies) < max(idle_latencies) + upload_seconds / 2
+
+
+@pytest.mark.anyio
+async def test_upload_streaming(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    mock_b2_upload_file,
+    mocker,
+):
+    mocker.patch.object(config, "UPLOAD_STREAMING", True)
+    stream_upload = mocker.patch(
+        "main.storage.stream_upload", return_value="https://fakeurl.com"
+    )
+
+    response = await call_upload_endpoint(async_client, logged_in_token, sample_image)
+
+    assert response.status_code == 201
+    assert response.json()["file_url"] == "https://fakeurl.com"
+    assert stream_upload.call_args.args[1] == "myfile.png"
+    mock_b2_upload_file.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_upload_same_content_reuses_stored_file(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    mock_b2_upload_file,
+):
+    sample_image.write_bytes(b"image bytes")
+    hits = upload.dedup_stats.hits
+
+    first = await call_upload_endpoint(async_client, logged_in_token, sample_image)
+    second = await call_upload_endpoint(async_client, logged_in_token, sample_image)
+
+    assert first.status_code == second.status_code == 201
+    assert second.json()["file_url"] == first.json()["file_url"]
+    assert mock_b2_upload_file.call_count == 1
+    assert upload.dedup_stats.hits == hits + 1
+
+
+@pytest.mark.anyio
+async def test_upload_different_content_is_stored(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    mock_b2_upload_file,
+):
+    sample_image.write_bytes(b"image bytes")
+    await call_upload_endpoint(async_client, logged_in_token, sample_image)
+    sample_image.write_bytes(b"other image bytes")
+    await call_upload_endpoint(async_client, logged_in_token, sample_image)
+
+    assert mock_b2_upload_file.call_count == 2
+
+
+@pytest.mark.anyio
+async def test_upload_streaming_reuses_stored_file(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    mocker,
+):
+    mocker.patch.object(config, "UPLOAD_STREAMING", True)
+    stream_upload = mocker.patch(
+        "main.storage.stream_upload", return_value="https://fakeurl.com"
+    )
+    sample_image.write_bytes(b"image bytes")
+    bytes_saved = upload.dedup_stats.bytes_saved
+
+    for _ in range(2):
+        response = await call_upload_endpoint(
+            async_client, logged_in_token, sample_image
+        )
+        assert response.json()["file_url"] == "https://fakeurl.com"
+
+    assert stream_upload.call_count == 1
+    assert upload.dedup_stats.bytes_saved == bytes_saved + len(b"image bytes")
+
+
+async def direct_upload(
+    async_client: AsyncClient, token: str, fake_b2: FastAPI, data: bytes
+) -> dict:
+    response = await async_client.post(
+        "/upload/authorize",
+        json={"file_name": "my file.png", "content_type": "image/png"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 200
+    authorization = response.json()
+
+    # The client sends the bytes to the bucket, not to the API
+    async with AsyncClient(transport=ASGITransport(app=fake_b2)) as b2_client:
+        uploaded = await b2_client.post(
+            authorization["upload_url"],
+            headers={
+                **authorization["headers"],
+                "X-Bz-Content-Sha1": hashlib.sha1(data).hexdigest(),
+            },
+            content=data,
+        )
+    assert uploaded.status_code == 200
+    return {"file_id": uploaded.json()["fileId"], "ticket": authorization["ticket"]}
+
+
+@pytest.mark.anyio
+async def test_direct_upload(
+    async_client: AsyncClient, logged_in_token: str, fake_b2: FastAPI, db
+):
+    completion = await direct_upload(
+        async_client, logged_in_token, fake_b2, b"image bytes"
+    )
+
+    response = await async_client.post(
+        "/upload/complete",
+        json=completion,
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 201
+    assert response.json()["file_url"].endswith(f"fileId={completion['file_id']}")
+    query = direct_upload_table.select()
+    recorded = await db.fetch_one(query)
+    assert recorded.size == len(b"image bytes")
+    assert recorded.file_name.endswith("/my file.png")
+
+
+@pytest.mark.anyio
+async def test_direct_upload_token_only_writes_its_file(
+    async_client: AsyncClient, logged_in_token: str, fake_b2: FastAPI
+):
+    response = await async_client.post(
+        "/upload/authorize",
+        json={"file_name": "myfile.png"},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    authorization = response.json()
+
+    async with AsyncClient(transport=ASGITransport(app=fake_b2)) as b2_client:
+        uploaded = await b2_client.post(
+            authorization["upload_url"],
+            headers={
+                **authorization["headers"],
+                "X-Bz-File-Name": "index.html",
+                "X-Bz-Content-Sha1": hashlib.sha1(b"data").hexdigest(),
+            },
+            content=b"data",
+        )
+
+    assert uploaded.status_code == 401
+    assert fake_b2.state.files == {}
+
+
+@pytest.mark.anyio
+async def test_direct_upload_requires_login(async_client: AsyncClient):
+    response = await async_client.post(
+        "/upload/authorize", json={"file_name": "myfile.png"}
+    )
+
+    assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_direct_upload_complete_rejects_other_file(
+    async_client: AsyncClient, logged_in_token: str, fake_b2: FastAPI
+):
+    completion = await direct_upload(
+        async_client, logged_in_token, fake_b2, b"image bytes"
+    )
+    other = await direct_upload(async_client, logged_in_token, fake_b2, b"other")
+
+    response = await async_client.post(
+        "/upload/complete",
+        json={"file_id": other["file_id"], "ticket": completion["ticket"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_direct_upload_complete_unknown_file(
+    async_client: AsyncClient, logged_in_token: str, fake_b2: FastAPI
+):
+    completion = await direct_upload(
+        async_client, logged_in_token, fake_b2, b"image bytes"
+    )
+
+    response = await async_client.post(
+        "/upload/complete",
+        json={"file_id": "missing", "ticket": completion["ticket"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 400
+
+
+async def call_batch_endpoint(async_client: AsyncClient, files: dict[str, bytes]):
+    return await async_client.post(
+        "/upload/batch",
+        files=[("files", (name, data)) for name, data in files.items()],
+    )
+
+
+@pytest.mark.anyio
+async def test_upload_batch(async_client: AsyncClient, mock_b2_upload_file, mocker):
+    mocker.patch.object(config, "UPLOAD_BATCH_CONCURRENCY", 2)
+    running = []
+    max_running = 0
+    lock = threading.Lock()
+
+    def upload_slowly(local_file: str, file_name: str):
+        nonlocal max_running
+        with lock:
+            running.append(file_name)
+            max_running = max(max_running, len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(file_name)
+        return f"https://fakeurl.com/{file_name}"
+
+    mock_b2_upload_file.side_effect = upload_slowly
+    files = {f"file{i}.png": f"image {i}".encode() for i in range(5)}
+
+    response = await call_batch_endpoint(async_client, files)
+
+    assert response.status_code == 201
+    assert [f["file_url"] for f in response.json()["files"]] == [
+        f"https://fakeurl.com/{name}" for name in files
+    ]
+    assert max_running == 2
+
+
+@pytest.mark.anyio
+async def test_upload_batch_partial_failure(
+    async_client: AsyncClient, mock_b2_upload_file
+):
+    def upload(local_file: str, file_name: str):
+        if file_name == "bad.png":
+            raise RuntimeError("upload failed")
+        return "https://fakeurl.com"
+
+    mock_b2_upload_file.side_effect = upload
+
+    response = await call_batch_endpoint(
+        async_client, {"good.png": b"good", "bad.png": b"bad"}
+    )
+
+    assert response.status_code == 207
+    good, bad = response.json()["files"]
+    assert good["file_url"] == "https://fakeurl.com"
+    assert bad["file_url"] is None
+
+
+@pytest.mark.anyio
+async def test_upload_batch_too_many_files(async_client: AsyncClient, mocker):
+    mocker.patch.object(config, "UPLOAD_BATCH_MAX_FILES", 1)
+
+    response = await call_batch_endpoint(async_client, {"a.png": b"a", "b.png": b"b"})
+
+    assert response.status_code == 413
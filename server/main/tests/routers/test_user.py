@@ -1,7 +1,8 @@
 import pytest
-from fastapi import BackgroundTasks
 from httpx import AsyncClient
 
+from main import jobs, security
+
 
 async def register_user(async_client: AsyncClient, email: str, password: str):
     return await async_client.post(
@@ -9,6 +10,13 @@ async def register_user(async_client: AsyncClient, email: str, password: str):
     )
 
 
+async def login(async_client: AsyncClient, user: dict) -> dict:
+    response = await async_client.post(
+        "/token", json={"email": user["email"], "password": user["password"]}
+    )
+    return response.json()
+
+
 @pytest.mark.anyio
 async def test_register_user(async_client: AsyncClient):
     response = await register_user(async_client, "test@example.net", "12345678")
@@ -28,9 +36,9 @@ async def test_register_user_already_exists(async_client, registered_user: dict)
 
 @pytest.mark.anyio
 async def test_confirm_user(async_client: AsyncClient, mocker):
-    spy = mocker.spy(BackgroundTasks, "add_task")
+    spy = mocker.spy(jobs, "enqueue")
     await register_user(async_client, "test@example.com", "12345678")
-    confirmation_url = str(spy.call_args[1]["confirmation_url"])
+    confirmation_url = spy.call_args[1]["confirmation_url"]
     response = await async_client.get(confirmation_url)
 
     assert response.status_code == 200
@@ -46,9 +54,9 @@ async def test_confirm_user_invalid_token(async_client: AsyncClient):
 @pytest.mark.anyio
 async def test_confirm_user_expired_token(async_client: AsyncClient, mocker):
     mocker.patch("main.security.confirm_token_expire_minutes", return_value=-1)
-    spy = mocker.spy(BackgroundTasks, "add_task")
+    spy = mocker.spy(jobs, "enqueue")
     await register_user(async_client, "test@example.com", "12345678")
-    confirmation_url = str(spy.call_args[1]["confirmation_url"])
+    confirmation_url = spy.call_args[1]["confirmation_url"]
     response = await async_client.get(confirmation_url)
 
     assert response.status_code == 401
@@ -88,4 +96,72 @@ async def test_login_user(async_client: AsyncClient, confirmed_user: dict):
             "name": "Test name",
         },
     )
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_refresh_token(async_client: AsyncClient, confirmed_user: dict, mocker):
+    tokens = await login(async_client, confirmed_user)
+    verify_password = mocker.spy(security, "verify_password")
+
+    response = await async_client.post(
+        "/token/refresh", json={"refresh_token": tokens["refresh_token"]}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["refresh_token"] != tokens["refresh_token"]
+    verify_password.assert_not_called()
+
+    response = await async_client.get(
+        "/post", headers={"Authorization": f"Bearer {response.json()['access_token']}"}
+    )
+    assert response.status_code != 401
+
+
+@pytest.mark.anyio
+async def test_refresh_token_reuse_revokes_all(
+    async_client: AsyncClient, confirmed_user: dict
+):
+    tokens = await login(async_client, confirmed_user)
+    rotated = (
+        await async_client.post(
+            "/token/refresh", json={"refresh_token": tokens["refresh_token"]}
+        )
+    ).json()
+
+    response = await async_client.post(
+        "/token/refresh", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert response.status_code == 401
+
+    response = await async_client.post(
+        "/token/refresh", json={"refresh_token": rotated["refresh_token"]}
+    )
+    assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_revoke_refresh_token(async_client: AsyncClient, confirmed_user: dict):
+    tokens = await login(async_client, confirmed_user)
+
+    response = await async_client.post(
+        "/token/revoke", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert response.status_code == 200
+
+    response = await async_client.post(
+        "/token/refresh", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert response.status_code == 401
+
+
+@pytest.mark.anyio
+async def test_refresh_with_access_token(
+    async_client: AsyncClient, confirmed_user: dict
+):
+    tokens = await login(async_client, confirmed_user)
+
+    response = await async_client.post(
+        "/token/refresh", json={"refresh_token": tokens["access_token"]}
+    )
+    assert response.status_code == 401
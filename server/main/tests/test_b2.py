@@ -0,0 +1,26 @@
+from main.libs.b2 import B2ApiSession
+
+
+def test_b2_api_session_reuses_api_and_reauthorizes(mocker):
+    api_class = mocker.patch("main.libs.b2.b2.B2Api")
+    monotonic = mocker.patch("main.libs.b2.time.monotonic", return_value=1000)
+    session = B2ApiSession(max_age=60)
+
+    api = session.api()
+    assert session.api() is api
+    assert api.authorize_account.call_count == 1
+
+    monotonic.return_value = 1061
+    assert session.api() is api
+    assert api.authorize_account.call_count == 2
+    assert api_class.call_count == 1
+
+
+def test_b2_api_session_caches_bucket(mocker):
+    mocker.patch("main.libs.b2.b2.B2Api")
+    session = B2ApiSession(max_age=60)
+
+    bucket = session.bucket()
+
+    assert session.bucket() is bucket
+    assert session.api().get_bucket_by_name.call_count == 1
@@ -0,0 +1,145 @@
+import asyncio
+import io
+import os
+
+import pytest
+from fastapi import FastAPI, UploadFile
+
+from main import resilience
+from main.libs.b2 import stream
+from main.libs.b2.stream import B2Error, BufferPool, stream_upload
+from main.resilience import UpstreamUnavailable
+from main.tests.fake_b2 import DOWNLOAD_URL
+
+
+@pytest.fixture(autouse=True)
+def small_buffer_pool(mocker):
+    mocker.patch.object(stream, "buffer_pool", BufferPool(buffers=2))
+
+
+def upload_file(data: bytes, filename: str = "myfile.png") -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename=filename)
+
+
+@pytest.mark.anyio
+async def test_stream_upload_small_file(fake_b2: FastAPI):
+    data = os.urandom(1000)
+
+    url = await stream_upload(upload_file(data), "myfile.png", part_size=4096)
+
+    assert url == f"{DOWNLOAD_URL}/b2api/v2/b2_download_file_by_id?fileId=file1"
+    assert fake_b2.state.files["file1"] == {"name": "myfile.png", "data": data}
+    assert "b2_start_large_file" not in fake_b2.state.calls
+    assert stream.buffer_pool.stats.in_use == 0
+
+
+@pytest.mark.anyio
+async def test_stream_upload_file_of_exactly_one_part(fake_b2: FastAPI):
+    data = os.urandom(4096)
+
+    url = await stream_upload(upload_file(data), "myfile.png", part_size=4096)
+
+    assert url.endswith("fileId=file1")
+    assert fake_b2.state.files["file1"]["data"] == data
+    assert "b2_start_large_file" not in fake_b2.state.calls
+    assert stream.buffer_pool.stats.in_use == 0
+
+
+@pytest.mark.anyio
+async def test_stream_upload_file_of_exactly_two_parts(fake_b2: FastAPI):
+    data = os.urandom(4096 * 2)
+
+    await stream_upload(upload_file(data), "big.bin", part_size=4096)
+
+    assert fake_b2.state.files["file1"]["data"] == data
+    assert fake_b2.state.calls.count("b2_upload_part") == 2
+    assert stream.buffer_pool.stats.in_use == 0
+
+
+@pytest.mark.anyio
+async def test_stream_upload_large_file_in_parallel_parts(fake_b2: FastAPI):
+    fake_b2.state.part_delay = 0.01
+    data = os.urandom(4096 * 5 + 10)
+
+    url = await stream_upload(upload_file(data), "big.bin", part_size=4096)
+
+    assert url.endswith("fileId=file1")
+    assert fake_b2.state.files["file1"]["data"] == data
+    assert fake_b2.state.calls.count("b2_upload_part") == 6
+    assert fake_b2.state.max_parts_in_flight == 2  # capped by the buffer pool
+    # Upload URLs are reused once a part finishes
+    assert fake_b2.state.calls.count("b2_get_upload_part_url") <= 2
+    assert stream.buffer_pool.stats.in_use == 0
+
+
+@pytest.mark.anyio
+async def test_stream_upload_goes_through_b2_guard(fake_b2: FastAPI):
+    data = os.urandom(4096 * 2 + 10)
+
+    await stream_upload(upload_file(data), "big.bin", part_size=4096)
+
+    assert resilience.guard("b2").stats.calls == len(fake_b2.state.calls)
+
+
+@pytest.mark.anyio
+async def test_stream_upload_rejected_while_b2_circuit_is_open(fake_b2: FastAPI):
+    breaker = resilience.guard("b2").breaker
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+    with pytest.raises(UpstreamUnavailable):
+        await stream_upload(upload_file(b"data"), "myfile.png", part_size=4096)
+
+    assert fake_b2.state.calls == []
+    assert stream.buffer_pool.stats.in_use == 0
+
+
+@pytest.mark.anyio
+async def test_stream_upload_authorizes_once(fake_b2: FastAPI):
+    for _ in range(2):
+        await stream_upload(upload_file(b"data"), "myfile.png", part_size=4096)
+
+    assert fake_b2.state.calls.count("b2_authorize_account") == 1
+
+
+@pytest.mark.anyio
+async def test_stream_upload_cancels_failed_large_file(fake_b2: FastAPI, mocker):
+    async def corrupt_sha1(data: bytes) -> str:
+        return "0" * 40
+
+    mocker.patch.object(stream, "sha1", corrupt_sha1)
+
+    with pytest.raises(B2Error):
+        await stream_upload(
+            upload_file(os.urandom(4096 * 3)), "big.bin", part_size=4096
+        )
+
+    assert "b2_cancel_large_file" in fake_b2.state.calls
+    assert fake_b2.state.large_files == {}
+    await asyncio.sleep(0)
+    assert stream.buffer_pool.stats.in_use == 0
+
+
+@pytest.mark.anyio
+async def test_session_authorizes_again_when_token_expired(fake_b2: FastAPI):
+    await stream_upload(upload_file(b"data"), "myfile.png", part_size=4096)
+    fake_b2.state.tokens.clear()
+
+    url = await stream.get_upload_url()
+
+    assert url["uploadUrl"]
+    assert fake_b2.state.calls.count("b2_authorize_account") == 2
+    assert stream.session.stats.expired >= 1
+
+
+@pytest.mark.anyio
+async def test_session_authorizes_again_before_token_expires(fake_b2: FastAPI, mocker):
+    session = stream.B2Session(max_age=60)
+    monotonic = mocker.patch("main.libs.b2.stream.time.monotonic", return_value=1000)
+
+    first = await session.account()
+    assert await session.account() is first
+
+    monotonic.return_value = 1061
+    assert await session.account() is not first
+    assert session.stats.authorizations == 2
@@ -0,0 +1,50 @@
+import pytest
+
+from main.cache import MemoryCache
+
+
+@pytest.mark.anyio
+async def test_memory_cache_hit_and_miss():
+    cache = MemoryCache(max_entries=2, ttl_seconds=60)
+    assert await cache.get("a") is None
+
+    await cache.set("a", 1)
+    assert await cache.get("a") == 1
+    assert {"hits": 1, "misses": 1}.items() <= cache.metrics().items()
+
+
+@pytest.mark.anyio
+async def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_entries=2, ttl_seconds=60)
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    await cache.get("a")
+    await cache.set("c", 3)
+
+    assert await cache.get("b") is None
+    assert await cache.get("a") == 1
+    assert cache.stats.evictions == 1
+
+
+@pytest.mark.anyio
+async def test_memory_cache_expires_entries(mocker):
+    cache = MemoryCache(max_entries=2, ttl_seconds=10)
+    monotonic = mocker.patch("main.cache.time.monotonic", return_value=100)
+    await cache.set("a", 1)
+
+    monotonic.return_value = 111
+    assert await cache.get("a") is None
+    assert len(cache) == 0
+
+
+@pytest.mark.anyio
+async def test_memory_cache_invalidate_tags():
+    cache = MemoryCache(max_entries=10, ttl_seconds=60)
+    await cache.set("feed", [1, 2], tags=["post:1", "post:2"])
+    await cache.set("post", {"id": 3}, tags=["post:3"])
+
+    await cache.invalidate("post:2")
+
+    assert await cache.get("feed") is None
+    assert await cache.get("post") == {"id": 3}
+    assert cache.stats.invalidations == 1
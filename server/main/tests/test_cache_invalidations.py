@@ -0,0 +1,38 @@
+import pytest
+from databases import Database
+
+from main.cache import MemoryCache, post_tag
+from main.cache_invalidations import InvalidationLog
+
+
+def process_cache() -> MemoryCache:
+    return MemoryCache(max_entries=10, ttl_seconds=60)
+
+
+@pytest.mark.anyio
+async def test_published_invalidation_reaches_other_process(db: Database):
+    web = InvalidationLog(db, process_cache(), poll_interval=60)
+    worker = InvalidationLog(db, process_cache(), poll_interval=60)
+    await web.start()
+    await web.cache.set("post:1:50", {"image_url": None}, tags=[post_tag(1)])
+    await web.cache.set("post:2:50", {"image_url": None}, tags=[post_tag(2)])
+
+    await worker.publish(post_tag(1))
+    assert await web.cache.get("post:1:50") is not None
+
+    assert await web.poll() == 1
+    assert await web.cache.get("post:1:50") is None
+    assert await web.cache.get("post:2:50") is not None
+    assert await web.poll() == 0
+    await web.stop()
+
+
+@pytest.mark.anyio
+async def test_listener_skips_invalidations_from_before_start(db: Database):
+    worker = InvalidationLog(db, process_cache(), poll_interval=60)
+    await worker.publish(post_tag(1))
+
+    web = InvalidationLog(db, process_cache(), poll_interval=60)
+    await web.start()
+    assert await web.poll() == 0
+    await web.stop()
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from main import tasks
+from main.config import config
+from main.email_batcher import EmailBatcher
+from main.tests.fake_mailgun import create_fake_mailgun
+
+
+@pytest.fixture()
+async def fake_mailgun(mocker) -> FastAPI:
+    mocker.patch.object(config, "MAILGUN_DOMAIN", "example.net")
+    mocker.patch.object(config, "MAILGUN_API_KEY", "test-key")
+    app = create_fake_mailgun()
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="https://api.mailgun.net/v3"
+    ) as client:
+        mocker.patch("main.tasks.get_client", return_value=client)
+        yield app
+
+
+async def send_registration_emails(batcher: EmailBatcher, count: int):
+    await asyncio.gather(
+        *(
+            batcher.send(
+                f"user{i}@example.net",
+                tasks.REGISTRATION_EMAIL_SUBJECT,
+                tasks.REGISTRATION_EMAIL_BODY,
+                variables={
+                    "email": f"user{i}@example.net",
+                    "confirmation_url": f"https://example.net/confirm/{i}",
+                },
+            )
+            for i in range(count)
+        )
+    )
+
+
+@pytest.mark.anyio
+async def test_email_batcher_sends_one_request_per_window(fake_mailgun: FastAPI):
+    batcher = EmailBatcher(window=0.01, max_batch=1000)
+
+    await send_registration_emails(batcher, 3)
+
+    assert fake_mailgun.state.requests == 1
+    assert len(fake_mailgun.state.messages) == 3
+    message = fake_mailgun.state.messages[0]
+    assert message["to"] == "user0@example.net"
+    assert message["text"].startswith("Hi user0@example.net!")
+    assert message["text"].endswith("https://example.net/confirm/0")
+
+
+@pytest.mark.anyio
+async def test_email_batcher_splits_at_max_batch(fake_mailgun: FastAPI):
+    batcher = EmailBatcher(window=60, max_batch=2)
+
+    await send_registration_emails(batcher, 4)
+
+    assert fake_mailgun.state.requests == 2
+    assert batcher.stats.batches == 2
+
+
+@pytest.mark.anyio
+async def test_email_batcher_propagates_failure(mock_httpx_client):
+    mock_httpx_client.post.return_value = httpx.Response(
+        status_code=500, content="", request=httpx.Request("POST", "//")
+    )
+    batcher = EmailBatcher(window=0.01, max_batch=1000)
+
+    with pytest.raises(tasks.APIResponseError):
+        await send_registration_emails(batcher, 2)
+    assert batcher.stats.failed == 2
+
+
+@pytest.mark.anyio
+async def test_email_batcher_benchmark(fake_mailgun: FastAPI):
+    # Benchmark of batched sends against the fake Mailgun, in messages per second
+    batcher = EmailBatcher(window=0.05, max_batch=1000)
+    count = 2500
+
+    started = time.perf_counter()
+    await send_registration_emails(batcher, count)
+    elapsed = time.perf_counter() - started
+
+    print(f"email batching: {count / elapsed:.0f} messages/s")
+    assert fake_mailgun.state.requests == 3
+    assert len(fake_mailgun.state.messages) == count
+
+
+@pytest.mark.anyio
+async def test_email_batcher_isolates_rejected_recipient(fake_mailgun: FastAPI):
+    batcher = EmailBatcher(window=0.01, max_batch=1000)
+    recipients = ["user0@example.net", "not-an-address", "user1@example.net"]
+
+    results = await asyncio.gather(
+        *(batcher.send(to, "Subject", "Body", variables={}) for to in recipients),
+        return_exceptions=True,
+    )
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], tasks.APIResponseError)
+    assert [message["to"] for message in fake_mailgun.state.messages] == [
+        "user0@example.net",
+        "user1@example.net",
+    ]
+    assert {"messages": 2, "failed": 1, "split": 1}.items() <= batcher.metrics().items()
@@ -0,0 +1,41 @@
+import pytest
+
+from main import http_clients
+
+
+@pytest.fixture(autouse=True)
+async def closed_clients():
+    yield
+    await http_clients.close()
+
+
+@pytest.mark.anyio
+async def test_get_client_is_shared():
+    client = http_clients.get_client("mailgun")
+
+    assert http_clients.get_client("mailgun") is client
+    assert http_clients.get_client("deepai") is not client
+    assert client.build_request("POST", "/x/messages").url == (
+        "https://api.mailgun.net/v3/x/messages"
+    )
+
+
+@pytest.mark.anyio
+async def test_close_clients():
+    client = http_clients.get_client("deepai")
+    await http_clients.close()
+
+    assert client.is_closed
+    assert http_clients.get_client("deepai") is not client
+
+
+@pytest.mark.anyio
+async def test_pool_metrics():
+    await http_clients.start()
+
+    snapshot = http_clients.pool_metrics()
+
+    assert set(snapshot) == set(http_clients.UPSTREAMS)
+    assert {"connections": 0, "active": 0, "idle": 0}.items() <= snapshot[
+        "mailgun"
+    ].items()
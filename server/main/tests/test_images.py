@@ -0,0 +1,115 @@
+import io
+from unittest.mock import Mock
+
+import httpx
+import pytest
+
+from main import images
+from main.config import config
+from main.storage import LocalStorage
+
+
+@pytest.fixture()
+def local_storage(tmp_path, mocker) -> LocalStorage:
+    local_storage = LocalStorage(tmp_path, "http://test/files")
+    mocker.patch("main.images.storage", local_storage)
+    return local_storage
+
+
+@pytest.fixture()
+async def generated_image(mocker) -> Mock:
+    handler = Mock(
+        return_value=httpx.Response(
+            status_code=200, content=b"png bytes", headers={"Content-Type": "image/png"}
+        )
+    )
+    transport = httpx.MockTransport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        mocker.patch("main.images.get_client", return_value=client)
+        yield handler
+
+
+def png(width: int, height: int) -> bytes:
+    Image = pytest.importorskip("PIL.Image")
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "orange").save(output, "PNG")
+    return output.getvalue()
+
+
+@pytest.mark.anyio
+async def test_mirror_image(local_storage: LocalStorage, generated_image: Mock):
+    urls = await images.mirror_image("https://api.deepai.org/job/out.png", 1)
+
+    assert set(urls) == {"image_url"}
+    key = urls["image_url"].removeprefix("http://test/files/")
+    assert key.endswith("/image.png")
+    assert local_storage.path(key).read_bytes() == b"png bytes"
+
+
+@pytest.mark.anyio
+async def test_mirror_image_too_large(
+    local_storage: LocalStorage, generated_image: Mock, mocker
+):
+    mocker.patch.object(config, "IMAGE_MIRROR_MAX_BYTES", 4)
+
+    with pytest.raises(ValueError):
+        await images.mirror_image("https://api.deepai.org/job/out.png", 1)
+
+
+@pytest.mark.anyio
+async def test_mirror_image_stops_reading_past_limit(
+    local_storage: LocalStorage, generated_image: Mock, mocker
+):
+    mocker.patch.object(config, "IMAGE_MIRROR_MAX_BYTES", 4096)
+    sent = []
+
+    async def body():
+        # Chunked, so there is no Content-Length to reject up front
+        for _ in range(1000):
+            sent.append(1024)
+            yield b"x" * 1024
+
+    generated_image.return_value = httpx.Response(status_code=200, content=body())
+
+    with pytest.raises(ValueError):
+        await images.mirror_image("https://api.deepai.org/job/out.png", 1)
+    assert sum(sent) <= 5 * 1024
+
+
+@pytest.mark.anyio
+async def test_mirror_image_with_derivatives(
+    local_storage: LocalStorage, generated_image: Mock, mocker
+):
+    Image = pytest.importorskip("PIL.Image")
+    generated_image.return_value = httpx.Response(
+        status_code=200,
+        content=png(2048, 1024),
+        headers={"Content-Type": "image/png"},
+    )
+    mocker.patch.object(config, "IMAGE_DERIVATIVES", True)
+
+    urls = await images.mirror_image("https://api.deepai.org/job/out.png", 1)
+
+    assert set(urls) == {"image_url", "thumbnail_url", "medium_url"}
+    key = urls["thumbnail_url"].removeprefix("http://test/files/")
+    with Image.open(local_storage.path(key)) as thumbnail:
+        assert thumbnail.size == (256, 128)
+        assert thumbnail.format == "JPEG"
+
+
+def test_image_executor_does_not_fork_this_process():
+    try:
+        context = images.image_executor()._mp_context
+        assert context.get_start_method() == "forkserver"
+    finally:
+        images.shutdown()
+
+
+def test_resize_image_without_pillow():
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        with pytest.raises(RuntimeError, match="Pillow"):
+            images.resize_image(b"png bytes", 256, 80)
+    else:
+        pytest.skip("Pillow is installed")
@@ -0,0 +1,203 @@
+import asyncio
+import datetime
+
+import pytest
+from databases import Database
+
+from main import jobs
+from main.database import job_table
+from main.resilience import UpstreamUnavailable
+
+
+@pytest.fixture()
+def handler(mocker):
+    handler = mocker.AsyncMock()
+    mocker.patch.dict(
+        jobs.JOB_TYPES,
+        {"test": jobs.JobType(handler, concurrency=2, max_attempts=2)},
+    )
+    return handler
+
+
+async def get_job(db: Database, job_id: int):
+    return await db.fetch_one(job_table.select().where(job_table.c.id == job_id))
+
+
+@pytest.mark.anyio
+async def test_enqueue_unknown_type(db: Database):
+    with pytest.raises(ValueError):
+        await jobs.enqueue(db, "unknown")
+
+
+@pytest.mark.anyio
+async def test_worker_runs_job(db: Database, handler):
+    job_id = await jobs.enqueue(db, "test", value=1)
+
+    await jobs.Worker(db, poll_interval=0).run_once()
+
+    handler.assert_awaited_once_with(db, {"value": 1})
+    job = await get_job(db, job_id)
+    assert (job.status, job.attempts) == ("done", 1)
+
+
+@pytest.mark.anyio
+async def test_claim_hides_job_until_visibility_timeout(db: Database, handler):
+    job_id = await jobs.enqueue(db, "test")
+
+    assert [job.id for job in await jobs.claim(db, "test", 10)] == [job_id]
+    assert await jobs.claim(db, "test", 10) == []
+
+    query = (
+        job_table.update()
+        .where(job_table.c.id == job_id)
+        .values(locked_until=jobs.utcnow() - datetime.timedelta(seconds=1))
+    )
+    await db.execute(query)
+    assert [job.id for job in await jobs.claim(db, "test", 10)] == [job_id]
+
+
+@pytest.mark.anyio
+async def test_claim_respects_limit(db: Database, handler):
+    for _ in range(3):
+        await jobs.enqueue(db, "test")
+
+    assert len(await jobs.claim(db, "test", 2)) == 2
+
+
+@pytest.mark.anyio
+async def test_failed_job_is_retried_with_backoff(db: Database, handler):
+    handler.side_effect = RuntimeError("boom")
+    job_id = await jobs.enqueue(db, "test")
+    worker = jobs.Worker(db, poll_interval=0)
+
+    await worker.run_once()
+
+    job = await get_job(db, job_id)
+    assert job.status == "queued"
+    assert job.run_at > jobs.utcnow()
+    assert "boom" in job.last_error
+    assert worker.stats.retried["test"] == 1
+
+
+@pytest.mark.anyio
+async def test_job_fails_after_max_attempts(db: Database, handler, mocker):
+    handler.side_effect = RuntimeError("boom")
+    mocker.patch("main.jobs.random.uniform", return_value=0)  # retry immediately
+    job_id = await jobs.enqueue(db, "test")
+    worker = jobs.Worker(db, poll_interval=0)
+
+    await worker.run_once()
+    await worker.run_once()
+
+    assert (await get_job(db, job_id)).status == "failed"
+    assert worker.stats.failed["test"] == 1
+
+
+@pytest.mark.anyio
+async def test_job_deferred_while_circuit_is_open(db: Database, handler, mocker):
+    handler.side_effect = UpstreamUnavailable("Circuit is open", retry_after=30)
+    uniform = mocker.patch("main.jobs.random.uniform", return_value=1)
+    job_id = await jobs.enqueue(db, "test")
+    worker = jobs.Worker(db, poll_interval=0)
+
+    await worker.run_once()
+
+    job = await get_job(db, job_id)
+    assert (job.status, job.attempts) == ("queued", 0)
+    assert job.run_at >= jobs.utcnow() + datetime.timedelta(seconds=29)
+
+    await db.execute(
+        job_table.update().where(job_table.c.id == job_id).values(run_at=jobs.utcnow())
+    )
+    uniform.return_value = 0  # due again at once
+    for _ in range(3):  # more runs than max_attempts
+        await worker.run_once()
+
+    job = await get_job(db, job_id)
+    assert (job.status, job.attempts) == ("queued", 0)
+    assert worker.stats.deferred["test"] == 4
+    assert worker.stats.failed["test"] == 0
+
+
+@pytest.mark.anyio
+async def test_queue_depth(db: Database, handler):
+    await jobs.enqueue(db, "test")
+    await jobs.enqueue(db, "test")
+    await jobs.claim(db, "test", 1)
+
+    assert (await jobs.queue_depth(db))["test"] == {"queued": 1, "running": 1}
+
+
+@pytest.mark.anyio
+async def test_worker_run_until_stopped(db: Database, handler):
+    await jobs.enqueue(db, "test")
+    worker = jobs.Worker(db, poll_interval=0.01)
+
+    task = asyncio.create_task(worker.run())
+    while not handler.await_count:
+        await asyncio.sleep(0.01)
+    worker.stop()
+    await asyncio.wait_for(task, timeout=1)
+
+    assert worker.stats.completed["test"] == 1
+
+
+@pytest.mark.anyio
+async def test_running_job_keeps_its_lease(db: Database, mocker):
+    async def slow_handler(database, payload):
+        await asyncio.sleep(0.3)
+
+    handler = mocker.AsyncMock(side_effect=slow_handler)
+    mocker.patch.dict(
+        jobs.JOB_TYPES,
+        {"test": jobs.JobType(handler, concurrency=2, visibility_timeout=0.1)},
+    )
+    await jobs.enqueue(db, "test")
+    worker = jobs.Worker(db, poll_interval=0.01)
+
+    task = asyncio.create_task(worker.run())
+    while not worker.stats.completed["test"]:
+        await asyncio.sleep(0.01)
+    worker.stop()
+    await asyncio.wait_for(task, timeout=1)
+
+    assert handler.await_count == 1
+
+
+@pytest.mark.anyio
+async def test_stale_runner_cannot_settle_reclaimed_job(db: Database, handler):
+    job_id = await jobs.enqueue(db, "test")
+    [stale] = await jobs.claim(db, "test", 1)
+    query = (
+        job_table.update()
+        .where(job_table.c.id == job_id)
+        .values(locked_until=jobs.utcnow() - datetime.timedelta(seconds=1))
+    )
+    await db.execute(query)
+    [current] = await jobs.claim(db, "test", 1)
+
+    assert not await jobs.complete(db, stale)
+    assert await jobs.fail(db, stale, "late") is None
+    assert not await jobs.renew(db, stale)
+    assert (await get_job(db, job_id)).status == "running"
+    assert await jobs.complete(db, current)
+    assert (await get_job(db, job_id)).status == "done"
+
+
+@pytest.mark.anyio
+async def test_expired_job_without_attempts_left_fails(db: Database, handler):
+    job_id = await jobs.enqueue(db, "test")
+    query = (
+        job_table.update()
+        .where(job_table.c.id == job_id)
+        .values(
+            status="running",
+            attempts=2,
+            locked_until=jobs.utcnow() - datetime.timedelta(seconds=1),
+        )
+    )
+    await db.execute(query)
+
+    assert await jobs.claim(db, "test", 10) == []
+    job = await get_job(db, job_id)
+    assert (job.status, job.attempts) == ("failed", 2)
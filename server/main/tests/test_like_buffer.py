@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+from databases import Database
+
+from main.database import like_table, post_table, user_table
+from main.like_buffer import LikeBuffer
+
+
+@pytest.fixture()
+def buffer(db: Database) -> LikeBuffer:
+    return LikeBuffer(db, batch_size=10, flush_interval=60, max_pending=100)
+
+
+@pytest.fixture()
+async def user_ids(db: Database) -> list[int]:
+    return [
+        await db.execute(user_table.insert().values(email=f"user{i}@example.net"))
+        for i in range(3)
+    ]
+
+
+async def count_likes(db: Database, post_id: int) -> tuple[int, int]:
+    rows = await db.fetch_all(
+        like_table.select().where(like_table.c.post_id == post_id)
+    )
+    post = await db.fetch_one(post_table.select().where(post_table.c.id == post_id))
+    return len(rows), post.like_count
+
+
+@pytest.mark.anyio
+async def test_like_buffer_flush(
+    buffer: LikeBuffer, created_post: dict, user_ids: list[int], db: Database
+):
+    for user_id in user_ids:
+        await buffer.add(created_post["id"], user_id)
+
+    assert len(buffer) == 3
+    assert await count_likes(db, created_post["id"]) == (0, 0)
+
+    await buffer.flush()
+
+    assert len(buffer) == 0
+    assert await count_likes(db, created_post["id"]) == (3, 3)
+    assert {"flushed": 3, "batches": 1}.items() <= buffer.metrics().items()
+
+
+@pytest.mark.anyio
+async def test_like_buffer_bounded(
+    created_post: dict, user_ids: list[int], db: Database
+):
+    buffer = LikeBuffer(db, batch_size=10, flush_interval=60, max_pending=2)
+    for user_id in user_ids:
+        await buffer.add(created_post["id"], user_id)
+
+    assert len(buffer) == 1
+    assert await count_likes(db, created_post["id"]) == (2, 2)
+
+
+@pytest.mark.anyio
+async def test_like_buffer_skips_duplicates(
+    buffer: LikeBuffer, created_post: dict, confirmed_user: dict, db: Database
+):
+    for _ in range(2):
+        await buffer.add(created_post["id"], confirmed_user["id"])
+        await buffer.flush()
+
+    assert await count_likes(db, created_post["id"]) == (1, 1)
+    assert buffer.stats.duplicates == 1
+
+
+@pytest.mark.anyio
+async def test_like_buffer_discard(
+    buffer: LikeBuffer, created_post: dict, confirmed_user: dict, db: Database
+):
+    await buffer.add(created_post["id"], confirmed_user["id"])
+
+    assert await buffer.discard(created_post["id"], confirmed_user["id"])
+    assert not await buffer.discard(created_post["id"], confirmed_user["id"])
+    await buffer.flush()
+
+    assert await count_likes(db, created_post["id"]) == (0, 0)
+
+
+@pytest.mark.anyio
+async def test_like_buffer_wait_for_flush(
+    buffer: LikeBuffer, created_post: dict, confirmed_user: dict, db: Database
+):
+    task = asyncio.create_task(
+        buffer.add(created_post["id"], confirmed_user["id"], wait=True)
+    )
+    await asyncio.sleep(0)
+    assert not task.done()
+
+    await buffer.flush()
+    await task
+
+    assert await count_likes(db, created_post["id"]) == (1, 1)
+
+
+@pytest.mark.anyio
+async def test_like_buffer_stop_flushes(
+    buffer: LikeBuffer, created_post: dict, confirmed_user: dict, db: Database
+):
+    await buffer.start()
+    await buffer.add(created_post["id"], confirmed_user["id"])
+    await buffer.stop()
+
+    assert await count_likes(db, created_post["id"]) == (1, 1)
+
+
+@pytest.mark.anyio
+async def test_like_buffer_discard_double_tap(
+    buffer: LikeBuffer, created_post: dict, confirmed_user: dict, db: Database
+):
+    for _ in range(2):
+        await buffer.add(created_post["id"], confirmed_user["id"])
+
+    assert await buffer.discard(created_post["id"], confirmed_user["id"])
+    await buffer.flush()
+
+    assert await count_likes(db, created_post["id"]) == (0, 0)
+    assert buffer.stats.discarded == 2
+
+
+@pytest.mark.anyio
+async def test_like_buffer_discard_waits_for_running_flush(
+    buffer: LikeBuffer, created_post: dict, confirmed_user: dict, db: Database
+):
+    write = buffer._write
+    writing = asyncio.Event()
+
+    async def slow_write(likes):
+        writing.set()
+        await asyncio.sleep(0.05)
+        await write(likes)
+
+    buffer._write = slow_write
+    await buffer.add(created_post["id"], confirmed_user["id"])
+    flush = asyncio.create_task(buffer.flush())
+    await writing.wait()
+
+    # The batch is out of the queue, so it is committed rather than discarded
+    assert not await buffer.discard(created_post["id"], confirmed_user["id"])
+    assert await count_likes(db, created_post["id"]) == (1, 1)
+    await flush
+
+
+@pytest.mark.anyio
+async def test_like_buffer_stop_waits_for_running_flush(
+    created_post: dict, confirmed_user: dict, db: Database
+):
+    buffer = LikeBuffer(db, batch_size=1, flush_interval=60, max_pending=100)
+    write = buffer._write
+    writing = asyncio.Event()
+
+    async def slow_write(likes):
+        writing.set()
+        await asyncio.sleep(0.05)
+        await write(likes)
+
+    buffer._write = slow_write
+    await buffer.start()
+    task = asyncio.create_task(
+        buffer.add(created_post["id"], confirmed_user["id"], wait=True)
+    )
+    await writing.wait()
+    await buffer.stop()
+
+    await asyncio.wait_for(task, timeout=1)
+    assert await count_likes(db, created_post["id"]) == (1, 1)
+    assert {"queued": 1, "flushed": 1, "pending": 0}.items() <= buffer.metrics().items()
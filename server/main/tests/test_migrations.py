@@ -0,0 +1,48 @@
+import sqlalchemy
+
+from main import migrations
+from main.database import metadata
+from main.migrations import m0001_initial_schema
+
+
+def test_upgrade_creates_schema(tmp_path):
+    engine = migrations.create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+
+    applied = migrations.upgrade(engine)
+
+    assert applied == [version for version, _, _ in migrations.migrations()]
+    assert migrations.pending(engine) == []
+    assert migrations.upgrade(engine) == []
+
+    inspector = sqlalchemy.inspect(engine)
+    for table in metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        assert columns == {column.name for column in table.columns}
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert {index.name for index in table.indexes} <= indexes
+
+
+def test_upgrade_legacy_database(tmp_path):
+    engine = migrations.create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    with engine.begin() as connection:
+        m0001_initial_schema.metadata.create_all(connection)
+        connection.execute(
+            sqlalchemy.text("INSERT INTO users (id, email) VALUES (1, 'a@b.net')")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO posts (id, body, user_id) VALUES (1, 'x', 1)")
+        )
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO likes (post_id, user_id) VALUES (1, 1), (1, 1)"
+            )
+        )
+
+    migrations.upgrade(engine)
+
+    with engine.begin() as connection:
+        like_count = connection.execute(
+            sqlalchemy.text("SELECT like_count FROM posts WHERE id = 1")
+        ).scalar()
+        likes = connection.execute(sqlalchemy.text("SELECT count(*) FROM likes"))
+        assert (like_count, likes.scalar()) == (1, 1)
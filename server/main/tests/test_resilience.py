@@ -0,0 +1,181 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+
+from main import resilience
+from main.resilience import (
+    AdaptiveLimiter,
+    CircuitBreaker,
+    RetryBudget,
+    UpstreamGuard,
+    UpstreamUnavailable,
+)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def response(status_code: int) -> httpx.Response:
+    return httpx.Response(status_code, request=httpx.Request("POST", "//"))
+
+
+def create_guard(failure_threshold=5, max_retries=2, max_queued=10):
+    return UpstreamGuard(
+        "test",
+        breaker=CircuitBreaker(failure_threshold, reset_timeout=30),
+        limiter=AdaptiveLimiter(
+            min_limit=1, max_limit=4, latency_target=1, max_queued=max_queued
+        ),
+        budget=RetryBudget(ratio=0.2, max_tokens=10),
+        max_retries=max_retries,
+        backoff_base=0,
+    )
+
+
+def test_circuit_breaker_opens_and_probes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    clock.now = 30
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # only one probe at a time
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    clock.now = 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_circuit_breaker_retry_after():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    assert breaker.retry_after() == 0
+
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.retry_after() == 20
+
+    clock.now = 30
+    assert breaker.allow()  # the probe
+    assert breaker.retry_after() == 30
+
+
+def test_adaptive_limiter_aimd():
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=8, latency_target=1, max_queued=1)
+
+    limiter.record(latency=0.1, ok=False)
+    assert limiter.limit == 4
+    limiter.record(latency=2, ok=True)
+    assert limiter.limit == pytest.approx(3.6)
+    limiter.record(latency=0.1, ok=True)
+    assert limiter.limit == pytest.approx(3.6 + 1 / 3.6)
+
+    for _ in range(10):
+        limiter.record(latency=0.1, ok=False)
+    assert limiter.limit == 1
+
+
+@pytest.mark.anyio
+async def test_adaptive_limiter_queues_then_rejects():
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=1, latency_target=1, max_queued=1)
+    await limiter.acquire()
+
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    with pytest.raises(UpstreamUnavailable):
+        await limiter.acquire()
+
+    limiter.release()
+    await waiter
+    assert limiter.in_flight == 1
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, max_tokens=1)
+
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+@pytest.mark.anyio
+async def test_guard_retries_unhandled_requests():
+    guard = create_guard()
+    send = AsyncMock(side_effect=[response(503), response(200)])
+
+    result = await guard.call(send, "/path")
+
+    assert result.status_code == 200
+    assert send.await_count == 2
+    assert guard.metrics()["retries"] == 1
+    assert guard.metrics()["state"] == "closed"
+
+
+@pytest.mark.anyio
+async def test_guard_does_not_retry_handled_failures():
+    guard = create_guard()
+    send = AsyncMock(return_value=response(500))
+
+    result = await guard.call(send)
+
+    assert result.status_code == 500
+    assert send.await_count == 1
+
+
+@pytest.mark.anyio
+async def test_guard_retries_gateway_errors_only_when_configured():
+    guard = create_guard()
+    send = AsyncMock(return_value=response(504))
+
+    assert (await guard.call(send)).status_code == 504
+    assert send.await_count == 1
+
+    guard.retry_statuses = guard.retry_statuses | {504}
+    send = AsyncMock(side_effect=[response(504), response(200)])
+
+    assert (await guard.call(send)).status_code == 200
+    assert send.await_count == 2
+
+
+def test_mailgun_guard_does_not_retry_gateway_errors():
+    assert 504 not in resilience.create_guard("mailgun").retry_statuses
+    assert 504 in resilience.create_guard("deepai").retry_statuses
+
+
+@pytest.mark.anyio
+async def test_guard_open_circuit_rejects_without_calling():
+    guard = create_guard(failure_threshold=2, max_retries=0)
+    send = AsyncMock(side_effect=httpx.ConnectError("refused"))
+
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            await guard.call(send)
+    with pytest.raises(UpstreamUnavailable) as rejected:
+        await guard.call(send)
+
+    assert 0 < rejected.value.retry_after <= 30
+    assert send.await_count == 2
+    assert guard.metrics()["state"] == "open"
+    assert guard.metrics()["rejected"] == 1
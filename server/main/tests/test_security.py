@@ -1,8 +1,12 @@
+import asyncio
+import time
+
 import pytest
 from jose import jwt
 
 from main import security
 from main.config import config
+from main.models.user import User
 
 
 def test_access_token_expire_minutes():
@@ -132,4 +136,138 @@ async def test_get_current_user_wrong_type_token(registered_user: dict):
     token = security.create_confirmation_token(registered_user["email"])
 
     with pytest.raises(security.HTTPException):
-        await security.get_current_user(token)
\ No newline at end of file
+        await security.get_current_user(token)
+
+
+@pytest.mark.anyio
+async def test_offload_password_hashing():
+    password = "password"
+    hashed = await security.offload_password_hashing(
+        security.get_password_hash, password
+    )
+    assert await security.offload_password_hashing(
+        security.verify_password, password, hashed
+    )
+    assert security.password_hashing_stats.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_offload_password_hashing_keeps_event_loop_responsive():
+    # Benchmark: the event loop keeps ticking while a burst of logins is hashing.
+    # Lags are compared with a hash timed in the same run, so a slow or busy
+    # runner scales both
+    hashed = security.get_password_hash("password")
+    started = time.perf_counter()
+    security.verify_password("password", hashed)
+    hash_seconds = time.perf_counter() - started
+
+    logins = asyncio.gather(
+        *(
+            security.offload_password_hashing(
+                security.verify_password, "password", hashed
+            )
+            for _ in range(8)
+        )
+    )
+    lags = []
+    while not logins.done():
+        tick = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - tick)
+    await logins
+
+    lags.sort()
+    median = lags[len(lags) // 2]
+    print(
+        f"event loop lag while hashing: median {median * 1e3:.1f}ms,"
+        f" one hash {hash_seconds * 1e3:.1f}ms"
+    )
+    # Hashing on the loop would hold up ticks for a whole hash each
+    assert median < hash_seconds / 2
+
+
+@pytest.mark.anyio
+async def test_get_current_user_cached(registered_user: dict, mocker):
+    token = security.create_access_token(registered_user["email"])
+    await security.get_current_user(token)
+
+    fetch_one = mocker.spy(security.database, "fetch_one")
+    user = await security.get_current_user(token)
+
+    assert user == User(id=registered_user["id"], email=registered_user["email"])
+    fetch_one.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_invalidate_principal(registered_user: dict, mocker):
+    await security.get_principal(registered_user["email"])
+    await security.invalidate_principal(registered_user["email"])
+
+    fetch_one = mocker.spy(security.database, "fetch_one")
+    await security.get_principal(registered_user["email"])
+
+    fetch_one.assert_called_once()
+
+
+def test_get_subject_for_token_type_cached(mocker):
+    token = security.create_access_token("test@example.com")
+    security.get_subject_for_token_type(token, "access")
+    hits = security.verified_token_cache.stats.hits
+
+    decode = mocker.spy(security.jwt, "decode")
+    assert "test@example.com" == security.get_subject_for_token_type(token, "access")
+    decode.assert_not_called()
+    assert security.verified_token_cache.stats.hits == hits + 1
+
+
+def test_get_subject_for_token_type_cached_expired(mocker):
+    token = security.create_access_token("test@example.com")
+    security.get_subject_for_token_type(token, "access")
+
+    expire = time.time() + security.access_token_expire_minutes() * 60
+    mocker.patch("main.security.time.time", return_value=expire + 1)
+    with pytest.raises(security.HTTPException) as exc_info:
+        security.get_subject_for_token_type(token, "access")
+    assert "Token has expired" == exc_info.value.detail
+    assert len(security.verified_token_cache) == 0
+
+
+def test_verified_token_cache_evicts_least_recently_used():
+    cache = security.VerifiedTokenCache(max_entries=1)
+    exp = time.time() + 60
+    cache.set("a", {"sub": "a", "exp": exp})
+    cache.set("b", {"sub": "b", "exp": exp})
+
+    assert cache.get("a") is None
+    assert cache.get("b")["sub"] == "b"
+    assert cache.stats.evictions == 1
+
+
+def test_get_subject_for_token_type_benchmark():
+    # Microbenchmark of the per-request auth cost with and without the cache
+    token = security.create_access_token("test@example.com")
+    rounds = 200
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        security.verified_token_cache.clear()
+        security.get_subject_for_token_type(token, "access")
+    uncached = (time.perf_counter() - started) / rounds
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        security.get_subject_for_token_type(token, "access")
+    cached = (time.perf_counter() - started) / rounds
+
+    print(f"token verification: {uncached * 1e6:.1f}us -> {cached * 1e6:.1f}us")
+    assert cached < uncached
+
+
+@pytest.mark.anyio
+async def test_create_refresh_token():
+    token = await security.create_refresh_token("123")
+    payload = jwt.decode(
+        token, key=config.PWD_SECRET_KEY, algorithms=[security.ALGORITHM]
+    )
+    assert {"sub": "123", "type": "refresh"}.items() <= payload.items()
+    assert payload["jti"]
@@ -0,0 +1,114 @@
+import io
+
+import pytest
+from fastapi import UploadFile
+from httpx import AsyncClient
+
+from main.storage import LocalStorage
+
+BASE_URL = "http://test/files"
+
+
+@pytest.fixture()
+def local_storage(tmp_path, mocker) -> LocalStorage:
+    local_storage = LocalStorage(tmp_path, BASE_URL)
+    mocker.patch("main.routers.files.storage", local_storage)
+    mocker.patch("main.routers.upload.storage", local_storage)
+    return local_storage
+
+
+async def store(local_storage: LocalStorage, data: bytes, file_name: str) -> str:
+    url = await local_storage.upload(UploadFile(io.BytesIO(data)), file_name)
+    return url.removeprefix("http://test")
+
+
+@pytest.mark.anyio
+async def test_local_storage_upload(local_storage: LocalStorage, tmp_path):
+    url = await local_storage.upload(
+        UploadFile(io.BytesIO(b"image bytes")), "../my image.png"
+    )
+
+    assert url.startswith(f"{BASE_URL}/") and url.endswith("/my%20image.png")
+    (stored,) = tmp_path.glob("*/*")
+    assert stored.name == "my image.png"
+    assert stored.read_bytes() == b"image bytes"
+
+
+def test_local_storage_path_stays_in_root(local_storage: LocalStorage):
+    with pytest.raises(ValueError):
+        local_storage.path("../outside.png")
+    with pytest.raises(ValueError):
+        local_storage.path("")
+
+
+@pytest.mark.anyio
+async def test_download_file(async_client: AsyncClient, local_storage: LocalStorage):
+    path = await store(local_storage, b"image bytes", "myfile.png")
+
+    response = await async_client.get(path)
+
+    assert response.status_code == 200
+    assert response.content == b"image bytes"
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["x-content-type-options"] == "nosniff"
+    assert "content-disposition" not in response.headers
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["etag"]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("file_name", ["page.html", "image.svg", "noextension"])
+async def test_download_active_content_as_attachment(
+    async_client: AsyncClient, local_storage: LocalStorage, file_name: str
+):
+    path = await store(local_storage, b"<script>alert(1)</script>", file_name)
+
+    response = await async_client.get(path)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.headers["content-disposition"].startswith("attachment")
+    assert response.headers["x-content-type-options"] == "nosniff"
+
+
+@pytest.mark.anyio
+async def test_download_file_range(
+    async_client: AsyncClient, local_storage: LocalStorage
+):
+    path = await store(local_storage, b"0123456789", "myfile.bin")
+
+    response = await async_client.get(path, headers={"Range": "bytes=2-5"})
+
+    assert response.status_code == 206
+    assert response.content == b"2345"
+    assert response.headers["content-range"] == "bytes 2-5/10"
+
+
+@pytest.mark.anyio
+async def test_download_missing_file(
+    async_client: AsyncClient, local_storage: LocalStorage
+):
+    response = await async_client.get("/files/missing/myfile.png")
+
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_download_file_needs_local_storage(async_client: AsyncClient):
+    response = await async_client.get("/files/any/myfile.png")
+
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_upload_to_local_storage(
+    async_client: AsyncClient, local_storage: LocalStorage
+):
+    response = await async_client.post(
+        "/upload", files={"file": ("myfile.png", b"image bytes")}
+    )
+
+    assert response.status_code == 201
+    path = response.json()["file_url"].removeprefix("http://test")
+    downloaded = await async_client.get(path)
+    assert downloaded.content == b"image bytes"
@@ -1,12 +1,20 @@
+import asyncio
+
 import httpx
 import pytest
 from databases import Database
+from httpx import AsyncClient
 
+from main.cache import MemoryCache
+from main.cache_invalidations import InvalidationLog, invalidation_log
+from main.config import config
 from main.database import post_table
 from main.tasks import (
     APIResponseError,
     _generate_cute_creature_api,
     generate_and_add_to_post,
+    generate_cute_creature,
+    normalize_prompt,
     send_simple_email,
 )
 
@@ -80,3 +88,111 @@ async def test_generate_and_add_to_post_success(
     updated_post = await db.fetch_one(query)
 
     assert updated_post["image_url"] == json_data["output_url"]
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  A   Dog\n") == normalize_prompt("a dog")
+
+
+@pytest.mark.anyio
+async def test_generate_cute_creature_caches_by_prompt(mock_httpx_client):
+    json_data = {"output_url": "https://example.com/cute-creature.jpg"}
+    mock_httpx_client.post.return_value = httpx.Response(
+        status_code=200, json=json_data, request=httpx.Request("POST", "//")
+    )
+
+    assert await generate_cute_creature("A dog") == json_data
+    assert await generate_cute_creature("a  DOG") == json_data
+    assert mock_httpx_client.post.call_count == 1
+
+
+@pytest.mark.anyio
+async def test_generate_cute_creature_shares_in_flight_request(mock_httpx_client):
+    json_data = {"output_url": "https://example.com/cute-creature.jpg"}
+    release = asyncio.Event()
+
+    async def slow_post(*args, **kwargs):
+        await release.wait()
+        return httpx.Response(
+            status_code=200, json=json_data, request=httpx.Request("POST", "//")
+        )
+
+    mock_httpx_client.post.side_effect = slow_post
+
+    waiters = [asyncio.create_task(generate_cute_creature("A dog")) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*waiters) == [json_data] * 5
+    assert mock_httpx_client.post.call_count == 1
+
+
+@pytest.mark.anyio
+async def test_generate_cute_creature_does_not_cache_errors(mock_httpx_client):
+    mock_httpx_client.post.return_value = httpx.Response(
+        status_code=500, content="", request=httpx.Request("POST", "//")
+    )
+
+    for _ in range(2):
+        with pytest.raises(APIResponseError):
+            await generate_cute_creature("A dog")
+    assert mock_httpx_client.post.call_count == 2
+
+
+@pytest.mark.anyio
+async def test_generate_and_add_to_post_mirrors_image(
+    mock_httpx_client, created_post: dict, confirmed_user: dict, db: Database, mocker
+):
+    mock_httpx_client.post.return_value = httpx.Response(
+        status_code=200,
+        json={"output_url": "https://example.com/cute-creature.jpg"},
+        request=httpx.Request("POST", "//"),
+    )
+    mocker.patch.object(config, "IMAGE_MIRROR", True)
+    mirrored = {
+        "image_url": "https://files.example.com/image.jpg",
+        "thumbnail_url": "https://files.example.com/thumbnail.jpg",
+        "medium_url": "https://files.example.com/medium.jpg",
+    }
+    mirror_image = mocker.patch("main.tasks.images.mirror_image", return_value=mirrored)
+
+    await generate_and_add_to_post(
+        confirmed_user["email"], created_post["id"], "/post/1", db, "A dog"
+    )
+
+    mirror_image.assert_awaited_once_with(
+        "https://example.com/cute-creature.jpg", created_post["id"]
+    )
+    query = post_table.select().where(post_table.c.id == created_post["id"])
+    updated_post = await db.fetch_one(query)
+    assert {key: updated_post[key] for key in mirrored} == mirrored
+
+
+@pytest.mark.anyio
+async def test_generate_and_add_to_post_invalidates_web_cache(
+    mock_httpx_client,
+    async_client: AsyncClient,
+    created_post: dict,
+    confirmed_user: dict,
+    db: Database,
+    mocker,
+):
+    json_data = {"output_url": "https://example.com/cute-creature.jpg"}
+    mock_httpx_client.post.return_value = httpx.Response(
+        status_code=200, json=json_data, request=httpx.Request("POST", "//")
+    )
+    await invalidation_log.start()
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["image_url"] is None
+
+    # The job worker is another process, with a response cache of its own
+    worker_cache = MemoryCache(max_entries=10, ttl_seconds=60)
+    mocker.patch("main.tasks.invalidation_log", InvalidationLog(db, worker_cache, 60))
+    await generate_and_add_to_post(
+        confirmed_user["email"], created_post["id"], "/post/1", db, "A dog"
+    )
+    await invalidation_log.poll()
+
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["image_url"] == json_data["output_url"]
+    await invalidation_log.stop()
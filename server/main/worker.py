@@ -0,0 +1,36 @@
+import asyncio
+import logging
+import signal
+
+from main import db_pool, http_clients, images
+from main.config import config
+from main.database import database
+from main.email_batcher import email_batcher
+from main.jobs import Worker
+from main.logging_conf import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    """Run background jobs outside the web process: python -m main.worker"""
+    configure_logging()
+    await db_pool.connect(database)
+    await http_clients.start()
+
+    worker = Worker(database, poll_interval=config.JOB_POLL_INTERVAL_SECONDS)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        await email_batcher.flush_all()
+        images.shutdown()
+        await http_clients.close()
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())